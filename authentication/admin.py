@@ -149,6 +149,9 @@ class CustomUserAdmin(UserAdmin):
         "wallet_balance",
         "wallet_balance_usd",
         "is_wholesale",
+        "total_orders",
+        "total_orders_price",
+        "last_order_date",
     )
     list_display = (
         "email",
@@ -196,6 +199,10 @@ class CustomUserAdmin(UserAdmin):
                 )
             },
         ),
+        (
+            "Orders",
+            {"fields": ("total_orders", "total_orders_price", "last_order_date")},
+        ),
         (
             "Permissions",
             {
@@ -4,6 +4,25 @@ from django_filters import rest_framework as rest_framework_filters
 
 
 class UserFilter(rest_framework_filters.FilterSet):
+    total_orders_min = rest_framework_filters.NumberFilter(
+        field_name="total_orders", lookup_expr="gte"
+    )
+    total_orders_max = rest_framework_filters.NumberFilter(
+        field_name="total_orders", lookup_expr="lte"
+    )
+    total_orders_price_min = rest_framework_filters.NumberFilter(
+        field_name="total_orders_price", lookup_expr="gte"
+    )
+    total_orders_price_max = rest_framework_filters.NumberFilter(
+        field_name="total_orders_price", lookup_expr="lte"
+    )
+    last_order_date_after = rest_framework_filters.IsoDateTimeFilter(
+        field_name="last_order_date", lookup_expr="gte"
+    )
+    last_order_date_before = rest_framework_filters.IsoDateTimeFilter(
+        field_name="last_order_date", lookup_expr="lte"
+    )
+
     class Meta:
         model = get_user_model()
         fields = [
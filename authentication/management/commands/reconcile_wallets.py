@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from authentication.models import Transaction
+
+
+class Command(BaseCommand):
+    help = "Recompute the wallet balances of the users from the transactions ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the drifted balances.",
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        with transaction.atomic():
+            ledger = dict(
+                Transaction.wallet_entries()
+                .order_by()
+                .values_list("user")
+                .annotate(balance=Sum("amount"))
+            )
+            drifted = []
+            for user in (
+                User.objects.select_for_update()
+                .filter(Q(pk__in=ledger) | ~Q(wallet_balance=0))
+                .only("id", "email", "wallet_balance")
+            ):
+                balance = ledger.get(user.pk, 0)
+                if user.wallet_balance != balance:
+                    self.stdout.write(
+                        f"{user.email}: {user.wallet_balance} -> {balance}"
+                    )
+                    user.wallet_balance = balance
+                    drifted.append(user)
+            if not options["dry_run"]:
+                User.objects.bulk_update(drifted, ["wallet_balance"], batch_size=500)
+
+        action = "Found" if options["dry_run"] else "Reconciled"
+        self.stdout.write(
+            self.style.SUCCESS(f"{action} {len(drifted)} drifted wallet balances.")
+        )
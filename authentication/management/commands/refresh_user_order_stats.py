@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Recompute the order aggregates (count, total price, last order date) of the users."
+
+    def add_arguments(self, parser):
+        parser.add_argument("user_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        updated = get_user_model().refresh_order_stats(options["user_ids"] or None)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {updated} users."))
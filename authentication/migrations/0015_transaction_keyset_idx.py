@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ("authentication", "0014_user_is_deleted"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="transaction",
+            index=models.Index(fields=["-created", "-id"], name="auth_transaction_keyset_idx"),
+        ),
+    ]
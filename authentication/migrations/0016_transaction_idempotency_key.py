@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0015_transaction_keyset_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="idempotency_key",
+            field=models.CharField(
+                blank=True, editable=False, max_length=100, null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_stats(apps, schema_editor):
+    User = apps.get_model("authentication", "User")
+    Order = apps.get_model("orders", "Order")
+    orders = (
+        Order.objects.filter(created_by=OuterRef("pk"))
+        .order_by()
+        .values("created_by")
+    )
+    User.objects.update(
+        total_orders=Coalesce(
+            Subquery(orders.annotate(count=Count("pk")).values("count")), 0
+        ),
+        total_orders_price=Coalesce(
+            Subquery(orders.annotate(price=Sum("total_price")).values("price")),
+            Value(0, output_field=models.DecimalField()),
+        ),
+        last_order_date=Subquery(orders.annotate(last=Max("created")).values("last")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0016_transaction_idempotency_key"),
+        ("orders", "0044_order_orderline_keyset_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="total_orders",
+            field=models.PositiveIntegerField(
+                db_index=True, default=0, editable=False, verbose_name="Total Orders"
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="total_orders_price",
+            field=models.DecimalField(
+                db_index=True,
+                decimal_places=0,
+                default=0,
+                editable=False,
+                max_digits=26,
+                verbose_name="Total Orders Price",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="last_order_date",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                null=True,
+                verbose_name="Last Order Date",
+            ),
+        ),
+        migrations.RunPython(fill_order_stats, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,17 @@
+from collections import defaultdict
+
 from constance import config
 from crum import get_current_user
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.apps import apps
 
 from django_lifecycle import (
-    AFTER_SAVE,
+    AFTER_CREATE,
     AFTER_UPDATE,
     BEFORE_DELETE,
     LifecycleModelMixin,
@@ -102,9 +106,12 @@ class User(AbstractUser, TimeStampedModel, UserStampedModel):
     )
     is_wholesale = property(lambda self: self.wholesale_type is not None)
 
+    # only ever changed by the wallet ledger (see Transaction.apply_to_wallet),
+    # a full save never writes it
     wallet_balance = models.DecimalField(
         "Wallet Balance", max_digits=26, decimal_places=0, default=0
     )
+    LEDGER_FIELDS = ("wallet_balance",)
     wallet_balance_usd = property(
         lambda self: (
             round(self.wallet_balance / config.USD_TO_IQD_EXCHANGE_RATE, 2)
@@ -114,6 +121,24 @@ class User(AbstractUser, TimeStampedModel, UserStampedModel):
     )
     hidden = models.BooleanField("Hidden", default=False)
     is_deleted = models.BooleanField("Deleted", default=False)
+
+    # aggregates of the orders created by the user, only ever changed by the
+    # orders (see Order.add_to_user_order_stats), a full save never writes them
+    total_orders = models.PositiveIntegerField(
+        "Total Orders", default=0, editable=False, db_index=True
+    )
+    total_orders_price = models.DecimalField(
+        "Total Orders Price",
+        max_digits=26,
+        decimal_places=0,
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    last_order_date = models.DateTimeField(
+        "Last Order Date", null=True, blank=True, editable=False, db_index=True
+    )
+    ORDER_STATS_FIELDS = ("total_orders", "total_orders_price", "last_order_date")
     
     @property
     def role(self):
@@ -123,30 +148,67 @@ class User(AbstractUser, TimeStampedModel, UserStampedModel):
             return "Wholesale"
         return "Customer"
 
-    @property
-    def total_orders(self):
-        Orders = apps.get_model("orders", "Order")
-        return Orders.objects.filter(created_by=self).count()
-
-    @property
-    def total_orders_price(self):
-        Orders = apps.get_model("orders", "Order")
-        all_orders = Orders.objects.filter(created_by=self)
-        return sum([order.total_price for order in all_orders])
-    
-    @property
-    def last_order_date(self):
-        Orders = apps.get_model("orders", "Order")
-        all_orders = Orders.objects.filter(created_by=self)
-        if all_orders:
-            return all_orders.last().created
-        return None
-    
     @property
     def id(self):
         return self.pk
 
+    @classmethod
+    def add_order_stats(cls, user_id, orders=1, price=0, order_date=None):
+        """
+        Add `orders` orders worth `price` to the order aggregates of the user
+        in one UPDATE, the counters are incremented in the database so
+        concurrent orders of the same user do not overwrite each other.
+        """
+        values = {
+            "total_orders": models.F("total_orders") + orders,
+            "total_orders_price": models.F("total_orders_price") + price,
+        }
+        if order_date is not None:
+            values["last_order_date"] = Greatest(
+                Coalesce("last_order_date", Value(order_date)), Value(order_date)
+            )
+        cls.objects.filter(pk=user_id).update(**values)
+
+    @classmethod
+    def refresh_order_stats(cls, user_ids=None):
+        """
+        Recompute the order aggregates of the given users (all when None) from
+        their orders in one UPDATE, returns the number of updated users.
+        """
+        Order = apps.get_model("orders", "Order")
+        orders = (
+            Order.objects.filter(created_by=models.OuterRef("pk"))
+            .order_by()
+            .values("created_by")
+        )
+        users = cls.objects.all()
+        if user_ids is not None:
+            users = users.filter(pk__in=user_ids)
+        return users.update(
+            total_orders=Coalesce(
+                models.Subquery(orders.annotate(count=Count("pk")).values("count")),
+                0,
+            ),
+            total_orders_price=Coalesce(
+                models.Subquery(
+                    orders.annotate(price=Sum("total_price")).values("price")
+                ),
+                Value(0, output_field=models.DecimalField()),
+            ),
+            last_order_date=models.Subquery(
+                orders.annotate(last=Max("created")).values("last")
+            ),
+        )
+
     def save(self, force_insert=False, force_update=False, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.LEDGER_FIELDS
+                and field.name not in self.ORDER_STATS_FIELDS
+            ]
         super().save(force_insert, force_update, *args, **kwargs)
 
     def __str__(self):
@@ -163,22 +225,24 @@ class WholesaleUserType(LifecycleModelMixin, TimeStampedModel, UserStampedModel)
         "Negative Limit", max_digits=26, decimal_places=0
     )
 
-    @hook(AFTER_SAVE)
+    @hook(AFTER_CREATE)
     def create_product_wholesale_pricing(self):
-        for product in apps.get_model("products", "Product").objects.all():
-            # only create if not exists
-            if not product.wholesale_pricings.filter(wholesale_user_type=self).exists():
-                apps.get_model("products", "ProductWholesalePricing").objects.create(
-                    product=product,
-                    wholesale_user_type=self,
-                    price=product.price,
-                )
+        apps.get_model("products", "ProductWholesalePricing").create_missing(
+            wholesale_user_type_id=self.pk
+        )
 
     def __str__(self):
         return f"Wholesale Type: {self.title}"
 
 
 class Transaction(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-created", "-id"], name="auth_transaction_keyset_idx"
+            ),
+        ]
+
     TRANSACTION_TYPE = Choices(
         ("deposit", "ايداع"),
         ("order", "طلب"),
@@ -198,6 +262,11 @@ class Transaction(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         related_name="related_transactions",
         related_query_name="related_transaction",
     )
+    # set by the automatic transactions (wallet payment, cashback) so they are
+    # recorded once per order even when the order is approved twice
+    idempotency_key = models.CharField(
+        max_length=100, unique=True, null=True, blank=True, editable=False
+    )
     
     @property
     def username(self):
@@ -209,14 +278,122 @@ class Transaction(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
             return 0
         return round(self.amount / config.USD_TO_IQD_EXCHANGE_RATE, 2)
 
-    @hook(AFTER_SAVE)
-    def update_wallet_balance(self):
-        # if self.user.wholesale_type:
-        if self.transaction_type == self.TRANSACTION_TYPE.deposit:
-            self.user.wallet_balance += self.amount
-        elif self.transaction_type == self.TRANSACTION_TYPE.order and self.amount < 0:
-            self.user.wallet_balance += self.amount
-        self.user.save()
+    @property
+    def affects_wallet(self):
+        return self.transaction_type == self.TRANSACTION_TYPE.deposit or (
+            self.transaction_type == self.TRANSACTION_TYPE.order and self.amount < 0
+        )
+
+    @classmethod
+    def wallet_entries(cls):
+        """
+        The transactions that make up the wallet balances.
+        """
+        return cls.objects.filter(
+            models.Q(transaction_type=cls.TRANSACTION_TYPE.deposit)
+            | models.Q(transaction_type=cls.TRANSACTION_TYPE.order, amount__lt=0)
+        )
+
+    @classmethod
+    def record(cls, idempotency_key=None, **fields):
+        """
+        Append a transaction to the ledger, the wallet balance is updated in the
+        same database transaction.
+
+        With an `idempotency_key` the transaction is recorded only once: the
+        existing one is returned instead. Returns `(transaction, created)`.
+        """
+        if idempotency_key:
+            existing = cls.objects.filter(idempotency_key=idempotency_key).first()
+            if existing:
+                return existing, False
+        try:
+            with transaction.atomic():
+                entry = cls.objects.create(idempotency_key=idempotency_key, **fields)
+            return entry, True
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # recorded by a concurrent request in the meantime
+            return cls.objects.get(idempotency_key=idempotency_key), False
+
+    @classmethod
+    def record_many(cls, entries):
+        """
+        Append the unsaved `entries` to the ledger with one bulk insert and add
+        their amounts to the wallet balances with one UPDATE, in the current
+        database transaction. The entries whose `idempotency_key` is already
+        recorded are skipped. Returns the recorded entries.
+        """
+        keys = [entry.idempotency_key for entry in entries if entry.idempotency_key]
+        recorded = set(
+            cls.objects.filter(idempotency_key__in=keys).values_list(
+                "idempotency_key", flat=True
+            )
+        )
+        entries = [
+            entry
+            for entry in entries
+            if not entry.idempotency_key or entry.idempotency_key not in recorded
+        ]
+        if not entries:
+            return []
+        balances = defaultdict(int)
+        for entry in entries:
+            if entry.affects_wallet:
+                balances[entry.user_id] += entry.amount
+        with transaction.atomic():
+            cls.objects.bulk_create(entries)
+            if balances:
+                table = connection.ops.quote_name(User._meta.db_table)
+                values = ", ".join(["(%s::bigint, %s::numeric)"] * len(balances))
+                params = [
+                    value
+                    for user_id in sorted(balances)
+                    for value in (user_id, balances[user_id])
+                ]
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        UPDATE {table} AS wallet
+                        SET wallet_balance = wallet.wallet_balance + entry.amount
+                        FROM (VALUES {values}) AS entry (user_id, amount)
+                        WHERE wallet.id = entry.user_id
+                        """,
+                        params,
+                    )
+        return entries
+
+    @hook(AFTER_CREATE)
+    def apply_to_wallet(self):
+        """
+        Add the amount to the wallet balance with one
+        `UPDATE ... SET wallet_balance = wallet_balance + amount`, which locks
+        the user row until the transaction commits, so concurrent payments and
+        cashbacks never lose an update. The transactions are append only:
+        editing one later does not touch the balance.
+        """
+        if not self.affects_wallet:
+            return
+        table = connection.ops.quote_name(User._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET wallet_balance = wallet_balance + %s
+                WHERE id = %s
+                RETURNING wallet_balance
+                """,
+                [self.amount, self.user_id],
+            )
+            row = cursor.fetchone()
+        if row and Transaction.user.is_cached(self):
+            self.user.wallet_balance = row[0]
+
+    def save(self, *args, **kwargs):
+        # the transaction and its balance update are committed together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Transaction: {self.user.email} - {self.amount}"
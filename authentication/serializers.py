@@ -4,6 +4,8 @@ from rest_framework import serializers
 from django.db import transaction
 
 
+from core.utils import NoUpdateMixin
+
 from .forms import CustomResetPasswordForm
 from .models import Transaction, WholesaleUserType
 
@@ -78,6 +80,9 @@ class CustomUserDetailsSerializer(UserDetailsSerializer):
             "wallet_balance_usd",
             "is_staff",
             "is_superuser",
+            "total_orders",
+            "total_orders_price",
+            "last_order_date",
             "created",
         )
         
@@ -107,6 +112,34 @@ class CustomUserDetailsSerializer(UserDetailsSerializer):
         return {"stats": "Users deactivated successfully."}
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """
+    Compact user representation embedded in other objects (orders, lines...),
+    it only reads the user row so it never runs extra queries per user.
+    """
+
+    is_wholesale = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserModel
+        fields = (
+            "id",
+            "username",
+            "email",
+            "first_name",
+            "last_name",
+            "phone",
+            "country",
+            "city",
+            "is_wholesale",
+            "wholesale_type",
+        )
+        read_only_fields = fields
+
+    def get_is_wholesale(self, obj):
+        return obj.wholesale_type_id is not None
+
+
 class CustomPasswordResetSerializer(PasswordResetSerializer):
     @property
     def password_reset_form_class(self):
@@ -133,7 +166,7 @@ class TransactionSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "created", "modified", "related_order")
 
 
-class TransactionAdminSerializer(serializers.ModelSerializer):
+class TransactionAdminSerializer(NoUpdateMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = (
@@ -149,6 +182,8 @@ class TransactionAdminSerializer(serializers.ModelSerializer):
             "modified",
         )
         read_only_fields = ("id", "created", "modified", "related_order")
+        # the ledger is append only, the balance was applied on creation
+        no_update_fields = ("transaction_type", "user", "amount")
 
 
 class WholesaleUserTypeSerializer(serializers.ModelSerializer):
@@ -163,3 +198,16 @@ class WholesaleUserTypeSerializer(serializers.ModelSerializer):
             "created",
             "modified",
         )
+
+
+class WholesaleRepriceSerializer(serializers.Serializer):
+    discount_percent = serializers.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        min_value=-100,
+        max_value=100,
+        help_text="Discount from the list price, negative for a markup",
+    )
+    category = serializers.IntegerField(required=False)
+    sub_category = serializers.IntegerField(required=False)
+    company = serializers.IntegerField(required=False)
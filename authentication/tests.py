@@ -0,0 +1,97 @@
+import threading
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TransactionTestCase
+
+from authentication.models import Transaction, User
+
+
+class WalletLedgerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="wallet", email="wallet@example.com")
+
+    def ledger_balance(self):
+        return (
+            Transaction.wallet_entries()
+            .filter(user=self.user)
+            .aggregate(balance=Sum("amount"))["balance"]
+            or 0
+        )
+
+    def assert_balance(self, expected):
+        self.user.refresh_from_db(fields=["wallet_balance"])
+        self.assertEqual(self.user.wallet_balance, expected)
+        self.assertEqual(self.ledger_balance(), expected)
+
+    def test_concurrent_entries_keep_the_balance_equal_to_the_ledger(self):
+        threads_count, operations = 4, 10
+        errors = []
+
+        def worker():
+            try:
+                for operation in range(operations):
+                    Transaction.record(
+                        transaction_type=Transaction.TRANSACTION_TYPE.deposit,
+                        user_id=self.user.pk,
+                        amount=Decimal(1000),
+                        description="deposit",
+                    )
+                    Transaction.record(
+                        transaction_type=Transaction.TRANSACTION_TYPE.order,
+                        user_id=self.user.pk,
+                        amount=Decimal(-250),
+                        description="payment",
+                    )
+                    # every thread races on the same cashback keys
+                    Transaction.record(
+                        idempotency_key=f"wallet:{self.user.pk}:cashback:{operation}",
+                        transaction_type=Transaction.TRANSACTION_TYPE.deposit,
+                        user_id=self.user.pk,
+                        amount=Decimal(10),
+                        description="cashback",
+                    )
+            except Exception as error:  # noqa: BLE001 - reported by the test
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assert_balance(threads_count * operations * (1000 - 250) + operations * 10)
+
+    def test_replayed_idempotency_key_is_applied_once(self):
+        fields = {
+            "transaction_type": Transaction.TRANSACTION_TYPE.deposit,
+            "user": self.user,
+            "amount": Decimal(500),
+            "description": "cashback",
+        }
+        entry, created = Transaction.record(
+            idempotency_key="order:1:cashback", **fields
+        )
+        self.assertTrue(created)
+        replayed, created = Transaction.record(
+            idempotency_key="order:1:cashback", **fields
+        )
+        self.assertFalse(created)
+        self.assertEqual(replayed.pk, entry.pk)
+
+        with transaction.atomic():
+            recorded = Transaction.record_many(
+                [
+                    Transaction(idempotency_key="order:1:cashback", **fields),
+                    Transaction(idempotency_key="order:2:cashback", **fields),
+                ]
+            )
+        self.assertEqual(
+            [entry.idempotency_key for entry in recorded], ["order:2:cashback"]
+        )
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        self.assert_balance(1000)
@@ -1,6 +1,7 @@
 from constance import config
 from dal import autocomplete
 from dj_rest_auth.views import UserDetailsView
+from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
@@ -21,10 +22,12 @@ from authentication.serializers import (
     CustomUserDetailsSerializer,
     TransactionAdminSerializer,
     TransactionSerializer,
+    WholesaleRepriceSerializer,
     WholesaleUserTypeSerializer,
 )
 from authentication.stats import TransactionStats, UserStats
-from core.utils import StandardLimitOffsetPagination
+from core.export import StreamingExportMixin
+from core.utils import StandardKeysetPagination, StandardLimitOffsetPagination
 from django.db.models import Sum, F, Case, When, Count, DecimalField, CharField, Value
 from django.db.models.functions import TruncDate
 from rest_framework.response import Response
@@ -477,10 +480,10 @@ class TransactionViews(viewsets.ModelViewSet):
         ],
     ),
 )
-class TransactionAdminViews(viewsets.ModelViewSet):
+class TransactionAdminViews(StreamingExportMixin, viewsets.ModelViewSet):
     serializer_class = TransactionAdminSerializer
     permission_classes = [permissions.IsAdminUser]
-    pagination_class = StandardLimitOffsetPagination
+    pagination_class = StandardKeysetPagination
     queryset = Transaction.objects.all()
     filter_backends = [
         filters.SearchFilter,
@@ -497,6 +500,17 @@ class TransactionAdminViews(viewsets.ModelViewSet):
     ]
     filterset_class = TransactionAdminFilter
     ordering_fields = "__all__"
+    export_filename = "transactions"
+    export_fields = (
+        ("ID", "id"),
+        ("Created", "created"),
+        ("User", "user__username"),
+        ("Email", "user__email"),
+        ("Type", "transaction_type"),
+        ("Amount", "amount"),
+        ("Description", "description"),
+        ("Order Number", "related_order__order_number"),
+    )
 
     @swagger_auto_schema(
         operation_description="Get stats for transactions",
@@ -632,3 +646,28 @@ class WholesaleUserTypeViewSet(viewsets.ModelViewSet):
         "title",
     ]
     ordering_fields = "__all__"
+
+    @swagger_auto_schema(
+        operation_description="Set the prices of the wholesale type to the list price minus a percentage, for all the products or those of a category, sub category or company",
+        request_body=WholesaleRepriceSerializer,
+        responses={200: "Number of updated prices"},
+    )
+    @action(detail=True, methods=["post"])
+    def reprice(self, request, pk=None):
+        instance = self.get_object()
+        serializer = WholesaleRepriceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        products = None
+        scope = {
+            f"{field}_id": data[field]
+            for field in ("category", "sub_category", "company")
+            if field in data
+        }
+        if scope:
+            products = apps.get_model("products", "Product").objects.filter(**scope)
+        updated = apps.get_model("products", "ProductWholesalePricing").reprice(
+            instance.pk, data["discount_percent"], products=products
+        )
+        return Response({"updated": updated})
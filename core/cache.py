@@ -0,0 +1,134 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_catalog_version():
+    """
+    Version of the public catalog, it is the time (in ms) of its last change so
+    it keeps increasing even when the cache is flushed.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidate all the cached catalog responses once the current transaction
+    commits, so no request can cache the data of the uncommitted change.
+    """
+
+    def bump():
+        version = cache.get(CATALOG_VERSION_KEY) or 0
+        cache.set(
+            CATALOG_VERSION_KEY, max(int(time.time() * 1000), version + 1), None
+        )
+
+    transaction.on_commit(bump)
+
+
+class CatalogCacheMixin:
+    """
+    Cache the read responses of a catalog viewset.
+
+    The responses are cached per action, url kwargs, query params and user
+    audience (anonymous, retail, wholesale tier or staff) under the current
+    catalog version, so any catalog change invalidates all of them at once.
+    The key stock counters do not bump the version on every key reserved or
+    released, only on stock band changes, so the responses are also renewed
+    every `catalog_cache_timeout` seconds to bound how much they lag.
+    The responses carry an ETag and Last-Modified derived from the version and
+    conditional requests get a 304 without touching the database.
+    """
+
+    catalog_cache_actions = ("list", "retrieve")
+    catalog_cache_timeout = 60 * 10
+
+    def get_cache_audience(self):
+        user = self.request.user
+        if not user or not user.is_authenticated:
+            return "anonymous"
+        if user.is_staff:
+            return "staff"
+        if user.wholesale_type_id is not None:
+            return f"wholesale:{user.wholesale_type_id}"
+        return "retail"
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return handler(request, *args, **kwargs)
+
+        version = get_catalog_version()
+        window = int(time.time()) // self.catalog_cache_timeout
+        params = sorted(
+            (key, value)
+            for key in request.query_params
+            for value in request.query_params.getlist(key)
+        )
+        signature = hashlib.md5(
+            json.dumps(
+                [
+                    version,
+                    window,
+                    self.__class__.__name__,
+                    self.action,
+                    kwargs,
+                    params,
+                    self.get_cache_audience(),
+                ],
+                default=str,
+            ).encode()
+        ).hexdigest()
+        etag = f'"{signature}"'
+        last_modified = max(version // 1000, window * self.catalog_cache_timeout)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(last_modified),
+            "Cache-Control": "private, max-age=0, must-revalidate",
+            "Vary": "Authorization, Cookie",
+        }
+
+        if_none_match = request.headers.get("If-None-Match")
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        if (if_none_match and etag in if_none_match) or (
+            not if_none_match
+            and if_modified_since
+            and if_modified_since >= last_modified
+        ):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        cache_key = f"catalog:response:{signature}"
+        data = cache.get(cache_key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            # store plain json data, the serializer data keeps references to
+            # the serializers which can not be pickled
+            data = json.loads(JSONRenderer().render(response.data))
+            cache.set(cache_key, data, self.catalog_cache_timeout)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        if "list" not in self.catalog_cache_actions:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if "retrieve" not in self.catalog_cache_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -103,6 +103,8 @@ MIDDLEWARE = [
 
 CRON_CLASSES = [
     "orders.cron.CancelOrdersNotPaid",
+    "orders.cron.SendOrderEmails",
+    "orders.cron.InitiateQueuedPayments",
 ]
 
 DJANGO_CRON_DELETE_LOGS_OLDER_THAN = 15
@@ -134,6 +136,16 @@ DATABASES = {
     "default": env.db(),
 }
 
+# Cache
+# The cache must be shared by all the workers and the cron process: it holds
+# the catalog version, the cached catalog responses and the FIB token. The
+# database cache needs `createcachetable`, set CACHE_URL (e.g. redis://...) to
+# use another shared backend.
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default="dbcache://django_cache"),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -296,6 +308,15 @@ FIB_CREATE_PAYMENT_URL = env("FIB_CREATE_PAYMENT_URL")
 FIB_REDIRECT_URL = env("FIB_REDIRECT_URL")
 FIB_PAYMENT_STATUS_URL = env("FIB_PAYMENT_STATUS_URL")
 
+# payment gateways http clients (see orders/gateways.py)
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = env.float("PAYMENT_GATEWAY_CONNECT_TIMEOUT", default=3.05)
+PAYMENT_GATEWAY_READ_TIMEOUT = env.float("PAYMENT_GATEWAY_READ_TIMEOUT", default=20)
+PAYMENT_GATEWAY_RETRIES = env.int("PAYMENT_GATEWAY_RETRIES", default=2)
+PAYMENT_GATEWAY_POOL_SIZE = env.int("PAYMENT_GATEWAY_POOL_SIZE", default=10)
+# initiate the gateway payments in the `initiate_payments` worker after the
+# checkout commits instead of inside the checkout transaction
+ASYNC_PAYMENT_INITIATION = env.bool("ASYNC_PAYMENT_INITIATION", default=False)
+
 # SECURE_SSL_REDIRECT = True
 # SESSION_COOKIE_SECURE = True
 # CSRF_COOKIE_SECURE = True
@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from core.cache import get_catalog_version
+from orders.models import Order
+from products.models import Category
+
+
+class CatalogVersionTests(TransactionTestCase):
+    def run_in_another_process(self, code):
+        database = connection.settings_dict
+        env = {
+            **os.environ,
+            "DATABASE_URL": (
+                f"postgres://{database['USER']}:{database['PASSWORD']}"
+                f"@{database['HOST']}:{database['PORT']}/{database['NAME']}"
+            ),
+        }
+        subprocess.run(
+            [sys.executable, "manage.py", "shell", "-c", code],
+            cwd=settings.BASE_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+
+    def test_save_in_another_process_bumps_the_version(self):
+        version = get_catalog_version()
+        self.run_in_another_process(
+            "from products.models import Category; "
+            "Category.objects.create(name='Games', name_ar='Games')"
+        )
+        self.assertEqual(Category.objects.count(), 1)
+        self.assertGreater(get_catalog_version(), version)
+
+
+class CatalogConditionalRequestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("products:category-list")
+        Category.objects.create(name="Games", name_ar="Games")
+
+    def test_matching_etag_gets_a_304_until_the_catalog_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Cards", name_ar="Cards")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create(username="staff", is_staff=True)
+        )
+        self.url = reverse("orders:order-list")
+        Order.objects.bulk_create([Order() for _ in range(7)])
+        # rows sharing the same `created` are ordered by id
+        created = timezone.now()
+        Order.objects.filter(pk__in=Order.objects.order_by("pk")[:5]).update(
+            created=created
+        )
+        Order.objects.exclude(created=created).update(
+            created=created - timedelta(days=1)
+        )
+        self.newest_first = list(
+            Order.objects.order_by("-created", "-pk").values_list("pk", flat=True)
+        )
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [order["id"] for order in response.data["results"]], response.data
+
+    def test_next_and_previous_links_walk_every_row_once(self):
+        pages = []
+        url = f"{self.url}?cursor=&page_size=2"
+        while url:
+            ids, data = self.page(url)
+            pages.append(ids)
+            url = data["next"]
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(sum(pages, []), self.newest_first)
+        self.assertIsNone(data["next"])
+
+        # back from the last page
+        previous_pages = [pages[-1]]
+        url = data["previous"]
+        while url:
+            ids, data = self.page(url)
+            previous_pages.insert(0, ids)
+            url = data["previous"]
+        self.assertEqual(previous_pages, pages)
+
+    def test_ordering_is_rejected_with_a_cursor(self):
+        response = self.client.get(self.url, {"cursor": "", "ordering": "created"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ordering", response.data)
+        response = self.client.get(self.url, {"ordering": "created"})
+        self.assertEqual(response.status_code, 200)
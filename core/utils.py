@@ -1,17 +1,28 @@
+import base64
 import io
+import json
 import os
 import uuid
+import zlib
+from contextlib import contextmanager
 
 import filetype
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.paginator import Paginator
+from django.db import connection, connections, models
 from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from drf_extra_fields.fields import Base64ImageField
 from drf_yasg import openapi
 from rest_framework import serializers
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PublishedManager(models.Manager):
@@ -68,12 +79,274 @@ class Base64ImageField(Base64ImageField):
         return "jpg" if extension == "jpeg" else extension
 
 
+@contextmanager
+def advisory_lock(name: str):
+    """
+    Hold a postgres session advisory lock named `name` for the duration of the
+    block, yields False without waiting when another session holds it.
+    Other databases have no advisory locks and always get True.
+    """
+    if connection.vendor != "postgresql":
+        yield True
+        return
+    key = zlib.crc32(name.encode())
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [key])
+
+
 class StandardLimitOffsetPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = "page_size"
     max_page_size = 100
 
 
+def approximate_count(queryset, exact_below=10000):
+    """
+    Row count of `queryset` from the postgres planner estimate, which costs no
+    scan. Small results are counted exactly as the estimate is rough there.
+    """
+    db = connections[queryset.db]
+    if db.vendor != "postgresql":
+        return queryset.count()
+    sql, params = queryset.order_by().values("pk").query.sql_with_params()
+    with db.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+    if estimate < exact_below:
+        return queryset.count()
+    return estimate
+
+
+class ApproximateCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return approximate_count(self.object_list)
+
+
+class KeysetPagination:
+    """
+    Keyset pagination over (`created`, `id`), newest first.
+
+    Every page is read with `WHERE (created, id) < (last created, last id)`
+    from an index instead of an OFFSET scan, so deep pages cost the same as
+    the first one and rows inserted meanwhile do not shift the pages. The
+    count is only given with `count=approximate` (planner estimate). The order
+    is fixed, asking for another one with `ordering` is rejected.
+    """
+
+    page_size = 25
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    ordering_query_param = "ordering"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, row, reverse):
+        data = {"c": row.created.isoformat(), "i": row.pk}
+        if reverse:
+            data["r"] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """
+        Return the (created, id) position and direction of the cursor, the
+        position is None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            created = parse_datetime(data["c"])
+            pk = int(data["i"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (created, pk), bool(data.get("r"))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.ordering_query_param):
+            raise serializers.ValidationError(
+                {
+                    self.ordering_query_param: "The cursor pagination is always "
+                    "newest first, use the page numbers to order the results."
+                }
+            )
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == "approximate":
+            self.count = approximate_count(queryset)
+
+        if reverse:
+            queryset = queryset.order_by("created", "pk")
+            if position:
+                created, pk = position
+                queryset = queryset.filter(
+                    Q(created__gt=created) | Q(created=created, pk__gt=pk)
+                )
+        else:
+            queryset = queryset.order_by("-created", "-pk")
+            if position:
+                created, pk = position
+                queryset = queryset.filter(
+                    Q(created__lt=created) | Q(created=created, pk__lt=pk)
+                )
+
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_link = None
+        self.previous_link = None
+        if rows and has_next:
+            self.next_link = self.encode_cursor(rows[-1], reverse=False)
+        if rows and has_previous:
+            self.previous_link = self.encode_cursor(rows[0], reverse=True)
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.next_link,
+            "previous": self.previous_link,
+            "results": data,
+        }
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+
+class StandardKeysetPagination(StandardLimitOffsetPagination):
+    """
+    Page number pagination that switches to `KeysetPagination` when the request
+    passes `cursor` (empty for the first page), for the big tables that are
+    browsed with infinite scroll. `count=approximate` replaces the exact
+    `COUNT(*)` with the planner estimate in both modes.
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        keyset_class = self.keyset_pagination_class
+        if keyset_class.cursor_query_param in request.query_params:
+            self.keyset = keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        if request.query_params.get(keyset_class.count_query_param) == "approximate":
+            self.django_paginator_class = ApproximateCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, "coreapi must be installed"
+        assert coreschema is not None, "coreschema must be installed"
+        return super().get_schema_fields(view) + [
+            coreapi.Field(
+                name=KeysetPagination.cursor_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.String(
+                    title="Cursor",
+                    description="Pass it empty to paginate newest first by "
+                    "cursor instead of page numbers, then follow the `next` "
+                    "and `previous` links. It can not be combined with "
+                    "`ordering`.",
+                ),
+            ),
+            coreapi.Field(
+                name=KeysetPagination.count_query_param,
+                required=False,
+                location="query",
+                schema=coreschema.String(
+                    title="Count",
+                    description="`approximate` for an estimated count.",
+                ),
+            ),
+        ]
+
+
+def get_sparse_fieldsets(request):
+    """
+    The field names asked with `?fields=` and `?expand=` (comma separated).
+    """
+
+    def names(param):
+        value = request.query_params.get(param, "") if request else ""
+        return {name.strip() for name in value.split(",") if name.strip()}
+
+    return names("fields"), names("expand")
+
+
+class SparseFieldsetsMixin:
+    """
+    Sparse fieldsets of a serializer on read requests.
+
+    `?fields=id,name` keeps only the listed fields. In lists the heavy
+    `Meta.expandable_fields` are left out unless they are asked with
+    `?expand=` or listed in `fields`. Only the top level serializer is affected,
+    the nested ones keep their fields. `Meta.staff_only_fields` are dropped for
+    the non staff users on every request.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is not None and not request.user.is_staff:
+            for name in getattr(self.Meta, "staff_only_fields", ()):
+                fields.pop(name, None)
+        parent = self.parent
+        many = isinstance(parent, serializers.ListSerializer)
+        if many:
+            parent = parent.parent
+        if request is None or parent is not None or request.method != "GET":
+            return fields
+
+        only, expand = get_sparse_fieldsets(request)
+        if many:
+            for name in getattr(self.Meta, "expandable_fields", ()):
+                if name not in expand and name not in only:
+                    fields.pop(name, None)
+        if only:
+            for name in list(fields):
+                if name not in only:
+                    fields.pop(name)
+        return fields
+
+
 class NoUpdateMixin(serializers.ModelSerializer):
     def get_extra_kwargs(self):
         kwargs = super().get_extra_kwargs()
@@ -21,6 +21,13 @@ if ! python manage.py migrate; then
     exit 1
 fi
 
+# Create the table of the database cache (does nothing when it exists)
+echo "Creating the cache table..."
+if ! python manage.py createcachetable; then
+    echo "Failed to create the cache table" >&2
+    exit 1
+fi
+
 # Collect static files
 echo "Collecting static files..."
 if ! python manage.py collectstatic --noinput; then
@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ("notifications", "0005_rename_related_object_content_type_notification_content_type_and_more"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="notification",
+            index=models.Index(fields=["-created", "-id"], name="notification_keyset_idx"),
+        ),
+    ]
@@ -9,6 +9,10 @@ from authentication.models import UserStampedModel
 
 
 class Notification(UserStampedModel, TimeStampedModel):
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created", "-id"], name="notification_keyset_idx"),
+        ]
 
     NOTIFICATION_LEVELS = Choices(
         ("important", "Important"),
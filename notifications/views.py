@@ -8,7 +8,7 @@ from rest_framework.response import Response
 
 from rest_framework import filters, permissions, serializers, viewsets
 
-from core.utils import StandardLimitOffsetPagination
+from core.utils import StandardKeysetPagination
 from notifications.filters import NotificationFilter
 from notifications.models import Notification
 from notifications.serializers import NotificationSerializer
@@ -55,7 +55,7 @@ class NotificationViews(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAdminUser]
-    pagination_class = StandardLimitOffsetPagination
+    pagination_class = StandardKeysetPagination
     filter_backends = [
         filters.OrderingFilter,
         django_filters_rest_framework.DjangoFilterBackend,
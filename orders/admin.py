@@ -12,7 +12,7 @@ from rangefilter.filters import (
 )
 
 from authentication.models import Transaction
-from orders.models import Order, OrderLine, OrderLineKey, SupportTicket
+from orders.models import Order, OrderEmail, OrderLine, OrderLineKey, SupportTicket
 from products.models import Category, SubCategory
 
 
@@ -411,6 +411,41 @@ class CustomOrderAdmin(nested_admin.NestedModelAdmin):
             return HttpResponseRedirect(".")
         return super().response_change(request, obj)
 
+    actions = ("approve_orders", "reject_orders", "return_orders", "mark_orders_as_paid")
+
+    def bulk_transition(self, request, queryset, transition):
+        results = Order.bulk_transition(queryset, transition, request.user)
+        succeeded = [result for result in results if result["success"]]
+        failed = [result for result in results if not result["success"]]
+        if succeeded:
+            self.message_user(
+                request,
+                f"{Order.TRANSITIONS[transition]}: {len(succeeded)} orders.",
+                messages.SUCCESS,
+            )
+        for result in failed:
+            self.message_user(
+                request,
+                f"Order {result['order_number']}: {result['detail']}",
+                messages.WARNING,
+            )
+
+    @admin.action(description="Approve the selected orders")
+    def approve_orders(self, request, queryset):
+        self.bulk_transition(request, queryset, Order.TRANSITIONS.approve_order)
+
+    @admin.action(description="Reject the selected orders")
+    def reject_orders(self, request, queryset):
+        self.bulk_transition(request, queryset, Order.TRANSITIONS.reject_order)
+
+    @admin.action(description="Return the selected orders")
+    def return_orders(self, request, queryset):
+        self.bulk_transition(request, queryset, Order.TRANSITIONS.return_order)
+
+    @admin.action(description="Mark the selected orders as paid")
+    def mark_orders_as_paid(self, request, queryset):
+        self.bulk_transition(request, queryset, Order.TRANSITIONS.mark_as_paid)
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
 
@@ -428,6 +463,30 @@ class CustomOrderAdmin(nested_admin.NestedModelAdmin):
     inlines = [OrderLineInlineAdmin]
 
 
+@admin.register(OrderEmail)
+class OrderEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        "order",
+        "kind",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "sent_at",
+    )
+    list_filter = ("kind", "status")
+    search_fields = ("order__order_number",)
+    list_select_related = ("order",)
+    readonly_fields = (
+        "order",
+        "kind",
+        "attempts",
+        "last_error",
+        "sent_at",
+        "created",
+        "modified",
+    )
+
+
 @admin.register(SupportTicket)
 class SupportTicketCustomAdmin(admin.ModelAdmin):
     readonly_fields = (
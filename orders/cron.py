@@ -1,10 +1,7 @@
-from datetime import timedelta
-
-from django.db.models import Q
-from django.utils import timezone
 from django_cron import CronJobBase, Schedule
 
-from orders.models import Order
+from core.utils import advisory_lock
+from orders.models import Order, OrderEmail
 
 
 class CancelOrdersNotPaid(CronJobBase):
@@ -14,29 +11,45 @@ class CancelOrdersNotPaid(CronJobBase):
     code = "orders.cancel_orders_not_paid"
 
     def do(self):
-        count = 0
         # orders that have not been paid for 15 minutes will be canceled but the payment_method is not fib
-        orders = Order.objects.filter(
-            ~Q(payment_method=Order.PAYMENT_METHOD.fib),
-            payment_status=Order.PAYMENT_STATUS.pending,
-            created__lt=timezone.now() - timedelta(minutes=15),
-        )
-        for order in orders:
-            order.status = Order.STATUS.canceled
-            order.save()
+        # for fib orders we will check that it does not now > fib_payment_valid_until
+        with advisory_lock(self.code) as acquired:
+            if not acquired:
+                return "Another run is still canceling orders"
+            count = Order.cancel_expired()
 
-        count += orders.count()
+        return f"{count} orders have been canceled"
 
-        # for fib orders we will check that it does not now > fib_payment_valid_until
-        fib_orders = Order.objects.filter(
-            payment_method=Order.PAYMENT_METHOD.fib,
-            payment_status=Order.PAYMENT_STATUS.pending,
-            fib_payment_valid_until__lt=timezone.now(),
-        )
-        for order in fib_orders:
-            order.status = Order.STATUS.canceled
-            order.save()
-
-        count += fib_orders.count()
-
-        return f"{orders.count()} orders have been canceled"
+
+class SendOrderEmails(CronJobBase):
+    RUN_EVERY_MINS = 1
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = "orders.send_order_emails"
+
+    def do(self):
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = OrderEmail.send_batch()
+            if not (batch_sent or batch_failed):
+                break
+            sent += batch_sent
+            failed += batch_failed
+        return f"{sent} order emails have been sent, {failed} failed"
+
+
+class InitiateQueuedPayments(CronJobBase):
+    RUN_EVERY_MINS = 1
+
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = "orders.initiate_queued_payments"
+
+    def do(self):
+        ready = failed = 0
+        while True:
+            batch_ready, batch_failed = Order.initiate_queued_payments()
+            if not (batch_ready or batch_failed):
+                break
+            ready += batch_ready
+            failed += batch_failed
+        return f"{ready} payments have been initiated, {failed} failed"
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from rest_framework.exceptions import APIException
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(
+    lambda: {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+)
+
+
+def gateway_metrics():
+    """
+    Snapshot of the per provider latency metrics of this process.
+    """
+    with _metrics_lock:
+        return {
+            name: {
+                **stats,
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 2)
+                if stats["calls"]
+                else 0,
+            }
+            for name, stats in _metrics.items()
+        }
+
+
+def _record(name, elapsed_ms, error):
+    with _metrics_lock:
+        stats = _metrics[name]
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+class GatewayClient:
+    """
+    HTTP client of one payment provider.
+
+    Every provider keeps one pooled `requests.Session` per process so the
+    TCP and TLS connections are reused between payments. Calls get connect and
+    read timeouts, connection errors are retried for every method but read
+    errors and 5xx answers only for GET (a retried POST could pay twice).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    retries = settings.PAYMENT_GATEWAY_RETRIES
+                    retry = Retry(
+                        total=retries,
+                        connect=retries,
+                        read=retries,
+                        status=retries,
+                        allowed_methods=frozenset(["GET"]),
+                        status_forcelist=(502, 503, 504),
+                        backoff_factor=0.3,
+                        raise_on_status=False,
+                    )
+                    adapter = HTTPAdapter(
+                        pool_connections=4,
+                        pool_maxsize=settings.PAYMENT_GATEWAY_POOL_SIZE,
+                        max_retries=retry,
+                    )
+                    session = requests.Session()
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault(
+            "timeout",
+            (
+                settings.PAYMENT_GATEWAY_CONNECT_TIMEOUT,
+                settings.PAYMENT_GATEWAY_READ_TIMEOUT,
+            ),
+        )
+        start = time.perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            error = response.status_code >= 500
+            return response
+        except requests.RequestException as e:
+            logger.warning("%s %s %s failed: %s", self.name, method, url, e)
+            raise APIException(f"Can not connect to {self.name}", code=500)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _record(self.name, elapsed_ms, error)
+            logger.info("%s %s took %.1fms", self.name, method, elapsed_ms)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class FibClient(GatewayClient):
+    """
+    FIB client that reuses its OAuth `client_credentials` token until it expires,
+    the token is kept in the process and in the default cache, which is shared
+    by all the workers and the cron process (see `CACHES`).
+    """
+
+    TOKEN_CACHE_KEY = "orders:fib_access_token"
+    # renew the token a bit before FIB expires it
+    TOKEN_EXPIRY_MARGIN = 30
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._token = None
+        self._token_expires_at = 0
+
+    def access_token(self, force_refresh=False):
+        now = time.time()
+        if not force_refresh:
+            if self._token and self._token_expires_at > now:
+                return self._token
+            cached = cache.get(self.TOKEN_CACHE_KEY)
+            if cached and cached[1] > now:
+                self._token, self._token_expires_at = cached
+                return self._token
+
+        if not (
+            settings.FIB_AUTH_URL
+            or settings.FIB_CLIENT_ID
+            or settings.FIB_CLIENT_SECRET
+        ):
+            raise APIException("Can not connect to fib", code=500)
+        response = self.post(
+            settings.FIB_AUTH_URL,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": settings.FIB_CLIENT_ID,
+                "client_secret": settings.FIB_CLIENT_SECRET,
+            },
+        )
+        if response.status_code != 200:
+            raise APIException("Can not connect to fib", code=500)
+        response_data = response.json()
+        lifetime = max(
+            int(response_data.get("expires_in", 60)) - self.TOKEN_EXPIRY_MARGIN, 1
+        )
+        self._token = response_data["access_token"]
+        self._token_expires_at = now + lifetime
+        cache.set(
+            self.TOKEN_CACHE_KEY, (self._token, self._token_expires_at), lifetime
+        )
+        return self._token
+
+    def authorized_request(self, method, url, headers=None, **kwargs):
+        """
+        Call FIB with the cached token, renewing it once if FIB rejects it.
+        """
+        headers = dict(headers or {})
+        headers["Authorization"] = f"Bearer {self.access_token()}"
+        response = self.request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            headers["Authorization"] = f"Bearer {self.access_token(force_refresh=True)}"
+            response = self.request(method, url, headers=headers, **kwargs)
+        return response
+
+
+zain_cash = GatewayClient("zain cash")
+qi_card = GatewayClient("qi card")
+fastpay = GatewayClient("fastpay")
+fib = FibClient("fib")
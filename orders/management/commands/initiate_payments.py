@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Initiate the gateway payments of the queued orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for queued orders instead of exiting when none are left.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds to wait between polls when running with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        total_ready = total_failed = 0
+        while True:
+            ready, failed = Order.initiate_queued_payments(
+                batch_size=options["batch_size"]
+            )
+            total_ready += ready
+            total_failed += failed
+            if ready or failed:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total_ready} payments initiated, {total_failed} failed."
+            )
+        )
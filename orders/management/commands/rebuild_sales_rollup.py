@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+from orders.models import DailySalesRollup, Order, OrderLine
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollup of the dashboard from all the orders."
+
+    def handle(self, *args, **options):
+        counted_orders = Order.objects.filter(
+            status__in=[Order.STATUS.pending, Order.STATUS.approved]
+        ).exclude(payment_status=Order.PAYMENT_STATUS.failed)
+
+        with transaction.atomic():
+            # lock the orders table so no order is counted twice meanwhile
+            list(Order.objects.select_for_update().values_list("id", flat=True))
+            DailySalesRollup.objects.all().delete()
+
+            rows = [
+                DailySalesRollup(**row)
+                for row in counted_orders.order_by()
+                .annotate(day=TruncDate("created"))
+                .values("day", "payment_method", "is_wholesale")
+                .annotate(
+                    orders_count=Count("id"),
+                    revenue=Sum("total_price"),
+                    wallet_amount=Sum("paid_amount_from_wallet"),
+                    wallet_orders_count=Count(
+                        "id", filter=Q(paid_amount_from_wallet__gt=0)
+                    ),
+                )
+            ]
+            rows += [
+                DailySalesRollup(
+                    day=row["day"],
+                    product_id=row["product"],
+                    payment_method=row["order__payment_method"],
+                    is_wholesale=row["order__is_wholesale"],
+                    quantity=row["sold"],
+                    revenue=row["revenue"],
+                )
+                for row in OrderLine.objects.filter(order__in=counted_orders)
+                .order_by()
+                .annotate(day=TruncDate("order__created"))
+                .values("day", "product", "order__payment_method", "order__is_wholesale")
+                .annotate(
+                    # not named `quantity`, the revenue below reads the field
+                    sold=Sum("quantity"),
+                    revenue=Sum(
+                        F("quantity") * F("unit_price"),
+                        output_field=models.DecimalField(
+                            max_digits=26, decimal_places=0
+                        ),
+                    ),
+                )
+            ]
+            DailySalesRollup.objects.bulk_create(rows, batch_size=1000)
+
+            sold = defaultdict(int)
+            for row in rows:
+                if row.product_id is not None:
+                    sold[row.product_id] += row.quantity
+            Product.objects.exclude(pk__in=sold).exclude(sold_count=0).update(
+                sold_count=0
+            )
+            Product.objects.bulk_update(
+                [Product(pk=pk, sold_count=quantity) for pk, quantity in sold.items()],
+                ["sold_count"],
+                batch_size=500,
+            )
+
+            Order.objects.exclude(pk__in=counted_orders).filter(
+                in_sales_rollup=True
+            ).update(in_sales_rollup=False)
+            counted = counted_orders.update(in_sales_rollup=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {len(rows)} rollup rows from {counted} orders."
+            )
+        )
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import OrderEmail
+
+
+class Command(BaseCommand):
+    help = "Send the queued order emails of the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting when it is drained.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=10,
+            help="Seconds to wait between polls when running with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = OrderEmail.send_batch(batch_size=options["batch_size"])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(
+            self.style.SUCCESS(f"{total_sent} emails sent, {total_failed} failed.")
+        )
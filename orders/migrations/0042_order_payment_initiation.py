@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0041_orderemail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="payment_initiation_status",
+            field=models.CharField(
+                choices=[
+                    ("not_required", "Not Required"),
+                    ("queued", "Queued"),
+                    ("processing", "Processing"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                default="not_required",
+                max_length=50,
+                verbose_name="Payment Initiation Status",
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="payment_initiation_attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="payment_initiation_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,90 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0045_product_keys_used_count_product_keys_unused_count"),
+        ("orders", "0042_order_payment_initiation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="in_sales_rollup",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name="DailySalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(db_index=True)),
+                (
+                    "payment_method",
+                    models.CharField(
+                        choices=[
+                            ("cash", "Cash"),
+                            ("zain_cash", "Zain Cash"),
+                            ("fast_pay", "Fast Pay"),
+                            ("credit_card", "Credit Card"),
+                            ("fib", "FIB"),
+                        ],
+                        max_length=50,
+                        verbose_name="Payment Method",
+                    ),
+                ),
+                ("is_wholesale", models.BooleanField(default=False)),
+                ("quantity", models.IntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=0, default=0, max_digits=26),
+                ),
+                ("orders_count", models.IntegerField(default=0)),
+                (
+                    "wallet_amount",
+                    models.DecimalField(decimal_places=0, default=0, max_digits=26),
+                ),
+                ("wallet_orders_count", models.IntegerField(default=0)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        related_query_name="daily_sale",
+                        to="products.product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Daily Sales Rollups",
+                "ordering": ["-day"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailysalesrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("product__isnull", False)),
+                fields=("day", "product", "payment_method", "is_wholesale"),
+                name="unique_daily_sales_rollup_product",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailysalesrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("product__isnull", True)),
+                fields=("day", "payment_method", "is_wholesale"),
+                name="unique_daily_sales_rollup_order",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ("orders", "0043_dailysalesrollup_order_in_sales_rollup"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="order",
+            index=models.Index(fields=["-created", "-id"], name="orders_order_keyset_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="orderline",
+            index=models.Index(fields=["-created", "-id"], name="orders_line_keyset_idx"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.13 on 2026-10-17 22:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0045_backfill_daily_sales_rollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="payment_initiation_next_attempt_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
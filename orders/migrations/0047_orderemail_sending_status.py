@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0046_order_payment_initiation_next_attempt_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="orderemail",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("sending", "Sending"),
+                    ("sent", "Sent"),
+                    ("failed", "Failed"),
+                ],
+                default="queued",
+                max_length=50,
+                verbose_name="Status",
+            ),
+        ),
+    ]
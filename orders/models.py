@@ -1,18 +1,22 @@
 import json
 import time
 import uuid
+from collections import defaultdict
+from datetime import timedelta
 from decimal import Decimal
 from django.contrib.contenttypes.models import ContentType
 import jwt
-import requests
 from constance import config
 from django.conf import settings
-from django.core.mail import EmailMessage
-from django.db import models
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, models, transaction
+from django.db.models import Count
 from django.template.loader import get_template
+from django.utils import timezone
 from django_lifecycle import (
     AFTER_CREATE,
     AFTER_SAVE,
+    AFTER_UPDATE,
     BEFORE_CREATE,
     LifecycleModelMixin,
     hook,
@@ -21,13 +25,14 @@ from model_utils import Choices
 from model_utils.fields import MonitorField
 from model_utils.models import TimeStampedModel
 from requests.auth import HTTPBasicAuth
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 from sequences import get_next_value
 
-from authentication.models import Transaction, UserStampedModel
+from authentication.models import Transaction, User, UserStampedModel
 from core.utils import get_upload_path
 from notifications.models import Notification
-from products.models import ProductKey
+from orders import gateways
+from products.models import Product, ProductKey
 from products.models.product_image import ProductImage
 from django.contrib.contenttypes.fields import GenericRelation
 import base64
@@ -45,6 +50,9 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
     class Meta:
         verbose_name_plural = "Orders"
         ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["-created", "-id"], name="orders_order_keyset_idx"),
+        ]
 
     STATUS = Choices(
         ("pending", "Pending"),
@@ -65,6 +73,20 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         ("paid", "Paid"),
         ("failed", "Failed"),
     )
+    PAYMENT_INITIATION_STATUS = Choices(
+        ("not_required", "Not Required"),
+        ("queued", "Queued"),
+        ("processing", "Processing"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    )
+    GATEWAY_PAYMENT_METHODS = (
+        PAYMENT_METHOD.zain_cash,
+        PAYMENT_METHOD.credit_card,
+        PAYMENT_METHOD.fast_pay,
+        PAYMENT_METHOD.fib,
+    )
+    MAX_PAYMENT_INITIATION_ATTEMPTS = 3
 
     order_number = models.CharField(
         "Order Number", max_length=50, unique=True, default=get_next_order_number
@@ -111,6 +133,19 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
     readable_code = models.CharField(max_length=50, blank=True)
     fib_payment_valid_until = models.DateTimeField(blank=True, null=True)
     is_wholesale = models.BooleanField(default=False)
+    # payment gateway initiation, done by the `initiate_payments` worker when
+    # settings.ASYNC_PAYMENT_INITIATION is on
+    payment_initiation_status = models.CharField(
+        "Payment Initiation Status",
+        choices=PAYMENT_INITIATION_STATUS,
+        max_length=50,
+        default=PAYMENT_INITIATION_STATUS.not_required,
+    )
+    payment_initiation_attempts = models.PositiveIntegerField(default=0)
+    payment_initiation_next_attempt_at = models.DateTimeField(default=timezone.now)
+    payment_initiation_error = models.TextField(blank=True)
+    # whether the order is currently counted in DailySalesRollup
+    in_sales_rollup = models.BooleanField(default=False, editable=False)
 
     # status tracking fields
     approved_by = models.ForeignKey(
@@ -267,54 +302,44 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         return round(self.total_price_minus_wallet / config.USD_TO_IQD_EXCHANGE_RATE, 2)
 
     def send_order_pending_email(self):
-        # return
-        print("Sending order pending email...")
-        order_lines = OrderLine.objects.filter(order=self)
-        html = get_template("orders/order_pending.html").render(
-            {
-                "username": self.created_by.username,
-                "order_lines": order_lines,
-                "total": self.total_price
-            }
-        )
-        mail = EmailMessage(
-            subject=f"Order {self.order_number} Created",
-            body=html,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[self.created_by.email],
-        )
-        mail.content_subtype = "html"
-        mail.send()
+        OrderEmail.queue(self, OrderEmail.KIND.pending)
 
     def send_order_approved_email(self):
-        # return
-        order_lines = OrderLine.objects.filter(order=self)
-        
+        OrderEmail.queue(self, OrderEmail.KIND.approved)
 
+    @hook(AFTER_SAVE)
+    def set_is_wholesale(self):
+        self.is_wholesale = self.created_by.wholesale_type is not None
 
-        # Render email template
-        html = get_template("orders/order_approved.html").render(
-            {
-                "username": self.created_by.username,
-                "order_lines": order_lines,
-                "total": self.total_price
-            }
-        )
-
-        # Create and send email message
-        email_subject = f"Order {self.order_number} is Approved, Thanks for Purchasing"
-        email = EmailMessage(
-            subject=email_subject,
-            body=html,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[self.created_by.email],
+    @property
+    def counts_as_sale(self):
+        return (
+            self.status in (self.STATUS.pending, self.STATUS.approved)
+            and self.payment_status != self.PAYMENT_STATUS.failed
         )
-        email.content_subtype = "html"
-        email.send()
 
     @hook(AFTER_SAVE)
-    def set_is_wholesale(self):
-        self.is_wholesale = self.created_by.wholesale_type is not None
+    def sync_sales_rollup(self):
+        if self.counts_as_sale and not self.in_sales_rollup:
+            DailySalesRollup.apply([self], 1)
+        elif not self.counts_as_sale and self.in_sales_rollup:
+            DailySalesRollup.apply([self], -1)
+
+    @hook(AFTER_CREATE)
+    def add_to_user_order_stats(self):
+        if self.created_by_id is not None:
+            User.add_order_stats(
+                self.created_by_id, price=self.total_price, order_date=self.created
+            )
+
+    @hook(AFTER_UPDATE, when="total_price", has_changed=True)
+    def update_user_order_stats(self):
+        if self.created_by_id is not None:
+            User.add_order_stats(
+                self.created_by_id,
+                orders=0,
+                price=self.total_price - self.initial_value("total_price"),
+            )
 
     @hook(AFTER_SAVE, when="status", was="pending", is_now="approved")
     def approve_order(self):
@@ -323,52 +348,49 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
     @hook(AFTER_SAVE, when="status", was="pending", is_now="rejected")
     def reject_order(self):
         # send email to the user
-
-        html = get_template("orders/order_rejected.html").render(
-            {
-                "username": self.created_by.username,
-                "order_number": self.order_number,
-            }
-        )
-        # send email to the user
-        mail = EmailMessage(
-            subject=f"Order {self.order_number} Rejected",
-            body=html,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[self.created_by.email],
-        )
-        mail.content_subtype = "html"
-        mail.send()
+        OrderEmail.queue(self, OrderEmail.KIND.rejected)
 
     @hook(AFTER_SAVE, when="status", is_now="returned")
     def return_order(self):
         # send email to the user
-        html = get_template("orders/order_returned.html").render(
-            {
-                "order_number": self.order_number,
-            }
-        )
-        # send email to the user
-        mail = EmailMessage(
-            subject=f"Order {self.order_number} Returned",
-            body=html,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[self.created_by.email],
-        )
-        mail.content_subtype = "html"
-        mail.send()
+        OrderEmail.queue(self, OrderEmail.KIND.returned)
 
     @hook(AFTER_SAVE, when="payment_status", is_now="failed")
     @hook(AFTER_SAVE, when="status", is_now="canceled")
     def unuse_keys(self):
-        for order_line in self.order_lines.all():
-            for order_line_key in order_line.order_line_keys.all():
-                order_line_key.key.is_used = False
-                order_line_key.key.used_by = None
-                order_line_key.key.used_at = None
-                order_line_key.key.used_order = None
-                order_line_key.key.save()
-                order_line_key.delete()
+        OrderLineKey.release(OrderLineKey.objects.filter(order_line__order=self))
+
+    # written by the payment gateway calls, see save_payment_link
+    PAYMENT_LINK_FIELDS = (
+        "payment_status",
+        "payment_failed_at",
+        "transaction_id",
+        "transaction_url",
+        "qr_code",
+        "readable_code",
+        "fib_payment_valid_until",
+    )
+
+    def save_payment_link(self, fields=PAYMENT_LINK_FIELDS, payment_status=None):
+        """
+        Save the result of a payment gateway call: only `fields`, so a change
+        made to the order during the HTTP round trip (a cancel, a status
+        change) is not overwritten, and only while the stored payment status
+        is still `payment_status` (pending by default). Returns whether the
+        order was saved.
+        """
+        with transaction.atomic():
+            if not (
+                Order.objects.select_for_update()
+                .filter(
+                    pk=self.pk,
+                    payment_status=payment_status or self.PAYMENT_STATUS.pending,
+                )
+                .exists()
+            ):
+                return False
+            self.save(update_fields=[*fields, "modified"])
+        return True
 
     def create_zain_cash_transaction(self):
         if not (
@@ -406,23 +428,23 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
             "Content-Type": "Content-type: application/x-www-form-urlencoded",
         }
 
-        response = requests.post(
+        response = gateways.zain_cash.post(
             f"{url}/init", data=json.dumps(data_to_post), headers=headers
         )
         if response.status_code != 200:
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
         response_data = response.json()
         if response_data.get("status", "pending") != "pending":
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
         transaction_id = response_data.get("id", "")
         if not transaction_id:
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
         self.transaction_id = transaction_id
         self.transaction_url = f"{url}/pay?id={transaction_id}"
-        self.save()
+        self.save_payment_link()
 
     def create_qi_card_transaction(self):
         # raise APIException("Maintenance", code=500)
@@ -455,7 +477,7 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
             "X-Terminal-Id": settings.QICARD_TERMINAL_ID,
         }
 
-        response = requests.post(
+        response = gateways.qi_card.post(
             url,
             data=json.dumps(data),
             headers=headers,
@@ -463,16 +485,16 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         )
         if response.status_code != 200:
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
 
         response_data = response.json()
         if response_data.get("status", "FAILED") != "CREATED":
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
 
         self.transaction_id = response_data["paymentId"]
         self.transaction_url = response_data["formUrl"]
-        self.save()
+        self.save_payment_link()
 
     # @staticmethod
     # def create_qi_card_refund_transaction():
@@ -669,38 +691,18 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         }
         headers = {"Accept": "application/json",
                    "Content-Type": "application/json"}
-        response = requests.post(url, data=json.dumps(data), headers=headers)
+        response = gateways.fastpay.post(url, data=json.dumps(data), headers=headers)
         if response.status_code != 200:
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
         response_data = response.json()
         self.transaction_id = response_data["data"]["redirect_uri"]
         self.transaction_url = response_data["data"]["redirect_uri"]
-        self.save()
+        self.save_payment_link()
 
     @staticmethod
     def auth_fib():
-        if not (
-            settings.FIB_AUTH_URL
-            or settings.FIB_CLIENT_ID
-            or settings.FIB_CLIENT_SECRET
-        ):
-            raise APIException("Can not connect to fib", code=500)
-
-        url = settings.FIB_AUTH_URL
-        client_id = settings.FIB_CLIENT_ID
-        client_secret = settings.FIB_CLIENT_SECRET
-
-        data = {
-            "grant_type": "client_credentials",
-            "client_id": client_id,
-            "client_secret": client_secret,
-        }
-        response = requests.post(url, data=data)
-        if response.status_code != 200:
-            raise APIException("Can not connect to fib", code=500)
-        response_data = response.json()
-        return response_data["access_token"]
+        return gateways.fib.access_token()
 
     def create_fib_transaction(self):
         if not (
@@ -713,7 +715,6 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
 
         url = settings.FIB_CREATE_PAYMENT_URL
         redirect_url = settings.FIB_REDIRECT_URL
-        access_token = self.auth_fib()
         data = {
             "monetaryValue": {
                 "amount": int(self.total_price_minus_wallet),
@@ -722,82 +723,472 @@ class Order(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
             "statusCallbackUrl": redirect_url,
             "description": f"Original Software Order {self.order_number}",
         }
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}",
-        }
-        response = requests.post(url, data=json.dumps(data), headers=headers)
+        headers = {"Content-Type": "application/json"}
+        response = gateways.fib.authorized_request(
+            "POST", url, data=json.dumps(data), headers=headers
+        )
         if response.status_code != 201:
             self.payment_status = self.PAYMENT_STATUS.failed
-            self.save()
+            self.save_payment_link()
         response_data = response.json()
         self.transaction_id = response_data["paymentId"]
         self.transaction_url = response_data["personalAppLink"]
         self.qr_code = response_data["qrCode"]
         self.readable_code = response_data["readableCode"]
         self.fib_payment_valid_until = response_data["validUntil"]
-        self.save()
+        self.save_payment_link()
+
+    def initiate_payment(self):
+        if self.payment_method == self.PAYMENT_METHOD.zain_cash:
+            self.create_zain_cash_transaction()
+        elif self.payment_method == self.PAYMENT_METHOD.credit_card:
+            self.create_qi_card_transaction()
+        elif self.payment_method == self.PAYMENT_METHOD.fast_pay:
+            self.create_fastpay_transaction()
+        elif self.payment_method == self.PAYMENT_METHOD.fib:
+            self.create_fib_transaction()
+
+    @classmethod
+    def initiate_queued_payments(cls, batch_size=20):
+        """
+        Initiate the gateway payments of the queued orders that are due.
+
+        The orders are claimed in a short transaction (SKIP LOCKED, so several
+        workers can run) and the gateway is called after it commits, so no row
+        lock is held during the HTTP round trip. The results are written with
+        `save_payment_link`, only while the payment is still pending. A failed
+        attempt is retried with an exponential backoff until
+        MAX_PAYMENT_INITIATION_ATTEMPTS. Orders stuck in processing by a dead
+        worker are claimed again after 10 minutes.
+        Returns `(ready, failed)` counts.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            orders = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(
+                    models.Q(
+                        payment_initiation_status=cls.PAYMENT_INITIATION_STATUS.queued,
+                        payment_initiation_next_attempt_at__lte=now,
+                    )
+                    | models.Q(
+                        payment_initiation_status=cls.PAYMENT_INITIATION_STATUS.processing,
+                        modified__lt=now - timedelta(minutes=10),
+                    ),
+                    payment_status=cls.PAYMENT_STATUS.pending,
+                )
+                .exclude(status=cls.STATUS.canceled)
+                .order_by("id")[:batch_size]
+            )
+            cls.objects.filter(pk__in=[order.pk for order in orders]).update(
+                payment_initiation_status=cls.PAYMENT_INITIATION_STATUS.processing,
+                payment_initiation_attempts=models.F("payment_initiation_attempts") + 1,
+                modified=now,
+            )
+
+        ready = failed = 0
+        for order in orders:
+            order.refresh_from_db()
+            try:
+                order.initiate_payment()
+            except Exception as e:
+                error = str(e)
+            else:
+                error = ""
+            # the gateway call may have failed the payment already
+            payment_status = order.payment_status
+            fields = ["payment_initiation_status", "payment_initiation_error"]
+            if order.transaction_url or order.qr_code:
+                order.payment_initiation_status = cls.PAYMENT_INITIATION_STATUS.ready
+            elif order.payment_initiation_attempts < cls.MAX_PAYMENT_INITIATION_ATTEMPTS and (
+                order.payment_status == cls.PAYMENT_STATUS.pending
+            ):
+                order.payment_initiation_status = cls.PAYMENT_INITIATION_STATUS.queued
+                order.payment_initiation_next_attempt_at = timezone.now() + timedelta(
+                    seconds=30 * 2**order.payment_initiation_attempts
+                )
+                fields.append("payment_initiation_next_attempt_at")
+            else:
+                order.payment_initiation_status = cls.PAYMENT_INITIATION_STATUS.failed
+                order.payment_status = cls.PAYMENT_STATUS.failed
+                fields += ["payment_status", "payment_failed_at"]
+            order.payment_initiation_error = error
+            if not order.save_payment_link(fields, payment_status=payment_status):
+                # paid or failed in the meantime, by a gateway callback
+                continue
+            if order.payment_initiation_status == cls.PAYMENT_INITIATION_STATUS.ready:
+                ready += 1
+            elif order.payment_initiation_status == cls.PAYMENT_INITIATION_STATUS.failed:
+                failed += 1
+        return ready, failed
+
+    @classmethod
+    def cancel_expired(cls, chunk_size=500):
+        """
+        Cancel the orders whose payment was not completed in time: 15 minutes
+        after creation, or after `fib_payment_valid_until` for FIB orders.
+
+        Every chunk is canceled with one UPDATE ... RETURNING, its keys are
+        released with one bulk update and one bulk delete and the owners are
+        notified with one bulk insert. The per-order save hooks are skipped.
+        Returns the number of canceled orders.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        content_type = ContentType.objects.get_for_model(cls)
+        canceled = 0
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        UPDATE {table}
+                        SET status = %s,
+                            canceled_at = %s,
+                            modified = %s
+                        WHERE id IN (
+                            SELECT id FROM {table}
+                            WHERE payment_status = %s
+                              AND status <> %s
+                              AND (
+                                (payment_method <> %s AND created < %s)
+                                OR (payment_method = %s AND fib_payment_valid_until < %s)
+                              )
+                            ORDER BY id
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, order_number, created_by
+                        """,
+                        [
+                            cls.STATUS.canceled,
+                            now,
+                            now,
+                            cls.PAYMENT_STATUS.pending,
+                            cls.STATUS.canceled,
+                            cls.PAYMENT_METHOD.fib,
+                            now - timedelta(minutes=15),
+                            cls.PAYMENT_METHOD.fib,
+                            now,
+                            chunk_size,
+                        ],
+                    )
+                    rows = cursor.fetchall()
+                if not rows:
+                    break
+                order_ids = [row[0] for row in rows]
+                OrderLineKey.release(
+                    OrderLineKey.objects.filter(order_line__order_id__in=order_ids)
+                )
+                DailySalesRollup.apply(
+                    cls.objects.filter(pk__in=order_ids, in_sales_rollup=True), -1
+                )
+                Notification.objects.bulk_create(
+                    [
+                        Notification(
+                            related_user_id=created_by,
+                            content_type=content_type,
+                            object_id=order_id,
+                            linked_model_name="orders.Order",
+                            description=f"Order {order_number} canceled, the payment was not completed in time",
+                            notification_level=Notification.NOTIFICATION_LEVELS.low,
+                        )
+                        for order_id, order_number, created_by in rows
+                    ]
+                )
+            canceled += len(rows)
+        return canceled
+
+    TRANSITIONS = Choices(
+        ("approve_order", "Order Successfully approved"),
+        ("reject_order", "Order Successfully rejected"),
+        ("return_order", "Order Successfully returned"),
+        ("mark_as_paid", "Order Successfully marked as paid"),
+    )
+
+    def transition_error(self, transition):
+        """
+        Why `transition` can not be applied to the order, None when it can.
+        """
+        if transition == self.TRANSITIONS.approve_order:
+            if self.status == self.STATUS.approved:
+                return "Order is already approved."
+            if self.status != self.STATUS.pending:
+                return "Order is not in pending status."
+        elif transition == self.TRANSITIONS.reject_order:
+            if self.status == self.STATUS.rejected:
+                return "Order is already rejected."
+            if self.status != self.STATUS.pending:
+                return "Order is not in pending status."
+        elif transition == self.TRANSITIONS.return_order:
+            if self.status == self.STATUS.returned:
+                return "Order is already returned."
+        elif transition == self.TRANSITIONS.mark_as_paid:
+            if self.payment_status == self.PAYMENT_STATUS.paid:
+                return "Order is already paid."
+        return None
+
+    def apply_transition(self, transition, user, notes="", now=None):
+        """
+        Set the fields changed by `transition` without saving the order, the
+        monitor fields included. Returns the names of the changed fields.
+        """
+        now = now or timezone.now()
+        if transition == self.TRANSITIONS.approve_order:
+            self.status = self.STATUS.approved
+            self.approved_by = user
+            self.approved_notes = notes
+            self.approved_at = now
+            return ["status", "approved_by", "approved_notes", "approved_at"]
+        if transition == self.TRANSITIONS.reject_order:
+            self.status = self.STATUS.rejected
+            self.rejected_by = user
+            self.rejected_notes = notes
+            self.rejected_at = now
+            return ["status", "rejected_by", "rejected_notes", "rejected_at"]
+        if transition == self.TRANSITIONS.return_order:
+            self.status = self.STATUS.returned
+            self.returned_by = user
+            self.returned_at = now
+            return ["status", "returned_by", "returned_at"]
+        self.payment_status = self.PAYMENT_STATUS.paid
+        self.paid_by = user
+        self.paid_at = now
+        return ["payment_status", "paid_by", "paid_at"]
+
+    @classmethod
+    def bulk_transition(cls, orders, transition, user, notes=""):
+        """
+        Approve, reject, return or mark as paid the `orders` queryset at once.
+
+        The orders are locked and the valid ones are changed with one bulk
+        update, in one database transaction with their cashback transactions,
+        sales rollup, status notifications and queued emails, each written with
+        bulk queries. The per-order save hooks are skipped. Returns one
+        `{"id", "order_number", "success", "detail"}` result per order.
+        """
+        now = timezone.now()
+        results = []
+        with transaction.atomic():
+            locked = list(
+                cls.objects.filter(pk__in=orders.order_by().values("pk"))
+                .select_for_update()
+                .order_by("pk")
+            )
+            changed = []
+            fields = {"updated_by", "modified"}
+            for order in locked:
+                error = order.transition_error(transition)
+                if error:
+                    results.append(
+                        {
+                            "id": order.pk,
+                            "order_number": order.order_number,
+                            "success": False,
+                            "detail": error,
+                        }
+                    )
+                    continue
+                fields.update(order.apply_transition(transition, user, notes, now))
+                order.updated_by = user
+                order.modified = now
+                changed.append(order)
+                results.append(
+                    {
+                        "id": order.pk,
+                        "order_number": order.order_number,
+                        "success": True,
+                        "detail": cls.TRANSITIONS[transition],
+                    }
+                )
+            if not changed:
+                return results
+            cls.objects.bulk_update(changed, sorted(fields))
+
+            if transition == cls.TRANSITIONS.approve_order:
+                Transaction.record_many(
+                    [
+                        Transaction(
+                            idempotency_key=f"order:{order_line.order_id}:cashback:{order_line.pk}",
+                            transaction_type=Transaction.TRANSACTION_TYPE.deposit,
+                            user_id=order_line.order.created_by_id,
+                            amount=order_line.product.cashback_amount
+                            * order_line.quantity,
+                            description=f"Cashback for purchasing Qty: {order_line.quantity} of {order_line.product.name} in Order {order_line.order.order_number}",
+                            related_order_id=order_line.order_id,
+                            created_by=user,
+                            updated_by=user,
+                        )
+                        for order_line in OrderLine.objects.filter(
+                            order__in=changed,
+                            product__cashback_amount__gt=0,
+                            order__created_by__isnull=False,
+                        ).select_related("order", "product")
+                    ]
+                )
+
+            DailySalesRollup.apply(
+                [order for order in changed if order.counts_as_sale], 1
+            )
+            DailySalesRollup.apply(
+                [order for order in changed if not order.counts_as_sale], -1
+            )
+
+            email_kind = {
+                cls.TRANSITIONS.approve_order: OrderEmail.KIND.approved,
+                cls.TRANSITIONS.reject_order: OrderEmail.KIND.rejected,
+                cls.TRANSITIONS.return_order: OrderEmail.KIND.returned,
+            }.get(transition)
+            if email_kind:
+                OrderEmail.objects.bulk_create(
+                    [OrderEmail(order=order, kind=email_kind) for order in changed]
+                )
+
+            descriptions = {
+                cls.TRANSITIONS.approve_order: "Order {} approved",
+                cls.TRANSITIONS.reject_order: "Order {} rejected",
+                cls.TRANSITIONS.return_order: "Order {} returned",
+                cls.TRANSITIONS.mark_as_paid: "Order {} marked as paid",
+            }
+            content_type = ContentType.objects.get_for_model(cls)
+            Notification.objects.bulk_create(
+                [
+                    Notification(
+                        related_user_id=order.created_by_id,
+                        content_type=content_type,
+                        object_id=order.pk,
+                        linked_model_name="orders.Order",
+                        description=descriptions[transition].format(
+                            order.order_number
+                        ),
+                        notification_level=Notification.NOTIFICATION_LEVELS.normal,
+                        created_by=user,
+                        updated_by=user,
+                    )
+                    for order in changed
+                ]
+            )
+        return results
+
+    def use_keys(self, order_lines=None):
+        """
+        Reserve the keys of all the order lines, updating the stock counters
+        and notifications of each touched product once for the whole order.
+        """
+        if order_lines is None:
+            order_lines = self.order_lines.select_related(
+                "product", "created_by"
+            ).prefetch_related("product__offer_products")
+        used_keys = OrderLine.reserve_keys(self, order_lines)
+        Product.adjust_keys_stock_many(
+            {product_id: (count, -count) for product_id, count in used_keys.items()}
+        )
+        Product.evaluate_stock_bands(used_keys, related_user=self.created_by)
 
     def set_order_and_keys_as_viewed(self):
+        """
+        Flag the order and its keys as viewed with one UPDATE each. The keys
+        are updated in SQL, which skips their stock hooks: only `is_viewed`
+        changes, the stock stays the same.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            Order.objects.filter(pk=self.pk).update(is_viewed=True, modified=now)
+            ProductKey.objects.filter(
+                pk__in=OrderLineKey.objects.filter(order_line__order=self).values(
+                    "key_id"
+                ),
+                is_viewed=False,
+            ).update(is_viewed=True, modified=now)
         self.is_viewed = True
-        self.save()
-        for order_line in self.order_lines.all():
-            for order_line_key in order_line.order_line_keys.all():
-                order_line_key.key.is_viewed = True
-                order_line_key.key.save()
+        self.modified = now
+
+    def revealed_keys(self):
+        """
+        The keys of the order with their product, read with one join query.
+        """
+        return list(
+            OrderLineKey.objects.filter(order_line__order=self)
+            .order_by("order_line__seq", "pk")
+            .values(
+                "order_line_id",
+                "other_info",
+                product_name=models.F("order_line__product__name"),
+                product_name_ar=models.F("order_line__product__name_ar"),
+                key_serial=models.F("key__key"),
+                used_at=models.F("key__used_at"),
+            )
+        )
 
     def use_wallet_balance(self):
         if not self.use_wallet:
             return
 
         user = self.created_by
-        balance = user.wallet_balance
+        with transaction.atomic():
+            # lock the wallet row so concurrent checkouts can not spend the same
+            # balance twice
+            balance = (
+                type(user)
+                .objects.select_for_update()
+                .values_list("wallet_balance", flat=True)
+                .get(pk=user.pk)
+            )
 
-        if user.wholesale_type is None:
-            # Ensure balance is positive and sufficient to cover the total price
-            if balance >= self.total_price:
-                self.paid_amount_from_wallet = self.total_price
-            else:
-                self.paid_amount_from_wallet = balance
-        else:
-            # Ensure the balance won't exceed the negative limit after the order
-            if balance - self.total_price < -user.wholesale_type.negative_limit:
-                self.paid_amount_from_wallet = balance
+            if user.wholesale_type is None:
+                # Ensure balance is positive and sufficient to cover the total price
+                if balance >= self.total_price:
+                    self.paid_amount_from_wallet = self.total_price
+                else:
+                    self.paid_amount_from_wallet = balance
             else:
-                self.paid_amount_from_wallet = self.total_price
-        # Save the updated order
-        self.save()
-        # Create a transaction for the paid amount
-        Transaction.objects.create(
-            transaction_type=Transaction.TRANSACTION_TYPE.order,
-            user=user,
-            amount=-self.paid_amount_from_wallet,
-            description=f"Order {self.order_number}",
-            related_order=self,
-        )
+                # Ensure the balance won't exceed the negative limit after the order
+                if balance - self.total_price < -user.wholesale_type.negative_limit:
+                    self.paid_amount_from_wallet = balance
+                else:
+                    self.paid_amount_from_wallet = self.total_price
+            # Save the updated order
+            self.save()
+            # Create a transaction for the paid amount
+            Transaction.record(
+                idempotency_key=f"order:{self.pk}:wallet",
+                transaction_type=Transaction.TRANSACTION_TYPE.order,
+                user=user,
+                amount=-self.paid_amount_from_wallet,
+                description=f"Order {self.order_number}",
+                related_order=self,
+            )
 
     def create_order_for_user(self, user):
+        previous_user_id = self.created_by_id
         self.created_by = user
         self.save()
+        User.refresh_order_stats([previous_user_id, user.pk])
+
+    def notify_created(self):
+        Notification.objects.create(
+            related_user=self.created_by,
+            content_object=self,
+            linked_model_name="orders.Order",
+            description=f"Order {self.order_number} created",
+            notification_level=Notification.NOTIFICATION_LEVELS.low,
+        )
 
     def save(self, *args, **kwargs):
         if not self.pk:
             super().save(*args, **kwargs)
-            Notification.objects.create(
-                related_user=self.created_by,
-                content_object=self,
-                linked_model_name="orders.Order",
-                description=f"Order {self.order_number} created",
-                notification_level=Notification.NOTIFICATION_LEVELS.low,
-            )
-            
+            self.notify_created()
         else:
             super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
+        if self.in_sales_rollup:
+            DailySalesRollup.apply([self], -1)
         for order_line in self.order_lines.all():
             order_line.delete()
         super().delete(*args, **kwargs)
+        if self.created_by_id is not None:
+            User.refresh_order_stats([self.created_by_id])
 
     def __str__(self):
         return f" Order: {self.order_number}"
@@ -807,6 +1198,9 @@ class OrderLine(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
     class Meta:
         verbose_name_plural = "Order Lines"
         ordering = ["seq"]
+        indexes = [
+            models.Index(fields=["-created", "-id"], name="orders_line_keyset_idx"),
+        ]
 
     seq = models.PositiveIntegerField(default=1)
 
@@ -866,7 +1260,8 @@ class OrderLine(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
 
     def preform_cashback(self):
         if self.product.cashback_amount and self.product.cashback_amount > 0:
-            Transaction.objects.create(
+            Transaction.record(
+                idempotency_key=f"order:{self.order_id}:cashback:{self.pk}",
                 transaction_type=Transaction.TRANSACTION_TYPE.deposit,
                 user=self.order.created_by,
                 amount=self.product.cashback_amount * self.quantity,
@@ -874,32 +1269,79 @@ class OrderLine(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
                 related_order=self.order,
             )
 
-    def use_keys(self):
-        if self.product.is_key_product and not self.product.offer_products.exists():
-            keys_to_use = ProductKey.objects.filter(
-                product=self.product, is_used=False
-            )[: self.quantity]
-            for key in keys_to_use:
-                key.is_used = True
-                key.used_by = self.created_by
-                key.used_order = self.order
-                key.save()
-                OrderLineKey.objects.create(order_line=self, key=key)
-        elif self.product.offer_products.exists():
-            for offer_product in self.product.offer_products.all():
-                keys_to_use = ProductKey.objects.filter(
-                    product=offer_product, is_used=False
-                )[: self.quantity]
-                for key in keys_to_use:
-                    key.is_used = True
-                    key.used_by = self.created_by
-                    key.used_order = self.order
-                    key.save()
-                    OrderLineKey.objects.create(
-                        order_line=self,
-                        key=key,
-                        other_info=f"{offer_product.name}",
+    def key_products(self):
+        """
+        The `(product, other info)` pairs whose keys this line needs, its offer
+        products or the product itself.
+        """
+        offer_products = list(self.product.offer_products.all())
+        if offer_products:
+            return [
+                (offer_product, f"{offer_product.name}")
+                for offer_product in offer_products
+            ]
+        if self.product.is_key_product:
+            return [(self.product, "")]
+        return []
+
+    @staticmethod
+    def reserve_keys(order, order_lines):
+        """
+        Claim the keys of all the `order_lines` of `order` with one UPDATE per
+        line creator (normally one) and link them to the lines with one bulk
+        insert.
+
+        Returns the claimed keys count of each product so the caller can update
+        the stock of each product once, even when several lines share it.
+        """
+        lines = [(order_line, order_line.key_products()) for order_line in order_lines]
+        demands = defaultdict(lambda: defaultdict(int))
+        creators = {}
+        for order_line, key_products in lines:
+            creator_demands = demands[order_line.created_by_id]
+            creators[order_line.created_by_id] = order_line.created_by
+            for key_product, _ in key_products:
+                creator_demands[key_product.pk] += order_line.quantity
+        if not any(demands.values()):
+            return {}
+
+        reserved = {
+            creator_id: ProductKey.reserve(
+                creator_demands, order, used_by=creators[creator_id]
+            )
+            for creator_id, creator_demands in demands.items()
+        }
+
+        order_line_keys = []
+        used_keys = defaultdict(int)
+        for order_line, key_products in lines:
+            available = reserved[order_line.created_by_id]
+            for key_product, other_info in key_products:
+                key_ids = available.get(key_product.pk, [])
+                if len(key_ids) < order_line.quantity:
+                    raise ValidationError(
+                        {
+                            "quantity": f"There is no available quantity of keys for product {key_product.name}"
+                        }
                     )
+                # hand the claimed keys out to the lines in order
+                available[key_product.pk] = key_ids[order_line.quantity :]
+                used_keys[key_product.pk] += order_line.quantity
+                order_line_keys += [
+                    OrderLineKey(
+                        order_line=order_line,
+                        key_id=key_id,
+                        other_info=other_info,
+                        created_by=order_line.created_by,
+                        updated_by=order_line.created_by,
+                    )
+                    for key_id in key_ids[: order_line.quantity]
+                ]
+        OrderLineKey.objects.bulk_create(order_line_keys)
+        return dict(used_keys)
+
+    def use_keys(self):
+        self.order.use_keys([self])
 
     @property
     def first_product_image(self):
@@ -915,14 +1357,9 @@ class OrderLine(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
 
     def delete(self, *args, **kwargs):
         if self.product.is_key_product:
-            for order_line_key in OrderLineKey.objects.filter(order_line=self):
-                order_line_key.key.is_used = False
-                order_line_key.key.is_viewed = False
-                order_line_key.key.used_by = None
-                order_line_key.key.used_at = None
-                order_line_key.key.used_order = None
-                order_line_key.key.save()
-                order_line_key.delete()
+            OrderLineKey.release(
+                OrderLineKey.objects.filter(order_line=self), reset_viewed=True
+            )
         # return the product quantity to the stock
         self.product.qty += self.quantity
         self.product.save()
@@ -959,10 +1396,406 @@ class OrderLineKey(TimeStampedModel, UserStampedModel):
     key_serial = property(lambda self: self.key.key)
     used_at = property(lambda self: self.key.used_at)
 
+    @staticmethod
+    def release(order_line_keys, reset_viewed=False):
+        """
+        Give the keys of `order_line_keys` back to the stock and delete the links,
+        with one bulk update and one bulk delete instead of a save per key.
+
+        Returns the ids of the products whose stock changed.
+        """
+        with transaction.atomic():
+            key_ids = list(order_line_keys.values_list("key_id", flat=True))
+            if not key_ids:
+                return []
+            used_keys = ProductKey.objects.filter(pk__in=key_ids, is_used=True)
+            released = dict(
+                used_keys.order_by()
+                .values("product")
+                .annotate(count=Count("id"))
+                .values_list("product", "count")
+            )
+            changes = {
+                "is_used": False,
+                "used_by": None,
+                "used_at": None,
+                "used_order": None,
+            }
+            if reset_viewed:
+                changes["is_viewed"] = False
+            used_keys.update(**changes)
+            order_line_keys.delete()
+            Product.adjust_keys_stock_many(
+                {product_id: (-count, count) for product_id, count in released.items()}
+            )
+            Product.evaluate_stock_bands(released)
+        return list(released)
+
     def __str__(self):
         return f" Order Line Key for {self.order_line.order.order_number}"
 
 
+class OrderEmail(TimeStampedModel):
+    """
+    Outbox of the order emails, the rows are written in the same transaction as
+    the order change and sent later by the `send_order_emails` worker.
+    """
+
+    class Meta:
+        verbose_name_plural = "Order Emails"
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="orders_email_due_idx")
+        ]
+
+    KIND = Choices(
+        ("pending", "Pending"),
+        ("approved", "Approved"),
+        ("rejected", "Rejected"),
+        ("returned", "Returned"),
+    )
+    STATUS = Choices(
+        ("queued", "Queued"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+    MAX_ATTEMPTS = 6
+
+    order = models.ForeignKey(
+        "Order",
+        on_delete=models.CASCADE,
+        related_name="emails",
+        related_query_name="email",
+    )
+    kind = models.CharField("Kind", choices=KIND, max_length=50)
+    status = models.CharField(
+        "Status", choices=STATUS, max_length=50, default=STATUS.queued
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField("Last Error", blank=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def queue(cls, order, kind):
+        return cls.objects.create(order=order, kind=kind)
+
+    def build_message(self, connection=None):
+        order = self.order
+        context = {
+            "username": order.created_by.username,
+            "order_number": order.order_number,
+        }
+        if self.kind in (self.KIND.pending, self.KIND.approved):
+            context["order_lines"] = order.order_lines.select_related("product")
+            context["total"] = order.total_price
+        subjects = {
+            self.KIND.pending: f"Order {order.order_number} Created",
+            self.KIND.approved: f"Order {order.order_number} is Approved, Thanks for Purchasing",
+            self.KIND.rejected: f"Order {order.order_number} Rejected",
+            self.KIND.returned: f"Order {order.order_number} Returned",
+        }
+        mail = EmailMessage(
+            subject=subjects[self.kind],
+            body=get_template(f"orders/order_{self.kind}.html").render(context),
+            from_email=settings.EMAIL_HOST_USER,
+            to=[order.created_by.email],
+            connection=connection,
+        )
+        mail.content_subtype = "html"
+        return mail
+
+    @classmethod
+    def send_batch(cls, batch_size=50):
+        """
+        Send the due emails of one batch over a single SMTP connection.
+
+        The rows are claimed in a short transaction (SKIP LOCKED, so several
+        workers can run) by marking them as sending, and the emails are sent
+        after it commits, so no row lock is held during the SMTP round trips.
+        Emails left sending by a dead worker are claimed again after 10
+        minutes. A failed email, or all of them when the mail server can not
+        be reached, is retried with an exponential backoff until MAX_ATTEMPTS
+        and then marked as failed.
+        Returns `(sent, failed)` counts.
+        """
+        sent = failed = 0
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(
+                cls.objects.select_for_update(skip_locked=True, of=("self",))
+                .select_related("order__created_by")
+                .filter(
+                    status__in=[cls.STATUS.queued, cls.STATUS.sending],
+                    next_attempt_at__lte=now,
+                )
+                .order_by("next_attempt_at", "id")[:batch_size]
+            )
+            if not emails:
+                return sent, failed
+            cls.objects.filter(pk__in=[email.pk for email in emails]).update(
+                status=cls.STATUS.sending,
+                attempts=models.F("attempts") + 1,
+                next_attempt_at=now + timedelta(minutes=10),
+            )
+
+        def fail(email, error):
+            email.last_error = str(error)
+            if email.attempts >= cls.MAX_ATTEMPTS:
+                email.status = cls.STATUS.failed
+            else:
+                email.status = cls.STATUS.queued
+                email.next_attempt_at = timezone.now() + timedelta(
+                    minutes=2**email.attempts
+                )
+
+        processed = []
+        connection = get_connection()
+        try:
+            try:
+                connection.open()
+            except Exception as e:
+                # the mail server can not be reached, the whole batch failed
+                for email in emails:
+                    processed.append(email)
+                    email.attempts += 1
+                    fail(email, e)
+                failed = len(emails)
+                return sent, failed
+            for email in emails:
+                processed.append(email)
+                email.attempts += 1
+                try:
+                    email.build_message(connection).send()
+                except Exception as e:
+                    failed += 1
+                    fail(email, e)
+                else:
+                    sent += 1
+                    email.status = cls.STATUS.sent
+                    email.sent_at = timezone.now()
+                    email.last_error = ""
+        finally:
+            connection.close()
+            # the emails not reached because of an unexpected error are
+            # retried once their claim expires
+            cls.objects.bulk_update(
+                processed,
+                [
+                    "status",
+                    "attempts",
+                    "next_attempt_at",
+                    "last_error",
+                    "sent_at",
+                ],
+            )
+        return sent, failed
+
+    def __str__(self):
+        return f" {self.kind} email for {self.order.order_number}"
+
+
+class DailySalesRollup(models.Model):
+    """
+    Daily sales totals read by the orders dashboard endpoints.
+
+    The rows with a product hold the sold quantity and revenue of that product,
+    the rows without a product hold the order totals (count, total price and
+    wallet payments) of the day. Orders are added when they are created and
+    removed when they are rejected, returned, canceled or their payment fails,
+    see `Order.sync_sales_rollup` and the `rebuild_sales_rollup` command.
+    The all time `Product.sold_count` is kept along with it.
+    """
+
+    class Meta:
+        verbose_name_plural = "Daily Sales Rollups"
+        ordering = ["-day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "product", "payment_method", "is_wholesale"],
+                condition=models.Q(product__isnull=False),
+                name="unique_daily_sales_rollup_product",
+            ),
+            models.UniqueConstraint(
+                fields=["day", "payment_method", "is_wholesale"],
+                condition=models.Q(product__isnull=True),
+                name="unique_daily_sales_rollup_order",
+            ),
+        ]
+
+    day = models.DateField(db_index=True)
+    product = models.ForeignKey(
+        "products.Product",
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+        related_query_name="daily_sale",
+        null=True,
+        blank=True,
+    )
+    payment_method = models.CharField(
+        "Payment Method", choices=Order.PAYMENT_METHOD, max_length=50
+    )
+    is_wholesale = models.BooleanField(default=False)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=26, decimal_places=0, default=0)
+    orders_count = models.IntegerField(default=0)
+    wallet_amount = models.DecimalField(max_digits=26, decimal_places=0, default=0)
+    wallet_orders_count = models.IntegerField(default=0)
+
+    @staticmethod
+    def sales_day(value):
+        """
+        Day of the rollup of an order creation date, the local date like
+        `TruncDate` of the rebuild (the dates are naive when `USE_TZ` is off).
+        """
+        return timezone.localdate(value) if settings.USE_TZ else value.date()
+
+    @classmethod
+    def apply(cls, orders, sign):
+        """
+        Add (`sign=1`) or remove (`sign=-1`) `orders` from the rollup and flag
+        them accordingly, the orders already in the wanted state are skipped.
+
+        The flags are flipped first with a conditional UPDATE ... RETURNING and
+        only the orders whose flag this call flipped are counted, so two
+        concurrent saves of the same order never both apply it.
+        """
+        in_rollup = sign > 0
+        orders = [order for order in orders if order.in_sales_rollup != in_rollup]
+        if not orders:
+            return
+        with transaction.atomic():
+            table = connection.ops.quote_name(Order._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    UPDATE {table}
+                    SET in_sales_rollup = %s
+                    WHERE id = ANY(%s) AND in_sales_rollup = %s
+                    RETURNING id
+                    """,
+                    [in_rollup, [order.pk for order in orders], not in_rollup],
+                )
+                flipped = {row[0] for row in cursor.fetchall()}
+            for order in orders:
+                order.in_sales_rollup = in_rollup
+            orders = [order for order in orders if order.pk in flipped]
+            if orders:
+                cls.add_deltas(orders, sign)
+
+    @classmethod
+    def add_deltas(cls, orders, sign):
+        """
+        Add (`sign=1`) or remove (`sign=-1`) the sales of `orders` to the rollup
+        rows and the product sold counts, see `apply`.
+        """
+        deltas = defaultdict(lambda: defaultdict(int))
+        for order in orders:
+            day = cls.sales_day(order.created)
+            key = (day, None, order.payment_method, order.is_wholesale)
+            deltas[key]["orders_count"] += sign
+            deltas[key]["revenue"] += sign * order.total_price
+            if order.paid_amount_from_wallet > 0:
+                deltas[key]["wallet_amount"] += sign * order.paid_amount_from_wallet
+                deltas[key]["wallet_orders_count"] += sign
+        for order_line in OrderLine.objects.filter(order__in=orders).select_related(
+            "order"
+        ):
+            order = order_line.order
+            key = (
+                cls.sales_day(order.created),
+                order_line.product_id,
+                order.payment_method,
+                order.is_wholesale,
+            )
+            deltas[key]["quantity"] += sign * order_line.quantity
+            deltas[key]["revenue"] += sign * order_line.sub_total
+
+        sold = defaultdict(int)
+        for (_, product_id, _, _), values in deltas.items():
+            if product_id is not None and values["quantity"]:
+                sold[product_id] += values["quantity"]
+
+        if sold:
+            table = connection.ops.quote_name(Product._meta.db_table)
+            values = ", ".join(["(%s::bigint, %s::integer)"] * len(sold))
+            params = [
+                value
+                for product_id in sorted(sold)
+                for value in (product_id, sold[product_id])
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    UPDATE {table} AS product
+                    SET sold_count = product.sold_count + sold.quantity
+                    FROM (VALUES {values}) AS sold (product_id, quantity)
+                    WHERE product.id = sold.product_id
+                    """,
+                    params,
+                )
+        cls.upsert(
+            {key: values for key, values in deltas.items() if key[1] is not None},
+            with_product=True,
+        )
+        cls.upsert(
+            {key: values for key, values in deltas.items() if key[1] is None},
+            with_product=False,
+        )
+
+    @classmethod
+    def upsert(cls, deltas, with_product):
+        """
+        Add `deltas`, keyed by (day, product id, payment method, is wholesale),
+        to their rows in one `INSERT ... ON CONFLICT DO UPDATE`, creating the
+        missing rows. The product rows and the order rows have their own
+        partial unique constraint, so each kind is upserted on its own.
+        """
+        if not deltas:
+            return
+        quote = connection.ops.quote_name
+        keys = ["day", "product", "payment_method", "is_wholesale"]
+        if not with_product:
+            keys.remove("product")
+        amounts = [
+            "quantity",
+            "revenue",
+            "orders_count",
+            "wallet_amount",
+            "wallet_orders_count",
+        ]
+        columns = [quote(cls._meta.get_field(name).column) for name in keys + amounts]
+        row = ", ".join(["%s"] * len(columns))
+        params = []
+        for (day, product_id, payment_method, is_wholesale), values in sorted(
+            deltas.items(), key=lambda item: str(item[0])
+        ):
+            params += [day, product_id] if with_product else [day]
+            params += [payment_method, is_wholesale]
+            params += [values.get(name, 0) for name in amounts]
+        conflict = ", ".join(columns[: len(keys)])
+        product = quote(cls._meta.get_field("product").column)
+        condition = "IS NOT NULL" if with_product else "IS NULL"
+        updates = ", ".join(
+            f"{column} = rollup.{column} + EXCLUDED.{column}"
+            for column in columns[len(keys) :]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {quote(cls._meta.db_table)} AS rollup ({", ".join(columns)})
+                VALUES {", ".join([f"({row})"] * len(deltas))}
+                ON CONFLICT ({conflict}) WHERE {product} {condition}
+                DO UPDATE SET {updates}
+                """,
+                params,
+            )
+
+    def __str__(self):
+        return f" Sales of {self.day}"
+
+
 class SupportTicket(TimeStampedModel, UserStampedModel):
     class Meta:
         verbose_name_plural = "Support Tickets"
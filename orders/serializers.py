@@ -1,16 +1,36 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
+from constance import config
 from crum import get_current_user
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 
 from authentication.models import Transaction, User
-from authentication.serializers import CustomUserDetailsSerializer
+from authentication.serializers import UserSummarySerializer
 from orders.models import Order, OrderLine, OrderLineKey, SupportTicket
-from products.models import ProductKey, Product
+from products.models import Product, ProductWholesalePricing
 from products.serializers.product import NestedProductImageSerializer
 
 
+class UsdAmountsMixin:
+    """
+    Converts the IQD amounts to USD with the exchange rate read once for the
+    whole response, the nested serializers share the rate of their root.
+    """
+
+    @property
+    def usd_exchange_rate(self):
+        root = self.root
+        if not hasattr(root, "_usd_exchange_rate"):
+            root._usd_exchange_rate = config.USD_TO_IQD_EXCHANGE_RATE
+        return root._usd_exchange_rate
+
+    def to_usd(self, amount):
+        return round(amount / self.usd_exchange_rate, 2)
+
+
 class OrderLineKeySerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderLineKey
@@ -26,7 +46,7 @@ class OrderLineKeySerializer(serializers.ModelSerializer):
         )
 
 
-class OrderLineSerializer(serializers.ModelSerializer):
+class OrderLineSerializer(UsdAmountsMixin, serializers.ModelSerializer):
     order_line_keys = OrderLineKeySerializer(many=True, read_only=True)
     product_name = serializers.CharField(source="product.name", read_only=True)
     product_name_ar = serializers.CharField(
@@ -44,9 +64,10 @@ class OrderLineSerializer(serializers.ModelSerializer):
     is_key_product = serializers.BooleanField(
         source="product.is_key_product", read_only=True
     )
-    created_by_data = CustomUserDetailsSerializer(
-        source="created_by", read_only=True)
+    created_by_data = UserSummarySerializer(source="created_by", read_only=True)
     product_images = serializers.SerializerMethodField()
+    unit_price_usd = serializers.SerializerMethodField()
+    sub_total_usd = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderLine
@@ -96,48 +117,6 @@ class OrderLineSerializer(serializers.ModelSerializer):
             "modified",
         )
 
-    def validate(self, data):
-        # Retrieve the product from initial_data
-        product = data["product"]
-        # if product.has_options:
-        #     raise serializers.ValidationError(
-        #         {
-        #             "product": f"Product {product.name} has options, please send the options with the order line"
-        #         }
-        #     )
-        if product.is_key_product and not product.offer_products.exists():
-            keys_count = ProductKey.objects.filter(
-                product=product,
-                is_used=False,
-            ).count()
-            if keys_count < data["quantity"]:
-                raise serializers.ValidationError(
-                    {
-                        "quantity": f"There is no available quantity of keys for product {product.name}"
-                    }
-                )
-        elif product.offer_products.exists():
-            for offer_product in product.offer_products.all():
-                if offer_product.has_options:
-                    raise serializers.ValidationError(
-                        {
-                            "offer_product": f"Offer Product {product.name} has options, please send the options with the order line"
-                        }
-                    )
-
-                keys_count = ProductKey.objects.filter(
-                    product=offer_product,
-                    is_used=False,
-                ).count()
-                if keys_count < data["quantity"]:
-                    raise serializers.ValidationError(
-                        {
-                            "quantity": f"There is no available quantity of keys for product {offer_product.name}"
-                        }
-                    )
-        # Always return the value after validation
-        return data
-
     def to_representation(self, obj):
         # get the original representation
         ret = super(OrderLineSerializer, self).to_representation(obj)
@@ -158,17 +137,26 @@ class OrderLineSerializer(serializers.ModelSerializer):
     def get_product_images(self, obj):
         return NestedProductImageSerializer(obj.product.images.all(), many=True).data
 
+    def get_unit_price_usd(self, obj):
+        return self.to_usd(obj.unit_price)
+
+    def get_sub_total_usd(self, obj):
+        return self.to_usd(obj.sub_total)
 
-class OrderSerializer(serializers.ModelSerializer):
+
+class OrderSerializer(UsdAmountsMixin, serializers.ModelSerializer):
     order_lines = OrderLineSerializer(many=True, read_only=False)
-    approved_by = serializers.SerializerMethodField()
-    rejected_by = serializers.SerializerMethodField()
-    returned_by = serializers.SerializerMethodField()
-    canceled_by = serializers.SerializerMethodField()
-    paid_by = serializers.SerializerMethodField()
-    payment_failed_by = serializers.SerializerMethodField()
-    created_by = serializers.SerializerMethodField()
-    updated_by = serializers.SerializerMethodField()
+    approved_by = UserSummarySerializer(read_only=True)
+    rejected_by = UserSummarySerializer(read_only=True)
+    returned_by = UserSummarySerializer(read_only=True)
+    canceled_by = UserSummarySerializer(read_only=True)
+    paid_by = UserSummarySerializer(read_only=True)
+    payment_failed_by = UserSummarySerializer(read_only=True)
+    created_by = UserSummarySerializer(read_only=True)
+    updated_by = UserSummarySerializer(read_only=True)
+    total_price_usd = serializers.SerializerMethodField()
+    total_price_with_shipping_usd = serializers.SerializerMethodField()
+    total_price_minus_wallet_usd = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
@@ -184,6 +172,7 @@ class OrderSerializer(serializers.ModelSerializer):
             "qr_code",
             "readable_code",
             "fib_payment_valid_until",
+            "payment_initiation_status",
             "use_wallet",
             "order_lines",
             "country",
@@ -230,6 +219,7 @@ class OrderSerializer(serializers.ModelSerializer):
             "qr_code",
             "readable_code",
             "fib_payment_valid_until",
+            "payment_initiation_status",
             "approved_by",
             "approved_at",
             "rejected_by",
@@ -261,211 +251,177 @@ class OrderSerializer(serializers.ModelSerializer):
             "updated_by",
         )
 
+    def get_total_price_usd(self, obj):
+        return self.to_usd(obj.total_price)
+
+    def get_total_price_with_shipping_usd(self, obj):
+        # same rounding as `Order.total_price_with_shipping_usd`
+        return round(self.to_usd(obj.total_price)) + self.to_usd(obj.shipping_cost)
+
+    def get_total_price_minus_wallet_usd(self, obj):
+        return self.to_usd(obj.total_price_minus_wallet)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load everything the serializer reads in a fixed number of queries,
+        whatever the number of orders.
+        """
+        return queryset.select_related(
+            "approved_by",
+            "rejected_by",
+            "returned_by",
+            "canceled_by",
+            "paid_by",
+            "payment_failed_by",
+            "created_by",
+            "updated_by",
+        ).prefetch_related(
+            Prefetch(
+                "order_lines",
+                queryset=OrderLine.objects.select_related(
+                    "product__category", "created_by"
+                ).prefetch_related("product__images", "order_line_keys__key"),
+            ),
+        )
+
+    @staticmethod
+    def checkout(validated_data, order_lines_data, user):
+        """
+        Validate the cart against one snapshot of its products and persist the
+        order with one insert for the order and one bulk insert for its lines,
+        so the checkout cost does not grow with the number of lines.
+        """
+        # Remove duplicates
+        order_lines_data = [
+            OrderedDict(t) for t in {tuple(d.items()) for d in order_lines_data}
+        ]
+        products = {
+            product.pk: product
+            for product in Product.objects.filter(
+                pk__in={
+                    getattr(data["product"], "pk", data["product"])
+                    for data in order_lines_data
+                }
+            ).prefetch_related("offer_products", "images")
+        }
+
+        # validate the keys demand of the whole cart against the stored stock
+        keys_demand = defaultdict(int)
+        key_products = {}
+        lines = []
+        for order_line_data in order_lines_data:
+            product_id = getattr(
+                order_line_data["product"], "pk", order_line_data["product"]
+            )
+            product = products.get(int(product_id))
+            if product is None:
+                raise serializers.ValidationError(
+                    {"product": f"Invalid pk \"{product_id}\" - object does not exist."}
+                )
+            quantity = int(order_line_data.get("quantity", 1))
+            offer_products = list(product.offer_products.all())
+            for offer_product in offer_products:
+                if offer_product.has_options:
+                    raise serializers.ValidationError(
+                        {
+                            "offer_product": f"Offer Product {product.name} has options, please send the options with the order line"
+                        }
+                    )
+            if offer_products:
+                line_key_products = offer_products
+            elif product.is_key_product:
+                line_key_products = [product]
+            else:
+                line_key_products = []
+            for key_product in line_key_products:
+                key_products[key_product.pk] = key_product
+                keys_demand[key_product.pk] += quantity
+            lines.append((product, {**order_line_data, "quantity": quantity}))
+
+        for product_id, quantity in keys_demand.items():
+            key_product = key_products[product_id]
+            if key_product.keys_unused_count < quantity:
+                raise serializers.ValidationError(
+                    {
+                        "quantity": f"There is no available quantity of keys for product {key_product.name}"
+                    }
+                )
+
+        # price the lines in memory with one query for the wholesale prices
+        wholesale_type = user.wholesale_type if user else None
+        wholesale_prices = {}
+        if wholesale_type is not None:
+            wholesale_prices = dict(
+                ProductWholesalePricing.objects.filter(
+                    product__in=products, wholesale_user_type=wholesale_type
+                ).values_list("product", "price")
+            )
+        order_lines = []
+        for product, order_line_data in lines:
+            order_line_data.pop("product")
+            images = list(product.images.all())
+            order_lines.append(
+                OrderLine(
+                    product=product,
+                    unit_price=wholesale_prices.get(product.pk, product.price),
+                    product_image=images[0].image_file.url if images else None,
+                    created_by=user,
+                    updated_by=user,
+                    **order_line_data,
+                )
+            )
+        total_price = sum(order_line.sub_total for order_line in order_lines)
+
+        order = Order(
+            **validated_data,
+            is_wholesale=wholesale_type is not None,
+            total_price=total_price,
+            created_by=user,
+            updated_by=user,
+        )
+        if (
+            settings.ASYNC_PAYMENT_INITIATION
+            and order.payment_method in Order.GATEWAY_PAYMENT_METHODS
+        ):
+            # the gateway is called by the `initiate_payments` worker once the
+            # order is committed, the client polls `payment` for the links
+            order.payment_initiation_status = Order.PAYMENT_INITIATION_STATUS.queued
+        if order.use_wallet and wholesale_type is not None:
+            if user.wallet_balance - total_price - wholesale_type.negative_limit < 0:
+                raise serializers.ValidationError(
+                    {
+                        "use_wallet": "You don't have enough balance to use from your wallet"
+                    }
+                )
+
+        Order.objects.bulk_create([order])
+        order.notify_created()
+        order.add_to_user_order_stats()
+        for order_line in order_lines:
+            order_line.order = order
+        OrderLine.objects.bulk_create(order_lines)
+        order.use_keys(order_lines)
+
+        order.use_wallet_balance()
+        if order.payment_initiation_status != Order.PAYMENT_INITIATION_STATUS.queued:
+            order.initiate_payment()
+        order.sync_sales_rollup()
+
+        order.send_order_pending_email()
+        return order
+
     def create(self, validated_data):
         with transaction.atomic():
             order_lines_data = validated_data.pop("order_lines")
-            user = validated_data.pop("user", None)
-            # Remove duplicates
-            order_lines_data = [
-                OrderedDict(t) for t in {tuple(d.items()) for d in order_lines_data}
-            ]
-
-            for order_line_data in order_lines_data:
-                product = Product.objects.get(
-                    id=order_line_data.get('product').id)
-
-                # if product.has_options:
-                #     raise serializers.ValidationError(
-                #         {
-                #             "product": f"Product {product.name} has options, please send the options with the order line"
-                #         }
-                #     )
-                if product.is_key_product and not product.offer_products.exists():
-                    keys_count = ProductKey.objects.filter(
-                        product=product,
-                        is_used=False,
-                    ).count()
-                    if keys_count < order_line_data["quantity"]:
-                        raise serializers.ValidationError(
-                            {
-                                "quantity": f"There is no available quantity of keys for product {product.name}"
-                            }
-                        )
-                elif product.offer_products.exists():
-                    for offer_product in product.offer_products.all():
-                        if offer_product.has_options:
-                            raise serializers.ValidationError(
-                                {
-                                    "offer_product": f"Offer Product {product.name} has options, please send the options with the order line"
-                                }
-                            )
-
-                        keys_count = ProductKey.objects.filter(
-                            product=offer_product,
-                            is_used=False,
-                        ).count()
-                        if keys_count < order_line_data["quantity"]:
-                            raise serializers.ValidationError(
-                                {
-                                    "quantity": f"There is no available quantity of keys for product {offer_product.name}"
-                                }
-                            )
-            is_wholesale = False
-            if user and user.wholesale_type is not None:
-                is_wholesale = True
-            order = Order(**validated_data)
-            order.save(skip_hooks=True)
-            order.is_wholesale = is_wholesale
-            order.save()
-            order_lines_total_price = 0
-
-            for order_line_data in order_lines_data:
-
-                order_line = OrderLine.objects.create(
-                    order=order, **order_line_data)
-                order_line.use_keys()
-                order_lines_total_price += order_line.sub_total
-
-            order.total_price = order_lines_total_price
-            order.save()
-
-            if user:
-                order.created_by = user
-                order.updated_by = user
-                order.save()
-
-            if order.use_wallet:
-                user = self.context["request"].user
-                wholesale_type = user.wholesale_type
-                if wholesale_type is not None:
-                    balance = user.wallet_balance
-                    negative_limit = wholesale_type.negative_limit
-                    if balance - order.total_price - negative_limit < 0:
-                        raise serializers.ValidationError(
-                            {
-                                "use_wallet": "You don't have enough balance to use from your wallet"
-                            }
-                        )
-            order.use_wallet_balance()
-            if order.payment_method == Order.PAYMENT_METHOD.zain_cash:
-                order.create_zain_cash_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.credit_card:
-                order.create_qi_card_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.fast_pay:
-                order.create_fastpay_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.fib:
-                order.create_fib_transaction()
-
-            Order.objects.get(id=order.id).send_order_pending_email()
-            return order
+            user = validated_data.pop("user", None) or get_current_user()
+            return OrderSerializer.checkout(validated_data, order_lines_data, user)
 
     def create_admin(validated_data):
         with transaction.atomic():
             order_lines_data = validated_data.pop("order_lines")
             user = User.objects.get(id=validated_data.pop("user"))
-            # Remove duplicates
-            order_lines_data = [
-                OrderedDict(t) for t in {tuple(d.items()) for d in order_lines_data}
-            ]
-
-            for order_line_data in order_lines_data:
-                product = Product.objects.get(
-                    id=order_line_data.get('product'))
-
-                # if product.has_options:
-                #     raise serializers.ValidationError(
-                #         {
-                #             "product": f"Product {product.name} has options, please send the options with the order line"
-                #         }
-                #     )
-                if product.is_key_product and not product.offer_products.exists():
-                    keys_count = ProductKey.objects.filter(
-                        product=product,
-                        is_used=False,
-                    ).count()
-                    if keys_count < order_line_data["quantity"]:
-                        raise serializers.ValidationError(
-                            {
-                                "quantity": f"There is no available quantity of keys for product {product.name}"
-                            }
-                        )
-                elif product.offer_products.exists():
-                    for offer_product in product.offer_products.all():
-                        if offer_product.has_options:
-                            raise serializers.ValidationError(
-                                {
-                                    "offer_product": f"Offer Product {product.name} has options, please send the options with the order line"
-                                }
-                            )
-
-                        keys_count = ProductKey.objects.filter(
-                            product=offer_product,
-                            is_used=False,
-                        ).count()
-                        if keys_count < order_line_data["quantity"]:
-                            raise serializers.ValidationError(
-                                {
-                                    "quantity": f"There is no available quantity of keys for product {offer_product.name}"
-                                }
-                            )
-
-            order = Order(**validated_data)
-            order.save(skip_hooks=True)
-            is_wholesale = False
-            if user and user.wholesale_type is not None:
-                is_wholesale = True
-            order.is_wholesale = is_wholesale
-            order.save()
-            order_lines_total_price = 0
-
-            for order_line_data in order_lines_data:
-                # return
-                product = Product.objects.get(
-                    id=order_line_data.pop('product'))
-                order_line = OrderLine.objects.create(
-                    order=order,
-                    product=product,
-                    ** order_line_data)
-                order_line.created_by = user
-                order_line.updated_by = user
-                order_line.save()
-                order_line.use_keys()
-                order_lines_total_price += order_line.sub_total
-
-            order.total_price = order_lines_total_price
-            order.save()
-
-            if user:
-                order.created_by = user
-                order.updated_by = user
-                order.save()
-
-            if order.use_wallet:
-
-                wholesale_type = user.wholesale_type
-                if wholesale_type is not None:
-                    balance = user.wallet_balance
-                    negative_limit = wholesale_type.negative_limit
-                    if balance - order.total_price - negative_limit < 0:
-                        raise serializers.ValidationError(
-                            {
-                                "use_wallet": "You don't have enough balance to use from your wallet"
-                            }
-                        )
-                        
-            order.use_wallet_balance()
-            if order.payment_method == Order.PAYMENT_METHOD.zain_cash:
-                order.create_zain_cash_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.credit_card:
-                order.create_qi_card_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.fast_pay:
-                order.create_fastpay_transaction()
-            elif order.payment_method == Order.PAYMENT_METHOD.fib:
-                order.create_fib_transaction()
-                
-            Order.objects.get(id=order.id).send_order_pending_email()
-                
-            return order
+            return OrderSerializer.checkout(validated_data, order_lines_data, user)
 
     def delete_bulk(validated_data):
         with transaction.atomic():
@@ -475,45 +431,35 @@ class OrderSerializer(serializers.ModelSerializer):
 
         return {"message": "Orders deleted successfully"}
 
-    def get_approved_by(self, obj):
-        if obj.approved_by:
-            return CustomUserDetailsSerializer(obj.approved_by).data
-        return None
-
-    def get_rejected_by(self, obj):
-        if obj.rejected_by:
-            return CustomUserDetailsSerializer(obj.rejected_by).data
-        return None
-
-    def get_returned_by(self, obj):
-        if obj.returned_by:
-            return CustomUserDetailsSerializer(obj.returned_by).data
-        return None
-
-    def get_canceled_by(self, obj):
-        if obj.canceled_by:
-            return CustomUserDetailsSerializer(obj.canceled_by).data
-        return None
-
-    def get_paid_by(self, obj):
-        if obj.paid_by:
-            return CustomUserDetailsSerializer(obj.paid_by).data
-        return None
-
-    def get_payment_failed_by(self, obj):
-        if obj.payment_failed_by:
-            return CustomUserDetailsSerializer(obj.payment_failed_by).data
-        return None
-
-    def get_created_by(self, obj):
-        if obj.created_by:
-            return CustomUserDetailsSerializer(obj.created_by).data
-        return None
-
-    def get_updated_by(self, obj):
-        if obj.updated_by:
-            return CustomUserDetailsSerializer(obj.updated_by).data
-        return None
+
+class OrderBulkTransitionSerializer(serializers.Serializer):
+    # the most orders changed by one request
+    MAX_ORDERS = 1000
+
+    transition = serializers.ChoiceField(choices=Order.TRANSITIONS)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        max_length=MAX_ORDERS,
+        help_text="The orders to change",
+    )
+    all_filtered = serializers.BooleanField(
+        default=False,
+        help_text="Change all the orders matching the list filters instead of `ids`",
+    )
+    notes = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        default="",
+        help_text="Approved or rejected notes",
+    )
+
+    def validate(self, attrs):
+        if not attrs.get("ids") and not attrs["all_filtered"]:
+            raise serializers.ValidationError(
+                {"ids": "Pass the order ids or set `all_filtered`."}
+            )
+        return attrs
 
 
 class SupportTicketSerializer(serializers.ModelSerializer):
@@ -0,0 +1,664 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIClient
+
+from authentication.models import Transaction, User
+from notifications.models import Notification
+from orders.gateways import FibClient, GatewayClient
+from orders.models import (
+    DailySalesRollup,
+    Order,
+    OrderEmail,
+    OrderLine,
+    OrderLineKey,
+)
+from orders.serializers import OrderSerializer
+from products.models import Category, Product, ProductKey, SubCategory
+
+
+def create_product(index=0, keys=0, price=1000):
+    category, _ = Category.objects.get_or_create(name="Games", name_ar="Games")
+    sub_category, _ = SubCategory.objects.get_or_create(
+        name="Cards", name_ar="Cards", category=category
+    )
+    product = Product.objects.create(
+        name=f"Product {index}",
+        name_ar=f"Product {index}",
+        price=price,
+        SKU_code=f"SKU-{index}",
+        category=category,
+        sub_category=sub_category,
+        is_key_product=keys > 0,
+    )
+    if keys:
+        ProductKey.objects.bulk_create(
+            ProductKey(product=product, key=f"KEY-{index}-{n}") for n in range(keys)
+        )
+        Product.objects.filter(pk=product.pk).update(keys_unused_count=keys)
+        product.refresh_from_db()
+    return product
+
+
+def create_order(user, product, quantity):
+    order = Order(created_by=user, updated_by=user)
+    Order.objects.bulk_create([order])
+    order_line = OrderLine(
+        order=order,
+        product=product,
+        quantity=quantity,
+        unit_price=product.price,
+        created_by=user,
+        updated_by=user,
+    )
+    OrderLine.objects.bulk_create([order_line])
+    return order_line
+
+
+class ReserveKeysConcurrencyTests(TransactionTestCase):
+    def test_concurrent_checkouts_never_share_a_key(self):
+        user = User.objects.create_user(username="buyer", password="secret")
+        product = create_product(keys=6)
+        order_lines = [create_order(user, product, quantity=3) for _ in range(2)]
+        # both transactions are open before either one reserves its keys
+        barrier = threading.Barrier(len(order_lines))
+        errors = []
+
+        def checkout(order_line):
+            try:
+                with transaction.atomic():
+                    barrier.wait(timeout=10)
+                    order_line.use_keys()
+            except Exception as error:  # noqa: BLE001 - reported by the test
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=checkout, args=(order_line,))
+            for order_line in order_lines
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        reserved = [
+            set(
+                OrderLineKey.objects.filter(order_line=order_line).values_list(
+                    "key_id", flat=True
+                )
+            )
+            for order_line in order_lines
+        ]
+        self.assertEqual([len(keys) for keys in reserved], [3, 3])
+        self.assertEqual(reserved[0] & reserved[1], set())
+        for order_line, keys in zip(order_lines, reserved):
+            self.assertEqual(
+                set(
+                    ProductKey.objects.filter(
+                        used_order=order_line.order, is_used=True
+                    ).values_list("pk", flat=True)
+                ),
+                keys,
+            )
+        product.refresh_from_db()
+        self.assertEqual(product.keys_unused_count, 0)
+        self.assertEqual(product.keys_used_count, 6)
+
+
+class CheckoutQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="secret")
+        cls.products = [create_product(index, keys=50) for index in range(20)]
+        # an offer sells the keys of its offer products
+        cls.offer = create_product(20)
+        cls.offer.offer_products.set(cls.products[:2])
+
+    def checkout(self, lines):
+        order_lines_data = [
+            OrderedDict(product=product, quantity=2)
+            for product in [self.offer, *self.products[: lines - 1]]
+        ]
+        return OrderSerializer.checkout(
+            {"payment_method": Order.PAYMENT_METHOD.cash},
+            order_lines_data,
+            self.user,
+        )
+
+    def test_checkout_queries_do_not_grow_with_the_cart(self):
+        # the first checkout also fills the per process caches
+        self.checkout(1)
+        with CaptureQueriesContext(connection) as single_line:
+            self.checkout(1)
+        for lines in (5, 20):
+            with self.subTest(lines=lines):
+                with self.assertNumQueries(len(single_line)):
+                    order = self.checkout(lines)
+                self.assertEqual(order.order_lines.count(), lines)
+                self.assertEqual(order.total_price, lines * 2 * 1000)
+                # the offer line gets the keys of both its offer products
+                self.assertEqual(
+                    OrderLineKey.objects.filter(order_line__order=order).count(),
+                    (lines + 1) * 2,
+                )
+        for product in self.products:
+            product.refresh_from_db()
+            self.assertEqual(
+                product.keys_unused_count,
+                ProductKey.objects.filter(product=product, is_used=False).count(),
+            )
+
+
+class OrderListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="secret")
+        cls.staff = User.objects.create_user(
+            username="staff", password="secret", is_staff=True
+        )
+        cls.products = [create_product(0, keys=50), create_product(1)]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_orders(self, count):
+        for _ in range(count):
+            OrderSerializer.checkout(
+                {"payment_method": Order.PAYMENT_METHOD.cash},
+                [OrderedDict(product=product, quantity=2) for product in self.products],
+                self.user,
+            )
+
+    def assert_flat_query_count(self, user):
+        self.client.force_authenticate(user)
+        url = reverse("orders:order-list")
+        self.create_orders(1)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as single_order:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.create_orders(9)
+        with self.assertNumQueries(len(single_order)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 10)
+
+    def test_customer_order_list_queries_do_not_grow_with_the_orders(self):
+        self.assert_flat_query_count(self.user)
+
+    def test_staff_order_list_queries_do_not_grow_with_the_orders(self):
+        self.assert_flat_query_count(self.staff)
+
+
+class StubGateway:
+    """
+    Local HTTP server answering each path with its scripted
+    `(status, body, delay)` responses in turn, the last one is repeated.
+    """
+
+    def __init__(self, routes):
+        self.routes = {path: list(responses) for path, responses in routes.items()}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                stub.requests.append(
+                    (self.command, self.path, self.headers.get("Authorization"))
+                )
+                responses = stub.routes[self.path]
+                status, body, delay = (
+                    responses.pop(0) if len(responses) > 1 else responses[0]
+                )
+                if callable(body):
+                    status, body = body(self.headers)
+                time.sleep(delay)
+                content = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client timed out and closed the connection
+                    pass
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def calls(self, path):
+        return [request for request in self.requests if request[1] == path]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(
+    PAYMENT_GATEWAY_RETRIES=2,
+    PAYMENT_GATEWAY_CONNECT_TIMEOUT=1,
+    PAYMENT_GATEWAY_READ_TIMEOUT=2,
+)
+class GatewayClientTests(SimpleTestCase):
+    def test_get_is_retried_on_5xx(self):
+        routes = {"/status": [(503, {}, 0), (502, {}, 0), (200, {"paid": True}, 0)]}
+        with StubGateway(routes) as stub:
+            response = GatewayClient("stub").get(stub.url("/status"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"paid": True})
+        self.assertEqual(len(stub.calls("/status")), 3)
+
+    def test_post_is_not_retried_on_5xx(self):
+        routes = {"/pay": [(503, {}, 0), (200, {}, 0)]}
+        with StubGateway(routes) as stub:
+            response = GatewayClient("stub").post(stub.url("/pay"), json={})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(stub.calls("/pay")), 1)
+
+    @override_settings(PAYMENT_GATEWAY_READ_TIMEOUT=0.2)
+    def test_timeout_raises_without_retrying_the_post(self):
+        routes = {"/pay": [(200, {}, 1)]}
+        with StubGateway(routes) as stub:
+            with self.assertRaises(APIException), self.assertLogs(
+                "orders.gateways", "WARNING"
+            ):
+                GatewayClient("stub").post(stub.url("/pay"), json={})
+            self.assertEqual(len(stub.calls("/pay")), 1)
+
+
+class FibClientTests(TestCase):
+    def setUp(self):
+        cache.delete(FibClient.TOKEN_CACHE_KEY)
+        self.addCleanup(cache.delete, FibClient.TOKEN_CACHE_KEY)
+
+    def test_token_is_refreshed_once_on_401(self):
+        def payment(headers):
+            if headers["Authorization"] == "Bearer new-token":
+                return 201, {"paymentId": "1"}
+            return 401, {}
+
+        routes = {
+            "/token": [
+                (200, {"access_token": "old-token", "expires_in": 3600}, 0),
+                (200, {"access_token": "new-token", "expires_in": 3600}, 0),
+            ],
+            "/payments": [(None, payment, 0)],
+        }
+        with StubGateway(routes) as stub, override_settings(
+            FIB_AUTH_URL=stub.url("/token"),
+            FIB_CLIENT_ID="client",
+            FIB_CLIENT_SECRET="secret",
+        ):
+            client = FibClient("stub fib")
+            response = client.authorized_request("POST", stub.url("/payments"))
+            self.assertEqual(response.status_code, 201)
+            # the renewed token is reused by the next calls
+            response = client.authorized_request("POST", stub.url("/payments"))
+            self.assertEqual(response.status_code, 201)
+            # and by the clients of the other processes, through the cache
+            response = FibClient("other fib").authorized_request(
+                "POST", stub.url("/payments")
+            )
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(len(stub.calls("/token")), 2)
+        self.assertEqual(
+            [authorization for _, _, authorization in stub.calls("/payments")],
+            ["Bearer old-token"] + ["Bearer new-token"] * 3,
+        )
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError("Connection refused")
+
+    def send_messages(self, email_messages):
+        raise AssertionError("The connection is never opened")
+
+
+class OrderEmailTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="secret"
+        )
+        self.emails = [
+            OrderEmail.queue(create_order(user, create_product(index), 1).order, kind)
+            for index, kind in enumerate(
+                [OrderEmail.KIND.pending, OrderEmail.KIND.rejected]
+            )
+        ]
+
+    def test_sends_the_due_emails(self):
+        self.assertEqual(OrderEmail.send_batch(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        for email in self.emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, OrderEmail.STATUS.sent)
+            self.assertEqual(email.attempts, 1)
+
+    @override_settings(EMAIL_BACKEND="orders.tests.UnreachableEmailBackend")
+    def test_unreachable_mail_server_fails_the_batch_with_backoff(self):
+        self.assertEqual(OrderEmail.send_batch(), (0, 2))
+        for email in self.emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, OrderEmail.STATUS.queued)
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(email.last_error, "Connection refused")
+            self.assertGreater(email.next_attempt_at, email.modified)
+        # not due yet
+        self.assertEqual(OrderEmail.send_batch(), (0, 0))
+
+        OrderEmail.objects.update(
+            attempts=OrderEmail.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now()
+        )
+        self.assertEqual(OrderEmail.send_batch(), (0, 2))
+        self.assertEqual(
+            set(OrderEmail.objects.values_list("status", "attempts")),
+            {(OrderEmail.STATUS.failed, OrderEmail.MAX_ATTEMPTS)},
+        )
+
+
+class BulkTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="secret"
+        )
+        cls.staff = User.objects.create_user(
+            username="staff", password="secret", is_staff=True
+        )
+        cls.product = create_product(0)
+        Product.objects.filter(pk=cls.product.pk).update(cashback_amount=100)
+        cls.product.refresh_from_db()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def checkout(self, quantity=2):
+        return OrderSerializer.checkout(
+            {"payment_method": Order.PAYMENT_METHOD.cash},
+            [OrderedDict(product=self.product, quantity=quantity)],
+            self.user,
+        )
+
+    def bulk_transition(self, transition, orders):
+        response = self.client.post(
+            reverse("orders:order-bulk-transition"),
+            {"transition": transition, "ids": [order.pk for order in orders]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return {result["id"]: result for result in response.data["results"]}
+
+    def rollup_totals(self):
+        return DailySalesRollup.objects.aggregate(
+            quantity=Sum("quantity"), revenue=Sum("revenue"), orders=Sum("orders_count")
+        )
+
+    def test_cashback_is_credited_once_per_line(self):
+        approved, raced, pending = [self.checkout() for _ in range(3)]
+        response = self.client.patch(
+            reverse("orders:order-approve-order", args=[approved.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        # the single endpoint records the cashback before saving the order, a
+        # request that lost the race against the bulk action left it behind
+        for order_line in raced.order_lines.all():
+            order_line.preform_cashback()
+
+        results = self.bulk_transition(
+            Order.TRANSITIONS.approve_order, [approved, raced, pending]
+        )
+
+        self.assertFalse(results[approved.pk]["success"])
+        self.assertTrue(results[raced.pk]["success"])
+        self.assertTrue(results[pending.pk]["success"])
+        for order in (approved, raced, pending):
+            self.assertEqual(
+                list(
+                    Transaction.objects.filter(related_order=order).values_list(
+                        "idempotency_key", "amount"
+                    )
+                ),
+                [(f"order:{order.pk}:cashback:{order.order_lines.get().pk}", 200)],
+            )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.wallet_balance, 3 * 200)
+
+    def test_invalid_orders_are_reported_and_left_unchanged(self):
+        rejected, pending = self.checkout(), self.checkout()
+        self.bulk_transition(Order.TRANSITIONS.reject_order, [rejected])
+        rejected.refresh_from_db()
+        before = Order.objects.values().get(pk=rejected.pk)
+
+        results = self.bulk_transition(
+            Order.TRANSITIONS.approve_order, [rejected, pending]
+        )
+
+        self.assertEqual(
+            results[rejected.pk],
+            {
+                "id": rejected.pk,
+                "order_number": rejected.order_number,
+                "success": False,
+                "detail": "Order is not in pending status.",
+            },
+        )
+        self.assertEqual(Order.objects.values().get(pk=rejected.pk), before)
+        self.assertFalse(Transaction.objects.filter(related_order=rejected).exists())
+        self.assertEqual(
+            OrderEmail.objects.filter(
+                order=rejected, kind=OrderEmail.KIND.approved
+            ).count(),
+            0,
+        )
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, Order.STATUS.approved)
+
+    def test_reject_and_return_remove_the_orders_from_the_sales(self):
+        rejected, returned, kept = [self.checkout() for _ in range(3)]
+        self.assertEqual(
+            self.rollup_totals(), {"quantity": 6, "revenue": 12000, "orders": 3}
+        )
+
+        self.bulk_transition(Order.TRANSITIONS.reject_order, [rejected])
+        self.bulk_transition(Order.TRANSITIONS.return_order, [returned])
+
+        self.assertEqual(
+            self.rollup_totals(), {"quantity": 2, "revenue": 4000, "orders": 1}
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_count, 2)
+        self.assertEqual(
+            dict(Order.objects.values_list("pk", "in_sales_rollup")),
+            {rejected.pk: False, returned.pk: False, kept.pk: True},
+        )
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="secret"
+        )
+        cls.products = [
+            create_product(index, price=1000 * (index + 1)) for index in range(3)
+        ]
+
+    def checkout(self, *products):
+        return OrderSerializer.checkout(
+            {"payment_method": Order.PAYMENT_METHOD.cash},
+            [OrderedDict(product=product, quantity=2) for product in products],
+            self.user,
+        )
+
+    def snapshot(self):
+        keys = ("day", "product", "payment_method", "is_wholesale")
+        totals = (
+            "quantity",
+            "revenue",
+            "orders_count",
+            "wallet_amount",
+            "wallet_orders_count",
+        )
+        rows = {
+            tuple(row[key] for key in keys): tuple(row[total] for total in totals)
+            for row in DailySalesRollup.objects.values(*keys, *totals)
+            # the rebuild does not keep the rows emptied by removed orders
+            if any(row[total] for total in totals)
+        }
+        return rows, dict(Product.objects.values_list("pk", "sold_count"))
+
+    def test_rebuild_matches_the_incremental_rollup(self):
+        first, second, third = self.products
+        canceled = self.checkout(first, second)
+        approved = self.checkout(second, third)
+        self.checkout(first, third)
+        canceled.status = Order.STATUS.canceled
+        canceled.save()
+        approved.status = Order.STATUS.approved
+        approved.save()
+
+        incremental = self.snapshot()
+        self.assertEqual(incremental[1], {first.pk: 2, second.pk: 2, third.pk: 4})
+        call_command("rebuild_sales_rollup", stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_stale_copies_of_an_order_are_removed_once(self):
+        order = self.checkout(self.products[0])
+        copies = [Order.objects.get(pk=order.pk) for _ in range(2)]
+        for copy in copies:
+            # both saves saw the order in the rollup before either removed it
+            copy.status = Order.STATUS.canceled
+            DailySalesRollup.apply([copy], -1)
+
+        self.assertEqual(
+            DailySalesRollup.objects.aggregate(
+                orders=Sum("orders_count"), quantity=Sum("quantity")
+            ),
+            {"orders": 0, "quantity": 0},
+        )
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].sold_count, 0)
+
+
+class CancelExpiredTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="buyer", email="buyer@example.com", password="secret"
+        )
+        cls.product = create_product(0, keys=20)
+
+    def checkout(self, age=timedelta(0), **fields):
+        order = OrderSerializer.checkout(
+            {"payment_method": Order.PAYMENT_METHOD.cash},
+            [OrderedDict(product=self.product, quantity=2)],
+            self.user,
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created=timezone.now() - age, **fields
+        )
+        return order
+
+    def test_cancels_the_expired_orders_only(self):
+        now = timezone.now()
+        expired = self.checkout(age=timedelta(minutes=20))
+        expired_fib = self.checkout(
+            payment_method=Order.PAYMENT_METHOD.fib,
+            fib_payment_valid_until=now - timedelta(minutes=1),
+        )
+        valid_fib = self.checkout(
+            age=timedelta(minutes=20),
+            payment_method=Order.PAYMENT_METHOD.fib,
+            fib_payment_valid_until=now + timedelta(minutes=5),
+        )
+        paid = self.checkout(
+            age=timedelta(minutes=20), payment_status=Order.PAYMENT_STATUS.paid
+        )
+        fresh = self.checkout()
+
+        self.assertEqual(Order.cancel_expired(chunk_size=1), 2)
+
+        orders = {
+            order.pk: order
+            for order in Order.objects.filter(
+                pk__in=[expired.pk, expired_fib.pk, valid_fib.pk, paid.pk, fresh.pk]
+            )
+        }
+        for order in (expired, expired_fib):
+            order = orders[order.pk]
+            self.assertEqual(order.status, Order.STATUS.canceled)
+            self.assertIsNotNone(order.canceled_at)
+            self.assertFalse(order.in_sales_rollup)
+            self.assertFalse(
+                OrderLineKey.objects.filter(order_line__order=order).exists()
+            )
+            self.assertFalse(ProductKey.objects.filter(used_order=order).exists())
+        for order in (valid_fib, paid, fresh):
+            order = orders[order.pk]
+            self.assertEqual(order.status, Order.STATUS.pending)
+            self.assertTrue(order.in_sales_rollup)
+            self.assertEqual(
+                ProductKey.objects.filter(used_order=order, is_used=True).count(), 2
+            )
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.keys_used_count, 6)
+        self.assertEqual(self.product.keys_unused_count, 14)
+        self.assertEqual(self.product.sold_count, 6)
+        self.assertEqual(
+            DailySalesRollup.objects.aggregate(orders=Sum("orders_count"))["orders"],
+            3,
+        )
+        self.assertEqual(
+            set(
+                Notification.objects.filter(
+                    description__contains="not completed in time"
+                ).values_list("object_id", "related_user")
+            ),
+            {(expired.pk, self.user.pk), (expired_fib.pk, self.user.pk)},
+        )
+        # nothing left to cancel
+        self.assertEqual(Order.cancel_expired(), 0)
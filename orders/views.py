@@ -2,10 +2,10 @@ import json
 from collections import defaultdict
 from rest_framework import status
 import jwt
-import requests
 from django.conf import settings
-from django.db.models import Case, Count, DecimalField, F, Sum, When
-from django.db.models.functions import TruncDate, TruncMonth
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.utils.dateparse import parse_date
@@ -20,10 +20,13 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
-from core.utils import StandardLimitOffsetPagination
+from core.export import StreamingExportMixin
+from core.utils import StandardKeysetPagination, StandardLimitOffsetPagination
+from orders import gateways
 from orders.filters import OrderFilter, OrderLineFilter
 from orders.models import Order, SupportTicket
 from orders.serializers import (
+    OrderBulkTransitionSerializer,
     OrderLineSerializer,
     OrderSerializer,
     SupportTicketSerializer,
@@ -31,7 +34,10 @@ from orders.serializers import (
 from orders.stats import OrderStats
 from products.models import ProductImage
 
-from .models import Order, OrderLine
+from .models import DailySalesRollup, Order, OrderLine
+
+# the dashboard tiles can lag behind the orders by this many seconds
+TOP_SOLD_PRODUCTS_CACHE_TIMEOUT = 60
 
 
 @method_decorator(
@@ -236,11 +242,11 @@ from .models import Order, OrderLine
         ],
     ),
 )
-class OrderViews(viewsets.ModelViewSet):
+class OrderViews(StreamingExportMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = OrderSerializer
     model_object = Order
-    pagination_class = StandardLimitOffsetPagination
+    pagination_class = StandardKeysetPagination
     filter_backends = [
         filters.SearchFilter,
         filters.OrderingFilter,
@@ -254,11 +260,29 @@ class OrderViews(viewsets.ModelViewSet):
         "created_by__email",
         "payment_method",
     ]
+    export_filename = "orders"
+    export_fields = (
+        ("ID", "id"),
+        ("Order Number", "order_number"),
+        ("Created", "created"),
+        ("User", "created_by__username"),
+        ("Email", "created_by__email"),
+        ("Status", "status"),
+        ("Payment Method", "payment_method"),
+        ("Payment Status", "payment_status"),
+        ("Total Price", "total_price"),
+        ("Paid From Wallet", "paid_amount_from_wallet"),
+        ("Wholesale", "is_wholesale"),
+        ("Approved At", "approved_at"),
+        ("Paid At", "paid_at"),
+    )
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all().order_by("created")
-        return Order.objects.filter(created_by=self.request.user.id).order_by("created")
+            queryset = Order.objects.all()
+        else:
+            queryset = Order.objects.filter(created_by=self.request.user.id)
+        return OrderSerializer.setup_eager_loading(queryset.order_by("created"))
 
     @action(detail=True, methods=["get"])
     def first_view(self, request, *args, **kwargs):
@@ -270,14 +294,38 @@ class OrderViews(viewsets.ModelViewSet):
             raise serializers.ValidationError(
                 {"payment_status": "Order is not paid yet."}
             )
-        instance.is_viewed = True
-        for order_line in instance.order_lines.all():
-            for product_key in order_line.order_line_keys.all():
-                product_key.key.is_viewed = True
-                product_key.save()
-        instance.save()
+        instance.set_order_and_keys_as_viewed()
         serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        return Response(
+            {**serializer.data, "revealed_keys": instance.revealed_keys()}
+        )
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Payment links of the order, while the payment initiation is queued "
+            "or processing poll again after the Retry-After seconds"
+        ),
+    )
+    @action(detail=True, methods=["get"])
+    def payment(self, request, *args, **kwargs):
+        order = self.get_object()
+        headers = {}
+        if order.payment_initiation_status in (
+            Order.PAYMENT_INITIATION_STATUS.queued,
+            Order.PAYMENT_INITIATION_STATUS.processing,
+        ):
+            headers["Retry-After"] = "1"
+        return Response(
+            {
+                "payment_initiation_status": order.payment_initiation_status,
+                "payment_status": order.payment_status,
+                "transaction_url": order.transaction_url,
+                "qr_code": order.qr_code,
+                "readable_code": order.readable_code,
+                "fib_payment_valid_until": order.fib_payment_valid_until,
+            },
+            headers=headers,
+        )
 
     @swagger_auto_schema(
         auto_schema=None,
@@ -334,7 +382,7 @@ class OrderViews(viewsets.ModelViewSet):
             "X-Terminal-Id": settings.QICARD_TERMINAL_ID,
         }
 
-        response = requests.get(
+        response = gateways.qi_card.get(
             url, headers=headers, auth=HTTPBasicAuth(username, password)
         )
         if response.status_code != 200:
@@ -434,7 +482,7 @@ class OrderViews(viewsets.ModelViewSet):
         }
         headers = {"Accept": "application/json",
                    "Content-Type": "application/json"}
-        response = requests.post(url, data=json.dumps(data), headers=headers)
+        response = gateways.fastpay.post(url, data=json.dumps(data), headers=headers)
         if response.status_code != 200:
             order.payment_status = Order.PAYMENT_STATUS.failed
             order.save()
@@ -454,6 +502,18 @@ class OrderViews(viewsets.ModelViewSet):
         order.save()
         return HttpResponseRedirect(redirect_to=client_transaction_success_url)
 
+    @swagger_auto_schema(
+        operation_description="Latency metrics of the payment gateways calls of this worker",
+    )
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="gateway-metrics",
+        permission_classes=[IsAdminUser],
+    )
+    def gateway_metrics(self, request):
+        return Response(gateways.gateway_metrics())
+
     @action(
         detail=False,
         methods=["post"],
@@ -469,9 +529,7 @@ class OrderViews(viewsets.ModelViewSet):
         order = Order.objects.filter(transaction_id=transaction_id).first()
         url = settings.FIB_PAYMENT_STATUS_URL.format(
             transaction_id=transaction_id)
-        access_token = order.auth_fib()
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers)
+        response = gateways.fib.authorized_request("GET", url)
         response_data = response.json()
         if response_data.get("status", "error") == "PAID":
             order.payment_status = Order.PAYMENT_STATUS.paid
@@ -692,6 +750,56 @@ class OrderViews(viewsets.ModelViewSet):
             }
         )
 
+    @swagger_auto_schema(
+        operation_description=(
+            "Approve, reject, return or mark as paid many orders at once, the "
+            "orders of `ids` or all the orders matching the list filters"
+        ),
+        request_body=OrderBulkTransitionSerializer,
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        permission_classes=[IsAdminUser],
+    )
+    def bulk_transition(self, request, *args, **kwargs):
+        serializer = OrderBulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        orders = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        if data.get("ids"):
+            orders = orders.filter(pk__in=data["ids"])
+        elif orders.count() > OrderBulkTransitionSerializer.MAX_ORDERS:
+            raise serializers.ValidationError(
+                {
+                    "all_filtered": "Too many orders, narrow the filters to at most "
+                    f"{OrderBulkTransitionSerializer.MAX_ORDERS} orders."
+                }
+            )
+        results = Order.bulk_transition(
+            orders, data["transition"], request.user, data["notes"]
+        )
+        found = {result["id"] for result in results}
+        results += [
+            {
+                "id": order_id,
+                "order_number": None,
+                "success": False,
+                "detail": "Order not found.",
+            }
+            for order_id in data.get("ids", [])
+            if order_id not in found
+        ]
+        succeeded = sum(result["success"] for result in results)
+        return Response(
+            {
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+                "results": results,
+            }
+        )
+
     @swagger_auto_schema(
         operation_description="create order for user",
         request_body=openapi.Schema(
@@ -814,7 +922,7 @@ class OrderViews(viewsets.ModelViewSet):
         url_path="total_sold_per_product_per_day",
     )
     def total_sold_per_product_per_day(self, request):
-        queryset = OrderLine.objects.all().order_by("-created")
+        queryset = DailySalesRollup.objects.filter(product__isnull=False)
 
         start_date = request.query_params.get("start_date")
         end_date = request.query_params.get("end_date")
@@ -831,7 +939,7 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"start_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__gte=start_date)
+            queryset = queryset.filter(day__gte=start_date)
 
         if end_date:
             try:
@@ -842,19 +950,19 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"end_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__lte=end_date)
+            queryset = queryset.filter(day__lte=end_date)
 
         if product_name:
             queryset = queryset.filter(product__name__icontains=product_name)
             
         if is_wholesale:
-            queryset = queryset.filter(order__is_wholesale=True if is_wholesale.lower() == "wholesale" else False)
+            queryset = queryset.filter(is_wholesale=True if is_wholesale.lower() == "wholesale" else False)
 
         results = (
-            queryset.annotate(day=TruncDate("created"))
-            .values("product__name", "day")
+            queryset.values("product__name", "day")
             .annotate(total_sold=Sum("quantity"))
-            .annotate(total_revenue=Sum(F("quantity") * F("product__price")))
+            .annotate(total_revenue=Sum("revenue"))
+            .filter(total_sold__gt=0)
             .order_by("day", "product__name")
         )
 
@@ -899,7 +1007,7 @@ class OrderViews(viewsets.ModelViewSet):
         
     )
     def total_sold_per_product_per_month(self, request):
-        queryset = OrderLine.objects.all().order_by("-created")
+        queryset = DailySalesRollup.objects.filter(product__isnull=False)
 
         start_date = request.query_params.get("start_date")
         end_date = request.query_params.get("end_date")
@@ -914,7 +1022,7 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"start_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__gte=start_date)
+            queryset = queryset.filter(day__gte=start_date)
 
         if end_date:
             try:
@@ -925,16 +1033,17 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"end_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__lte=end_date)
+            queryset = queryset.filter(day__lte=end_date)
 
         if product_name:
             queryset = queryset.filter(product__name__icontains=product_name)
 
         results = (
-            queryset.annotate(month=TruncMonth("created"))
+            queryset.annotate(month=TruncMonth("day"))
             .values("product__name", "month")
             .annotate(total_sold=Sum("quantity"))
-            .annotate(total_revenue=Sum(F("quantity") * F("product__price")))
+            .annotate(total_revenue=Sum("revenue"))
+            .filter(total_sold__gt=0)
             .order_by("-month", "product__name")
         )
 
@@ -973,7 +1082,7 @@ class OrderViews(viewsets.ModelViewSet):
         
     )
     def total_per_payment_method_per_day(self, request):
-        queryset = Order.objects.all()
+        queryset = DailySalesRollup.objects.filter(product__isnull=True)
 
         # Filter by start_date
         start_date = request.query_params.get("start_date")
@@ -988,7 +1097,7 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"start_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__gte=start_date)
+            queryset = queryset.filter(day__gte=start_date)
 
         if end_date:
             try:
@@ -999,27 +1108,18 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"end_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__lte=end_date)
+            queryset = queryset.filter(day__lte=end_date)
 
         # Aggregate total sales and counts per payment method per day
         results = (
-            queryset.annotate(
-                day=TruncDate("created"),
-                wallet_payment=Case(
-                    When(
-                        use_wallet=True,
-                        then=F("paid_amount_from_wallet"),
-                    ),
-                    default=0,
-                    output_field=DecimalField(),
-                ),
-            )
-            .values("payment_method", "day")
+            queryset.values("payment_method", "day")
             .annotate(
-                total_amount=Sum("total_price"),
-                total_wallet_payment=Sum("wallet_payment"),
-                count=Count("id"),
+                total_amount=Sum("revenue"),
+                total_wallet_payment=Sum("wallet_amount"),
+                wallet_count=Sum("wallet_orders_count"),
+                count=Sum("orders_count"),
             )
+            .filter(count__gt=0)
             .order_by("day", "payment_method")
         )
 
@@ -1040,13 +1140,13 @@ class OrderViews(viewsets.ModelViewSet):
                     structured_results[day]["Wallet_count"] = 0
 
                 structured_results[day]["Wallet"] += result["total_wallet_payment"]
-                structured_results[day]["Wallet_count"] += 1
+                structured_results[day]["Wallet_count"] += result["wallet_count"]
 
                 # Update overall totals for wallet
                 overall_totals["Wallet"]["total_amount"] += result[
                     "total_wallet_payment"
                 ]
-                overall_totals["Wallet"]["count"] += 1
+                overall_totals["Wallet"]["count"] += result["wallet_count"]
 
             # Add or update the payment method's total and count
             if payment_method not in structured_results[day]:
@@ -1089,6 +1189,12 @@ class OrderViews(viewsets.ModelViewSet):
                 description="End date for filtering orders (YYYY-MM-DD)",
                 type=openapi.TYPE_STRING,
             ),
+            openapi.Parameter(
+                "limit",
+                openapi.IN_QUERY,
+                description="Number of products to return (default 10, max 100)",
+                type=openapi.TYPE_INTEGER,
+            ),
         ]
     )
     @action(
@@ -1099,10 +1205,19 @@ class OrderViews(viewsets.ModelViewSet):
         url_path="top_sold_products",
     )
     def top_sold_product(self, request):
-        queryset = OrderLine.objects.all().order_by("-created")
+        queryset = DailySalesRollup.objects.filter(product__isnull=False)
 
         start_date = request.query_params.get("start_date")
         end_date = request.query_params.get("end_date")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 100)
+        except ValueError:
+            raise drf_exceptions.ValidationError({"limit": "Must be a number."})
+
+        cache_key = f"orders:top_sold_products:{start_date}:{end_date}:{limit}"
+        structured_results = cache.get(cache_key)
+        if structured_results is not None:
+            return Response(structured_results)
 
         if start_date:
             try:
@@ -1113,7 +1228,7 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"start_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__gte=start_date)
+            queryset = queryset.filter(day__gte=start_date)
 
         # Filter by end_date
         if end_date:
@@ -1125,32 +1240,33 @@ class OrderViews(viewsets.ModelViewSet):
                 raise drf_exceptions.ValidationError(
                     {"end_date": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__lte=end_date)
+            queryset = queryset.filter(day__lte=end_date)
 
+        first_image = (
+            ProductImage.objects.filter(product=OuterRef("product"))
+            .order_by("id")
+            .values("image_file")[:1]
+        )
         results = (
-            queryset.values("product__name")
-            .annotate(total_sold=Sum("quantity"))
-            .order_by("-total_sold")
+            queryset.values("product", "product__name")
+            .annotate(total_sold=Sum("quantity"), total_revenue=Sum("revenue"))
+            .filter(total_sold__gt=0)
+            .annotate(image=Subquery(first_image))
+            .order_by("-total_sold", "product")[:limit]
         )
 
+        image_storage = ProductImage._meta.get_field("image_file").storage
         structured_results = [
             {
+                "product_id": result["product"],
                 "product": result["product__name"],
                 "total_sold": result["total_sold"],
-                "total_revenue": OrderLine.objects.filter(
-                    product__name=result["product__name"]
-                )
-                .first()
-                .sub_total
-                * result["total_sold"],
-                "image": ProductImage.objects.filter(
-                    product__name=result["product__name"]
-                )
-                .first()
-                .image_file.url,
+                "total_revenue": result["total_revenue"],
+                "image": image_storage.url(result["image"]) if result["image"] else None,
             }
             for result in results
         ]
+        cache.set(cache_key, structured_results, TOP_SOLD_PRODUCTS_CACHE_TIMEOUT)
 
         return Response(structured_results)
 
@@ -1269,8 +1385,8 @@ class OrderViews(viewsets.ModelViewSet):
         permission_classes=[IsAdminUser],
     )
     def wholesale_order_per_month(self, request):
-        queryset = Order.objects.filter(
-            created_by__wholesale_type__isnull=False)
+        queryset = DailySalesRollup.objects.filter(
+            product__isnull=True, is_wholesale=True)
 
         start_date = request.query_params.get("start_date")
         end_date = request.query_params.get("end_date")
@@ -1281,10 +1397,10 @@ class OrderViews(viewsets.ModelViewSet):
                 if not start_date:
                     raise ValueError
             except ValueError:
-                raise drf_exceptions(
+                raise drf_exceptions.ValidationError(
                     {"created_after": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__gte=start_date)
+            queryset = queryset.filter(day__gte=start_date)
 
         if end_date:
             try:
@@ -1292,18 +1408,17 @@ class OrderViews(viewsets.ModelViewSet):
                 if not end_date:
                     raise ValueError
             except ValueError:
-                raise drf_exceptions(
+                raise drf_exceptions.ValidationError(
                     {"created_before": "Invalid date format. Use YYYY-MM-DD."}
                 )
-            queryset = queryset.filter(created__date__lte=end_date)
-
-        queryset = queryset.filter(created_by__wholesale_type__isnull=False)
+            queryset = queryset.filter(day__lte=end_date)
 
         results = (
-            queryset.annotate(month=TruncMonth("created"))
+            queryset.annotate(month=TruncMonth("day"))
             .values("month")
-            .annotate(total_orders=Count("id"))
-            .annotate(total_amount=Sum("total_price"))
+            .annotate(total_orders=Sum("orders_count"))
+            .annotate(total_amount=Sum("revenue"))
+            .filter(total_orders__gt=0)
             .order_by("-month")
         )
 
@@ -1341,7 +1456,9 @@ class OrderViews(viewsets.ModelViewSet):
         permission_classes=[IsAdminUser],
     )
     def revenu(self, request):
-        queryset = OrderLine.objects.all()
+        queryset = OrderLine.objects.select_related(
+            "order", "product__category", "created_by"
+        ).prefetch_related("order_line_keys__key", "product__images")
         start_date = request.query_params.get("created_after")
         end_date = request.query_params.get("created_before")
         username = request.query_params.get("username")
@@ -1352,7 +1469,7 @@ class OrderViews(viewsets.ModelViewSet):
                 if not start_date:
                     raise ValueError
             except ValueError:
-                raise drf_exceptions(
+                raise drf_exceptions.ValidationError(
                     {"created_after": "Invalid date format. Use YYYY-MM-DD."}
                 )
             queryset = queryset.filter(created__gte=start_date)
@@ -1363,7 +1480,7 @@ class OrderViews(viewsets.ModelViewSet):
                 if not end_date:
                     raise ValueError
             except ValueError:
-                raise drf_exceptions(
+                raise drf_exceptions.ValidationError(
                     {"created_before": "Invalid date format. Use YYYY-MM-DD."}
                 )
             queryset = queryset.filter(created__lte=end_date)
@@ -1384,19 +1501,44 @@ class OrderViews(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class OrderLineViews(viewsets.GenericViewSet, mixins.ListModelMixin):
+class OrderLineViews(
+    StreamingExportMixin, viewsets.GenericViewSet, mixins.ListModelMixin
+):
     permission_classes = [permissions.IsAdminUser]
     serializer_class = OrderLineSerializer
     model_object = OrderLine
-    pagination_class = StandardLimitOffsetPagination
+    pagination_class = StandardKeysetPagination
     filter_backends = [
         filters.SearchFilter,
         filters.OrderingFilter,
         django_filters_rest_framework.DjangoFilterBackend,
     ]
-    queryset = OrderLine.objects.all()
+    queryset = OrderLine.objects.select_related(
+        "order", "product__category", "created_by"
+    ).prefetch_related("product__images", "order_line_keys__key")
     filterset_class = OrderLineFilter
     ordering_fields = "__all__"
+    export_filename = "order-lines"
+    export_fields = (
+        ("ID", "id"),
+        ("Order Number", "order__order_number"),
+        ("Created", "created"),
+        ("User", "created_by__username"),
+        ("Product", "product__name"),
+        ("Quantity", "quantity"),
+        ("Unit Price", "unit_price"),
+        ("Sub Total", "sub_total"),
+        ("Order Status", "order__status"),
+        ("Payment Method", "order__payment_method"),
+        ("Payment Status", "order__payment_status"),
+    )
+
+    def get_export_queryset(self):
+        return (
+            super()
+            .get_export_queryset()
+            .annotate(sub_total=F("quantity") * F("unit_price"))
+        )
 
 
 class SupportTicketViewSet(viewsets.ModelViewSet):
@@ -1,6 +1,11 @@
+import logging
+import time
+
+from crum import get_current_user
 from django.contrib import admin, messages
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
+from import_export.results import RowResult
 from messages_extends import constants as constants_messages
 
 from products.forms import (
@@ -25,6 +30,8 @@ from products.models import (
     SubCategorySlider,
 )
 
+logger = logging.getLogger(__name__)
+
 
 @admin.register(KeyUsersCount)
 class KeyUsersCountAdmin(admin.ModelAdmin):
@@ -338,17 +345,73 @@ class ProductKeyExportResource(resources.ModelResource):
 
 
 class ProductKeyResource(resources.ModelResource):
+    """
+    Import the keys of one product in bulk: the rows are deduped against the
+    stored keys with one lookup per import, saved with `bulk_create` by batches
+    and the product stock is adjusted once at the end.
+    """
+
     class Meta:
         model = ProductKey
         import_id_fields = ("key",)
         fields = ("key",)
+        use_bulk = True
+        batch_size = 1000
+        force_init_instance = True
+        skip_diff = True
+        report_skipped = False
 
     def __init__(self, **kwargs):
         super().__init__()
         self.product = kwargs.get("product")
+        self.user = get_current_user()
+        self.seen_keys = set()
+        self.existing_keys = set()
+        self.duplicates = 0
+        self.started_at = None
+
+    def before_import(self, dataset, using_transactions, dry_run, **kwargs):
+        self.started_at = time.perf_counter()
+        if "key" in dataset.headers:
+            self.existing_keys = ProductKey.existing_keys(
+                {str(key).strip() for key in dataset["key"] if key}
+            )
+
+    def before_import_row(self, row, row_number=None, **kwargs):
+        row["key"] = str(row.get("key") or "").strip()
+
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        key = row["key"]
+        if not key:
+            return True
+        if key in self.seen_keys or key in self.existing_keys:
+            self.duplicates += 1
+            return True
+        self.seen_keys.add(key)
+        return False
 
     def before_save_instance(self, instance, using_transactions, dry_run):
         instance.product = self.product
+        # bulk_create skips UserStampedModel.save
+        instance.created_by = self.user
+        instance.updated_by = self.user
+
+    def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+        created = result.totals[RowResult.IMPORT_TYPE_NEW]
+        seconds = time.perf_counter() - self.started_at
+        logger.info(
+            "Imported %s keys of product %s in %.1fs (%.0f rows/s), "
+            "%s duplicates skipped",
+            created,
+            self.product.pk if self.product else None,
+            seconds,
+            len(dataset) / (seconds or 1),
+            self.duplicates,
+        )
+        if dry_run or not created or result.has_errors():
+            return
+        Product.adjust_keys_stock(self.product.pk, unused=created, qty=created)
+        self.product.refresh_keys_stock(related_user=self.user)
 
 
 @admin.register(ProductKey)
@@ -1,7 +1,7 @@
-from django.db.models import Q
 from django_filters import rest_framework as django_filters_rest_framework
 
 from products.models import Product
+from products.search import get_product_search_backend
 
 
 class ProductFilter(django_filters_rest_framework.FilterSet):
@@ -11,6 +11,13 @@ class ProductFilter(django_filters_rest_framework.FilterSet):
     is_discounted = django_filters_rest_framework.BooleanFilter(
         field_name="old_price", lookup_expr="isnull", exclude=True
     )
+    price_min = django_filters_rest_framework.NumberFilter(
+        field_name="price", lookup_expr="gte"
+    )
+    price_max = django_filters_rest_framework.NumberFilter(
+        field_name="price", lookup_expr="lte"
+    )
+    created = django_filters_rest_framework.DateFromToRangeFilter()
 
     class Meta:
         model = Product
@@ -22,6 +29,7 @@ class ProductFilter(django_filters_rest_framework.FilterSet):
             "sub_category__id",
             "company__id",
             "is_special_offer",
+            "search_status",
         ]
 
 
@@ -31,7 +39,8 @@ class ProductCustomFilterBackend:
 
     This filter backend provides functionality to filter products based on
     whether they are discounted or not, and also allows searching for products
-    based on a query string.
+    based on a query string through the full text search backend of
+    `products.search` (numbers and dates are filtered by `ProductFilter`).
 
     Attributes:
         None
@@ -53,41 +62,13 @@ class ProductCustomFilterBackend:
     def filter_queryset(self, request, queryset, view):
         search = request.query_params.get("search", None)
         status_display = request.query_params.get("status_display", None)
-        if search:
-            search = search.strip()
-            # take the first 3 characters of the query string
-            # and search for the product name and name_ar
-            # and take the last 3 characters of the query string
-            # but only if the query string is at least 3 characters long
-            # else search with the full query string
-            # we also have to normalize the query string to lowercase
-            # so that the search is case-insensitive
-            if len(search) >= 3:
-                queryset = queryset.filter(
-                    Q(name__istartswith=search[:3])
-                    | Q(name_ar__istartswith=search[:3])
-                    | Q(name__iendswith=search[-3:])
-                    | Q(name_ar__iendswith=search[-3:])
-                    | Q(name__icontains=search)
-                    | Q(name_ar__icontains=search)
-                    | Q(category__name__icontains=search)
-                    | Q(qty__icontains=search)
-                    | Q(price__icontains=search)
-                    | Q(old_price__icontains=search)
-                    | Q(search_status__icontains=search)
-                    | Q(created__icontains=search)
-
-                )
-            else:
-                queryset = queryset.filter(
-                    Q(name__icontains=search) | Q(name_ar__icontains=search)
-                    | Q(category__name__icontains=search)
-                    | Q(qty__icontains=search)
-                    | Q(price__icontains=search)
-                    | Q(old_price__icontains=search)
-                    | Q(search_status__icontains=search)
-                    | Q(created__icontains=search)
-                )
+        if search and search.strip():
+            # the ranking only applies when the client did not ask for an ordering
+            queryset = get_product_search_backend().search(
+                queryset,
+                search.strip(),
+                ordered=not request.query_params.get("ordering"),
+            )
 
         if status_display == "active":
             queryset = queryset.filter(
@@ -0,0 +1,98 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from products.models import Category, Product, SubCategory
+from products.search import (
+    FallbackProductSearchBackend,
+    get_product_search_backend,
+)
+
+WORDS = [
+    "windows", "office", "antivirus", "steam", "playstation", "xbox", "netflix",
+    "spotify", "adobe", "autocad", "kaspersky", "norton", "vpn", "server",
+    "professional", "home", "ultimate", "gift", "card", "subscription",
+]
+
+
+def legacy_search(queryset, search):
+    # the icontains search the products list used before the full text search
+    return queryset.filter(
+        Q(name__icontains=search)
+        | Q(name_ar__icontains=search)
+        | Q(category__name__icontains=search)
+        | Q(qty__icontains=search)
+        | Q(price__icontains=search)
+        | Q(old_price__icontains=search)
+        | Q(search_status__icontains=search)
+        | Q(created__icontains=search)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the latency of the product search backends on generated "
+        "products, everything is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[10_000, 100_000]
+        )
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument(
+            "--queries", nargs="+", default=["windows", "ofice", "gift card", "pro"]
+        )
+
+    def handle(self, *args, **options):
+        backends = {
+            "legacy icontains": lambda qs, search: legacy_search(qs, search),
+            "fallback": FallbackProductSearchBackend().search,
+            "current": get_product_search_backend().search,
+        }
+        with transaction.atomic():
+            category = Category.objects.create(name="Benchmark", name_ar="Benchmark")
+            sub_category = SubCategory.objects.create(
+                category=category, name="Benchmark", name_ar="Benchmark"
+            )
+            created = 0
+            for size in options["sizes"]:
+                products = []
+                for i in range(created, size):
+                    name = " ".join(WORDS[(i * k) % len(WORDS)] for k in (1, 3, 7))
+                    products.append(
+                        Product(
+                            name=f"{name} {i}",
+                            name_ar=f"{name} {i}",
+                            description=f"{name} benchmark product",
+                            price=1000 + i,
+                            SKU_code=uuid.uuid4().hex[:12],
+                            category=category,
+                            sub_category=sub_category,
+                        )
+                    )
+                Product.objects.bulk_create(products, batch_size=2000)
+                created = max(created, size)
+                Product.refresh_search_vectors(Product.objects.filter(category=category))
+
+                self.stdout.write(f"{size} products")
+                for name, search in backends.items():
+                    timings = []
+                    for query in options["queries"]:
+                        for _ in range(options["runs"]):
+                            start = time.perf_counter()
+                            list(
+                                search(Product.objects.all(), query)
+                                .values_list("id", flat=True)[:25]
+                            )
+                            timings.append((time.perf_counter() - start) * 1000)
+                    timings.sort()
+                    self.stdout.write(
+                        f"  {name:<17} p50 {statistics.median(timings):8.2f}ms"
+                        f"  p95 {timings[int(len(timings) * 0.95) - 1]:8.2f}ms"
+                    )
+            transaction.set_rollback(True)
@@ -0,0 +1,62 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products.models import Product, ProductKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the keys of a product from a text file (one key per line) or a "
+        "csv file with a `key` column, streaming it by batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_id", type=int)
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def read_keys(self, file):
+        first_line = file.readline()
+        if first_line.strip().lower() == "key":
+            for row in csv.DictReader(file, fieldnames=["key"]):
+                yield row["key"]
+            return
+        if "," in first_line and "key" in first_line.lower().split(","):
+            file.seek(0)
+            for row in csv.DictReader(file):
+                yield row["key"]
+            return
+        yield first_line
+        yield from file
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(pk=options["product_id"])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} does not exist")
+
+        def progress(stats):
+            self.stdout.write(
+                f"{stats['rows']} rows, {stats['created']} created, "
+                f"{stats['duplicates']} duplicates "
+                f"({stats['rows_per_second']:.0f} rows/s)"
+            )
+
+        with open(options["path"], newline="", encoding="utf-8-sig") as file:
+            with transaction.atomic():
+                stats = ProductKey.import_keys(
+                    product,
+                    self.read_keys(file),
+                    batch_size=options["batch_size"],
+                    progress=progress,
+                )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats['created']} keys of {product.name} in "
+                f"{stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s), "
+                f"skipped {stats['duplicates']} duplicates and {stats['blank']} "
+                "blank rows."
+            )
+        )
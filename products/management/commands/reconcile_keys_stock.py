@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from products.models import Product, ProductKey
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored used/unused keys counters of the key products."
+
+    def handle(self, *args, **options):
+        stock = {
+            row["product"]: (row["used"], row["unused"])
+            for row in ProductKey.objects.order_by()
+            .values("product")
+            .annotate(
+                used=Count("id", filter=Q(is_used=True)),
+                unused=Count("id", filter=Q(is_used=False)),
+            )
+        }
+        drifted = []
+        with transaction.atomic():
+            for product in (
+                Product.objects.select_for_update()
+                .filter(Q(pk__in=stock) | Q(keys_qty__gt=0) | Q(keys_used_count__gt=0))
+                .only(*Product.KEYS_STOCK_FIELDS)
+            ):
+                used, unused = stock.get(product.pk, (0, 0))
+                if (
+                    product.keys_used_count,
+                    product.keys_unused_count,
+                    product.keys_qty,
+                ) != (used, unused, used + unused):
+                    product.keys_used_count = used
+                    product.keys_unused_count = unused
+                    product.keys_qty = used + unused
+                    drifted.append(product)
+            Product.objects.bulk_update(
+                drifted, list(Product.KEYS_STOCK_FIELDS), batch_size=500
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled keys stock of {len(drifted)} products.")
+        )
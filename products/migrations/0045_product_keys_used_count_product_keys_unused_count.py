@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_keys_stock(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductKey = apps.get_model("products", "ProductKey")
+    products = []
+    for row in (
+        ProductKey.objects.order_by()
+        .values("product")
+        .annotate(
+            used=Count("id", filter=Q(is_used=True)),
+            unused=Count("id", filter=Q(is_used=False)),
+        )
+    ):
+        products.append(
+            Product(
+                pk=row["product"],
+                keys_used_count=row["used"],
+                keys_unused_count=row["unused"],
+            )
+        )
+    Product.objects.bulk_update(
+        products, ["keys_used_count", "keys_unused_count"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0044_alter_specialoffer_title_alter_specialoffer_title_ar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="keys_used_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Used Keys"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="keys_unused_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Unused Keys"
+            ),
+        ),
+        migrations.RunPython(fill_keys_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Value
+
+
+def fill_search_vectors(apps, schema_editor):
+    Category = apps.get_model("products", "Category")
+    Product = apps.get_model("products", "Product")
+    for category_id, category_name in Category.objects.values_list("pk", "name"):
+        Product.objects.filter(category_id=category_id).update(
+            search_vector=SearchVector("name", weight="A", config="english")
+            + SearchVector("name_ar", weight="A", config="arabic")
+            + SearchVector(Value(category_name), weight="B", config="english")
+            + SearchVector("description", weight="C", config="english")
+            + SearchVector("description_ar", weight="C", config="arabic")
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0045_product_keys_used_count_product_keys_unused_count"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="product_search_vector_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name"],
+                name="product_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["name_ar"],
+                name="product_name_ar_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
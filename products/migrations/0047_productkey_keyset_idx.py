@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ("products", "0046_product_search_vector"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="productkey",
+            index=models.Index(fields=["-created", "-id"], name="products_key_keyset_idx"),
+        ),
+    ]
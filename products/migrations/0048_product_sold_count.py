@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_sold_count(apps, schema_editor):
+    # from the order lines, the daily sales rollup is filled later by
+    # orders.0045_backfill_daily_sales_rollup
+    Product = apps.get_model("products", "Product")
+    OrderLine = apps.get_model("orders", "OrderLine")
+    Product.objects.bulk_update(
+        [
+            Product(pk=row["product"], sold_count=row["sold"])
+            for row in OrderLine.objects.filter(
+                order__status__in=["pending", "approved"]
+            )
+            .exclude(order__payment_status="failed")
+            .order_by()
+            .values("product")
+            .annotate(sold=Sum("quantity"))
+        ],
+        ["sold_count"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0043_dailysalesrollup_order_in_sales_rollup"),
+        ("products", "0047_productkey_keyset_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="sold_count",
+            field=models.IntegerField(default=0, editable=False, verbose_name="Sold"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["-sold_count", "id"], name="product_sold_count_idx"
+            ),
+        ),
+        migrations.RunPython(fill_sold_count, migrations.RunPython.noop),
+    ]
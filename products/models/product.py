@@ -1,14 +1,21 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
 from computedfields.models import ComputedField, ComputedFieldsModel
 from constance import config
 from crum import get_current_user
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
 from django.utils import timezone
 from django_lifecycle import (
     AFTER_CREATE,
-    AFTER_SAVE,
     AFTER_UPDATE,
-    BEFORE_DELETE,
     LifecycleModelMixin,
     hook,
 )
@@ -23,7 +30,10 @@ from authentication.models import UserStampedModel, WholesaleUserType
 from notifications.models import Notification
 
 from crum import get_current_user
+from core.cache import bump_catalog_version
 from core.utils import get_upload_path
+from products.models.category import Category
+from products.search import product_search_vector
 
 
 class ProductWholesalePricing(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
@@ -55,6 +65,88 @@ class ProductWholesalePricing(LifecycleModelMixin, TimeStampedModel, UserStamped
             return 0
         return round(self.price / config.USD_TO_IQD_EXCHANGE_RATE, 2)
 
+    @classmethod
+    def create_missing(cls, product_id=None, wholesale_user_type_id=None):
+        """
+        Create, at the list price, the missing pricings of a product, of a
+        wholesale type or of all of them in one
+        `INSERT ... SELECT ... ON CONFLICT DO NOTHING`.
+
+        Returns the number of created pricings.
+        """
+        user = get_current_user()
+        user_id = user.pk if user and user.pk else None
+        now = timezone.now()
+        quote = connection.ops.quote_name
+
+        def column(name):
+            return quote(cls._meta.get_field(name).column)
+
+        conditions = []
+        params = [now, now, user_id, user_id]
+        if product_id is not None:
+            conditions.append("product.id = %s")
+            params.append(product_id)
+        if wholesale_user_type_id is not None:
+            conditions.append("wholesale_user_type.id = %s")
+            params.append(wholesale_user_type_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {quote(cls._meta.db_table)} (
+                    {column("product")},
+                    {column("wholesale_user_type")},
+                    {column("price")},
+                    {column("created")},
+                    {column("modified")},
+                    {column("created_by")},
+                    {column("updated_by")}
+                )
+                SELECT product.id, wholesale_user_type.id, product.price,
+                    %s, %s, %s, %s
+                FROM {quote(Product._meta.db_table)} product
+                CROSS JOIN {quote(WholesaleUserType._meta.db_table)} wholesale_user_type
+                {where}
+                ON CONFLICT ({column("product")}, {column("wholesale_user_type")})
+                DO NOTHING
+                """,
+                params,
+            )
+            created = cursor.rowcount
+        if created:
+            bump_catalog_version()
+        return created
+
+    @classmethod
+    def reprice(cls, wholesale_user_type_id, discount_percent, products=None):
+        """
+        Set the prices of a wholesale type to the list price minus
+        `discount_percent` (rounded to the dinar) in one UPDATE, optionally only
+        for the `products` queryset.
+
+        Returns the number of updated pricings.
+        """
+        cls.create_missing(wholesale_user_type_id=wholesale_user_type_id)
+        factor = (Decimal(100) - Decimal(discount_percent)) / Decimal(100)
+        list_price = Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("price")[:1]
+        )
+        queryset = cls.objects.filter(wholesale_user_type_id=wholesale_user_type_id)
+        if products is not None:
+            queryset = queryset.filter(product__in=products)
+        user = get_current_user()
+        updated = queryset.update(
+            price=Round(
+                list_price * Value(factor, output_field=models.DecimalField())
+            ),
+            modified=timezone.now(),
+            updated_by=user if user and user.pk else None,
+        )
+        bump_catalog_version()
+        return updated
+
     def __str__(self):
         return f"{self.product.name} - {self.wholesale_user_type.title} - {self.price}"
 
@@ -65,6 +157,20 @@ class Product(
     class Meta:
         verbose_name_plural = "Products"
         ordering = ["seq"]
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_idx"),
+            GinIndex(
+                fields=["name"],
+                name="product_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(
+                fields=["name_ar"],
+                name="product_name_ar_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            models.Index(fields=["-sold_count", "id"], name="product_sold_count_idx"),
+        ]
 
     TAG = Choices(
         ("new", "New"),
@@ -104,27 +210,29 @@ class Product(
         blank=True,
         null=True,
     )
+    # the key stock is stored on the product and only ever changed with F()
+    # increments (see adjust_keys_stock), a full save never writes it
+    keys_used_count = models.PositiveIntegerField(
+        "Used Keys", default=0, editable=False
+    )
+    keys_unused_count = models.PositiveIntegerField(
+        "Unused Keys", default=0, editable=False
+    )
+    KEYS_STOCK_FIELDS = ("keys_qty", "keys_used_count", "keys_unused_count")
+
+    # all time sold quantity, only ever changed with F() increments by
+    # orders.DailySalesRollup.apply, a full save never writes it
+    sold_count = models.IntegerField("Sold", default=0, editable=False)
+
     keys_qty_used = property(
-        lambda self: (
-            self.product_keys.filter(is_used=True).count()
-            if self.is_key_product
-            else None
-        )
+        lambda self: self.keys_used_count if self.is_key_product else None
     )
     keys_qty_unused = property(
-        lambda self: (
-            self.product_keys.filter(is_used=False).count()
-            if self.is_key_product
-            else None
-        )
+        lambda self: self.keys_unused_count if self.is_key_product else None
     )
-    
+
     keys_qty_unused_2 = property(
-        lambda self: (
-            self.product_keys.filter(is_used=False).count()
-            if self.is_key_product
-            else None
-        )
+        lambda self: self.keys_unused_count if self.is_key_product else None
     )
 
     SKU_code = models.CharField(max_length=100)
@@ -216,6 +324,12 @@ class Product(
         default=5,
     )
 
+    # stock band of the key products, only ever written by evaluate_stock_bands
+    STOCK_BANDS = Choices(
+        ("Good", "good", "Good"),
+        ("Poor", "poor", "Poor"),
+        ("Empty", "empty", "Empty"),
+    )
     search_status = models.CharField(
         max_length=255,
         default="Good"
@@ -225,17 +339,28 @@ class Product(
         default=False
     )
 
-    @hook(AFTER_UPDATE, when="keys_qty_unused")
-    def set_search_status(self):
-        new_status = "Good"
-        if self.keys_qty_unused == 0:
-            new_status = "Empty"
-        elif self.keys_qty_unused <= self.number_of_keys_to_send_notification:
-            new_status = "Poor"
+    # full text search document, only ever written by refresh_search_vectors
+    search_vector = SearchVectorField(null=True, editable=False)
+    SEARCH_FIELDS = ("name", "name_ar", "description", "description_ar", "category")
+
+    @classmethod
+    def refresh_search_vectors(cls, queryset):
+        """
+        Rebuild the search document of the products of `queryset` with one
+        UPDATE per category.
+        """
+        categories = Category.objects.filter(
+            pk__in=queryset.values("category")
+        ).values_list("pk", "name")
+        for category_id, category_name in categories:
+            queryset.filter(category_id=category_id).update(
+                search_vector=product_search_vector(category_name)
+            )
 
-        if self.search_status != new_status:  # Only update if it actually changed
-            self.search_status = new_status  # Avoids triggering the hook again
-            self.save(update_fields=["search_status"])
+    @hook(AFTER_CREATE)
+    @hook(AFTER_UPDATE, when_any=list(SEARCH_FIELDS), has_changed=True)
+    def update_search_vector(self):
+        Product.refresh_search_vectors(Product.objects.filter(pk=self.pk))
 
     @hook(AFTER_UPDATE, when="qty", was=0, is_now=lambda x: x > 0)
     def set_qty_modified_from_zero(self):
@@ -243,13 +368,159 @@ class Product(
 
     @hook(AFTER_CREATE)
     def set_wholesale_pricing(self):
-        for wholesale_user_type in WholesaleUserType.objects.all():
-            ProductWholesalePricing.objects.create(
-                product=self,
-                wholesale_user_type=wholesale_user_type,
-                price=self.price,
+        ProductWholesalePricing.create_missing(product_id=self.pk)
+
+    @hook(
+        AFTER_UPDATE, when="number_of_keys_to_send_notification", has_changed=True
+    )
+    def reevaluate_stock_band(self):
+        if self.is_key_product:
+            Product.evaluate_stock_bands([self.pk], related_user=get_current_user())
+
+    @classmethod
+    def adjust_keys_stock(cls, product_id, used=0, unused=0, qty=0):
+        """
+        Shift the stored key counters of a product with atomic F() increments,
+        so concurrent checkouts, cancellations and imports never lose an update.
+
+        The catalog cache is not invalidated here, `evaluate_stock_bands` does
+        it when a stock band changes, the exact counts in the cached responses
+        may lag by up to `CatalogCacheMixin.catalog_cache_timeout`.
+        """
+        changes = {
+            "keys_qty": Coalesce(F("keys_qty"), 0) + used + unused,
+            "keys_used_count": F("keys_used_count") + used,
+            "keys_unused_count": F("keys_unused_count") + unused,
+        }
+        if qty:
+            changes["qty"] = F("qty") + qty
+            changes["qty_modified_from_zero"] = Case(
+                When(qty=0, then=Value(timezone.now())),
+                default=F("qty_modified_from_zero"),
+            )
+        cls.objects.filter(pk=product_id).update(**changes)
+
+    @classmethod
+    def adjust_keys_stock_many(cls, deltas):
+        """
+        Shift the key counters of several products with one
+        `UPDATE ... FROM (VALUES ...)`, `deltas` maps the product ids to their
+        `(used, unused)` shifts. Same increments as `adjust_keys_stock`.
+        """
+        deltas = {
+            product_id: (used, unused)
+            for product_id, (used, unused) in deltas.items()
+            if used or unused
+        }
+        if not deltas:
+            return
+        table = connection.ops.quote_name(cls._meta.db_table)
+        values = ", ".join(["(%s::bigint, %s::integer, %s::integer)"] * len(deltas))
+        params = [
+            value
+            for product_id in sorted(deltas)
+            for value in (product_id, *deltas[product_id])
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} AS product
+                SET keys_qty = COALESCE(product.keys_qty, 0)
+                        + delta.used + delta.unused,
+                    keys_used_count = product.keys_used_count + delta.used,
+                    keys_unused_count = product.keys_unused_count + delta.unused
+                FROM (VALUES {values}) AS delta (product_id, used, unused)
+                WHERE product.id = delta.product_id
+                """,
+                params,
             )
 
+    @classmethod
+    def evaluate_stock_bands(cls, product_ids, related_user=None):
+        """
+        Set the stock band (`search_status`) of the products from their stored
+        key counters with one UPDATE ... RETURNING, and notify once per product
+        whose band got worse (Good -> Poor -> Empty).
+
+        Batch operations on keys (orders, cancellations, imports) call this
+        once for all the touched products, so a product that stays in the same
+        band is never notified again. Returns the new band of each product.
+        """
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return {}
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    UPDATE {table} AS product
+                    SET search_status = CASE
+                            WHEN product.keys_unused_count = 0 THEN %s
+                            WHEN product.keys_unused_count
+                                <= product.number_of_keys_to_send_notification
+                                THEN %s
+                            ELSE %s
+                        END,
+                        is_key_product = TRUE
+                    FROM (
+                        SELECT id, search_status FROM {table}
+                        WHERE id = ANY(%s)
+                        ORDER BY id
+                        FOR UPDATE
+                    ) AS previous
+                    WHERE product.id = previous.id
+                    RETURNING product.id, product.name, product.keys_unused_count,
+                        previous.search_status, product.search_status
+                    """,
+                    [
+                        cls.STOCK_BANDS.empty,
+                        cls.STOCK_BANDS.poor,
+                        cls.STOCK_BANDS.good,
+                        product_ids,
+                    ],
+                )
+                rows = cursor.fetchall()
+
+            rank = {band: index for index, (band, _) in enumerate(cls.STOCK_BANDS)}
+            notifications = []
+            for product_id, name, keys_unused, previous, band in rows:
+                if rank[band] <= rank.get(previous, 0):
+                    continue
+                if band == cls.STOCK_BANDS.empty:
+                    description = f"Product {name} is out of keys"
+                    level = Notification.NOTIFICATION_LEVELS.important
+                else:
+                    description = f"Product {name} has only {keys_unused} keys left"
+                    level = Notification.NOTIFICATION_LEVELS.normal
+                notifications.append(
+                    Notification(
+                        linked_model_name="products.Product",
+                        object_id=product_id,
+                        related_user=related_user,
+                        description=description,
+                        notification_level=level,
+                    )
+                )
+            Notification.objects.bulk_create(notifications)
+        if any(previous != band for _, _, _, previous, band in rows):
+            # the band is part of the cached catalog responses
+            bump_catalog_version()
+        return {row[0]: row[4] for row in rows}
+
+    def refresh_keys_stock(self, related_user=None):
+        """
+        Reload the key counters of the product and evaluate its stock band, see
+        `evaluate_stock_bands`.
+        """
+        self.refresh_from_db(
+            fields=[*self.KEYS_STOCK_FIELDS, "qty", "qty_modified_from_zero"]
+        )
+        bands = Product.evaluate_stock_bands([self.pk], related_user=related_user)
+        if self.pk in bands:
+            self.is_key_product = True
+            self.search_status = bands[self.pk]
+
     @property
     def parent_product(self):
         return
@@ -275,6 +546,83 @@ class Product(
             return 0
         return round(self.old_price / config.USD_TO_IQD_EXCHANGE_RATE, 2)
 
+    @classmethod
+    def with_tier_price(cls, queryset, wholesale_type_id):
+        """
+        Annotate `tier_price`, the price of the wholesale tier `wholesale_type_id`
+        (None when the tier has no price for the product), with one subquery.
+        """
+        if wholesale_type_id is None:
+            return queryset
+        return queryset.annotate(
+            tier_price=Subquery(
+                ProductWholesalePricing.objects.filter(
+                    product=OuterRef("pk"), wholesale_user_type_id=wholesale_type_id
+                ).values("price")[:1]
+            )
+        )
+
+    @classmethod
+    def top_sold(cls, queryset, days=None):
+        """
+        Rank the products of `queryset` by sold quantity, of all time from
+        `sold_count` (an index scan) or of the last `days` days from the daily
+        sales rollup. Products without sales are left out.
+        """
+        if days is None:
+            return queryset.filter(sold_count__gt=0).order_by("-sold_count", "id")
+        since = timezone.now().date() - timedelta(days=days - 1)
+        return (
+            queryset.filter(daily_sale__day__gte=since)
+            .annotate(sold_quantity=Sum("daily_sale__quantity"))
+            .filter(sold_quantity__gt=0)
+            .order_by("-sold_quantity", "id")
+        )
+
+    @classmethod
+    def with_first_image(cls, queryset):
+        """
+        Annotate `first_image`, the file name of the first image of the product,
+        with one subquery instead of prefetching all the images.
+        """
+        from products.models.product_image import ProductImage
+
+        return queryset.annotate(
+            first_image=Subquery(
+                ProductImage.objects.filter(product=OuterRef("pk"))
+                .order_by("id")
+                .values("image_file")[:1]
+            )
+        )
+
+    def price_for(self, wholesale_type_id):
+        """
+        Price of the product for a user of the wholesale tier `wholesale_type_id`,
+        the list price for retail users or when the tier has no price.
+        """
+        if wholesale_type_id is None:
+            return self.price
+        if hasattr(self, "tier_price"):
+            tier_price = self.tier_price
+        else:
+            tier_price = (
+                self.wholesale_pricings.filter(wholesale_user_type_id=wholesale_type_id)
+                .values_list("price", flat=True)
+                .first()
+            )
+        return self.price if tier_price is None else tier_price
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.KEYS_STOCK_FIELDS
+                and field.name not in ("search_vector", "sold_count")
+            ]
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
         self.is_deleted = True
         self.save()
@@ -283,10 +631,38 @@ class Product(
         return self.name
 
 
+class ProductKeyQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the keys and take them out of the stock counters of their
+        products with one UPDATE and one stock band evaluation for the whole
+        batch, instead of once per key. The keys are locked first so a
+        concurrent checkout can not use one while it is counted.
+        """
+        with transaction.atomic():
+            keys = list(
+                self.order_by("pk")
+                .select_for_update()
+                .values_list("pk", "product_id", "is_used")
+            )
+            deltas = defaultdict(lambda: (0, 0))
+            for _, product_id, is_used in keys:
+                used, unused = deltas[product_id]
+                deltas[product_id] = (used - is_used, unused - (not is_used))
+            locked = self.model.objects.filter(pk__in=[pk for pk, _, _ in keys])
+            deleted = models.QuerySet.delete(locked)
+            Product.adjust_keys_stock_many(deltas)
+            Product.evaluate_stock_bands(deltas, related_user=get_current_user())
+        return deleted
+
+
 class ProductKey(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
     class Meta:
         verbose_name_plural = "Product Keys"
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["-created", "-id"], name="products_key_keyset_idx"),
+        ]
 
     product = models.ForeignKey(
         "Product",
@@ -321,73 +697,181 @@ class ProductKey(LifecycleModelMixin, TimeStampedModel, UserStampedModel):
         null=True,
     )
 
+    objects = ProductKeyQuerySet.as_manager()
+
     @property
     def order_number(self):
         return self.used_order.order_number if self.used_order else None
 
     @property
     def product_keys_left(self):
-        return ProductKey.objects.filter(product=self.product, is_used=False).count()
+        return self.product.keys_unused_count
+
+    @hook(AFTER_CREATE)
+    def add_to_product_keys_stock(self):
+        Product.adjust_keys_stock(
+            self.product_id,
+            used=int(self.is_used),
+            unused=int(not self.is_used),
+            qty=1,
+        )
 
-    @hook(AFTER_SAVE)
+    @hook(AFTER_UPDATE, when="is_used", has_changed=True)
+    def move_in_product_keys_stock(self):
+        shift = 1 if self.is_used else -1
+        Product.adjust_keys_stock(self.product_id, used=shift, unused=-shift)
+
+    def delete(self, *args, **kwargs):
+        # keep the stock counters right, see ProductKeyQuerySet.delete
+        return ProductKey.objects.filter(pk=self.pk).delete()
+
+    @hook(AFTER_CREATE)
+    @hook(AFTER_UPDATE, when="is_used", has_changed=True)
     def update_product_keys_qty(self):
-        self.product.keys_qty = self.product.product_keys.filter().count()
-        self.product.is_key_product = True
-        self.product.save()
-
-        # if there is no keys left, create important notification
-        if self.product.keys_qty_unused == 0:
-            Notification.objects.create(
-                linked_model_name="products.Product",
-                object_id=self.product.id,
-                related_user=get_current_user(),
-                description=f"Product {self.product.name} is out of keys",
-                notification_level=Notification.NOTIFICATION_LEVELS.important,
+        Product.evaluate_stock_bands(
+            [self.product_id], related_user=get_current_user()
+        )
+
+    @classmethod
+    def reserve(cls, demands, order, used_by=None):
+        """
+        Claim unused keys for `order` in a single UPDATE ... RETURNING round
+        trip, `demands` maps the product ids to the number of keys wanted.
+
+        The candidate rows are picked per product with FOR UPDATE SKIP LOCKED,
+        so concurrent checkouts never wait on each other and never get the same
+        key. The keys are updated in SQL, which skips the per-key save hooks:
+        the caller is responsible for refreshing the product stock once it is
+        done.
+
+        Returns the sorted ids of the claimed keys of each product, which can
+        be fewer than wanted when a product runs out of keys.
+        """
+        demands = {
+            product_id: quantity
+            for product_id, quantity in demands.items()
+            if quantity > 0
+        }
+        if not demands:
+            return {}
+        now = timezone.now()
+        table = connection.ops.quote_name(cls._meta.db_table)
+        values = ", ".join(["(%s::bigint, %s::integer)"] * len(demands))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET is_used = TRUE,
+                    used_at = %s,
+                    used_by_id = %s,
+                    used_order_id = %s,
+                    modified = %s
+                WHERE id IN (
+                    SELECT candidate.id
+                    FROM (VALUES {values}) AS demand (product_id, quantity)
+                    CROSS JOIN LATERAL (
+                        SELECT id FROM {table}
+                        WHERE product_id = demand.product_id AND is_used = FALSE
+                        ORDER BY id
+                        LIMIT demand.quantity
+                        FOR UPDATE SKIP LOCKED
+                    ) AS candidate
+                )
+                RETURNING id, product_id
+                """,
+                [
+                    now,
+                    used_by.pk if used_by else None,
+                    order.pk,
+                    now,
+                    *[
+                        value
+                        for product_id in sorted(demands)
+                        for value in (product_id, demands[product_id])
+                    ],
+                ],
             )
-        # if there is keys left is 5 or less, create normal notification
-        elif (
-            self.product.keys_qty_unused
-            <= self.product.number_of_keys_to_send_notification
-        ):
-            Notification.objects.create(
-                linked_model_name="products.Product",
-                object_id=self.product.id,
-                related_user=get_current_user(),
-                description=f"Product {self.product.name} has only {self.product.keys_qty_unused} keys left",
-                notification_level=Notification.NOTIFICATION_LEVELS.normal,
+            rows = cursor.fetchall()
+        reserved = defaultdict(list)
+        for key_id, product_id in sorted(rows):
+            reserved[product_id].append(key_id)
+        return reserved
+
+    @classmethod
+    def existing_keys(cls, keys, chunk_size=1000):
+        """
+        The subset of `keys` that is already stored, looked up by chunks of
+        `key IN (...)` so the caller can dedupe with a set.
+        """
+        keys = list(keys)
+        existing = set()
+        for start in range(0, len(keys), chunk_size):
+            existing.update(
+                cls.objects.filter(key__in=keys[start : start + chunk_size])
+                .values_list("key", flat=True)
+                .order_by()
             )
-
-    @hook(BEFORE_DELETE)
-    def update_product_keys_qty_on_delete(self):
-        self.product.keys_qty = self.product.product_keys.filter().count()
-        self.product.save()
-
-        # if there is no keys left, create important notification
-        if self.product.keys_qty_unused == 0:
-            Notification.objects.create(
-                linked_model_name="products.Product",
-                object_id=self.product.id,
-                description=f"Product {self.product.name} is out of keys",
-                notification_level=Notification.NOTIFICATION_LEVELS.important,
+        return existing
+
+    @classmethod
+    def import_keys(cls, product, keys, batch_size=1000, user=None, progress=None):
+        """
+        Add the `keys` iterable to `product` by chunks of `batch_size`.
+
+        Blank keys, keys repeated in the input and keys already stored are
+        skipped. Every chunk is deduped with one query and saved with one
+        `bulk_create`, which skips the per-key save hooks, so the product stock
+        is adjusted and refreshed once at the end: at most one stock
+        notification is sent. `progress` is called with the stats after every
+        chunk.
+
+        Returns the stats: `rows`, `created`, `duplicates`, `blank`, `seconds`
+        and `rows_per_second`.
+        """
+        stats = {"rows": 0, "created": 0, "duplicates": 0, "blank": 0}
+        start = time.perf_counter()
+        seen = set()
+
+        def save(chunk):
+            existing = cls.existing_keys(chunk, chunk_size=batch_size)
+            new_keys = [key for key in chunk if key not in existing]
+            stats["duplicates"] += len(chunk) - len(new_keys)
+            cls.objects.bulk_create(
+                [
+                    cls(product=product, key=key, created_by=user, updated_by=user)
+                    for key in new_keys
+                ],
+                batch_size=batch_size,
             )
-        # if there is keys left is 5 or less, create normal notification
-        elif (
-            self.product.keys_qty_unused
-            <= self.product.number_of_keys_to_send_notification
-        ):
-            Notification.objects.create(
-                linked_model_name="products.Product",
-                object_id=self.product.id,
-                description=f"Product {self.product.name} has only {self.product.keys_qty_unused} keys left",
-                notification_level=Notification.NOTIFICATION_LEVELS.normal,
+            stats["created"] += len(new_keys)
+            stats["seconds"] = time.perf_counter() - start
+            stats["rows_per_second"] = stats["rows"] / (stats["seconds"] or 1)
+            if progress:
+                progress(stats)
+
+        chunk = []
+        for key in keys:
+            stats["rows"] += 1
+            key = (key or "").strip()
+            if not key:
+                stats["blank"] += 1
+                continue
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            chunk.append(key)
+            if len(chunk) == batch_size:
+                save(chunk)
+                chunk = []
+        save(chunk)
+
+        if stats["created"]:
+            Product.adjust_keys_stock(
+                product.pk, unused=stats["created"], qty=stats["created"]
             )
-
-    def save(self, *args, **kwargs):
-        # add to qty if key is new
-        if not self.pk:
-            self.product.qty += 1
-
-        super().save(*args, **kwargs)
+            product.refresh_keys_stock(related_user=user)
+        return stats
 
     def __str__(self):
         return f"{self.product.name} - {self.key} - {'Used' if self.is_used else 'Not Used'}"
@@ -0,0 +1,77 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+
+# text search configurations of the english and arabic product texts
+ENGLISH_CONFIG = "english"
+ARABIC_CONFIG = "arabic"
+
+
+def product_search_vector(category_name=""):
+    """
+    Search document of a product: the names weigh more than the category and
+    the descriptions. `category_name` is passed as a value because an UPDATE
+    can not join the category table.
+    """
+    return (
+        SearchVector("name", weight="A", config=ENGLISH_CONFIG)
+        + SearchVector("name_ar", weight="A", config=ARABIC_CONFIG)
+        + SearchVector(Value(category_name), weight="B", config=ENGLISH_CONFIG)
+        + SearchVector("description", weight="C", config=ENGLISH_CONFIG)
+        + SearchVector("description_ar", weight="C", config=ARABIC_CONFIG)
+    )
+
+
+class PostgresProductSearchBackend:
+    """
+    Ranked full text search over `Product.search_vector`, with trigram word
+    similarity on the names for partial words and typos. Both are served by
+    GIN indexes.
+    """
+
+    def search(self, queryset, search, ordered=True):
+        query = SearchQuery(
+            search, search_type="websearch", config=ENGLISH_CONFIG
+        ) | SearchQuery(search, search_type="websearch", config=ARABIC_CONFIG)
+        queryset = queryset.filter(
+            Q(search_vector=query)
+            | Q(name__trigram_word_similar=search)
+            | Q(name_ar__trigram_word_similar=search)
+        )
+        if not ordered:
+            return queryset
+        return queryset.annotate(
+            search_rank=SearchRank(F("search_vector"), query),
+            search_similarity=Greatest(
+                TrigramWordSimilarity(search, "name"),
+                TrigramWordSimilarity(search, "name_ar"),
+            ),
+        ).order_by("-search_rank", "-search_similarity", "-id")
+
+
+class FallbackProductSearchBackend:
+    """
+    Plain `icontains` search for the databases without full text search
+    (sqlite in local tests).
+    """
+
+    def search(self, queryset, search, ordered=True):
+        return queryset.filter(
+            Q(name__icontains=search)
+            | Q(name_ar__icontains=search)
+            | Q(category__name__icontains=search)
+            | Q(description__icontains=search)
+            | Q(description_ar__icontains=search)
+        )
+
+
+def get_product_search_backend():
+    if connection.vendor == "postgresql":
+        return PostgresProductSearchBackend()
+    return FallbackProductSearchBackend()
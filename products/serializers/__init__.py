@@ -9,6 +9,7 @@ from .product import (
     KeyUsersCountSerializer,
     KeyValiditySerializer,
     ProductImageSerializer,
+    ProductCardSerializer,
     ProductKeySerializer,
     ProductOptionSerializer,
     ProductSectionSerializer,
@@ -5,6 +5,7 @@ from crum import get_current_user
 from rest_framework import serializers
 from rest_framework.utils import model_meta
 from django.db import transaction
+from django.db.models import Prefetch
 
 
 from core.serializer_fields import (
@@ -12,7 +13,7 @@ from core.serializer_fields import (
     RecursiveField,
     RelatedObjectSerializerField,
 )
-from core.utils import NoUpdateMixin
+from core.utils import NoUpdateMixin, SparseFieldsetsMixin
 from products.models import (
     KeyUsersCount,
     KeyValidity,
@@ -137,7 +138,99 @@ class NestedProductWholesalePricingSerializer(serializers.ModelSerializer):
         )
 
 
-class ProductSerializer(NoUpdateMixin, serializers.ModelSerializer):
+class ProductPriceFieldsMixin(serializers.Serializer):
+    """
+    Read only prices of a product in the tier of the current user.
+    """
+
+    price_readonly = serializers.SerializerMethodField()
+    price_in_usd_readonly = serializers.SerializerMethodField()
+    old_price_in_usd = serializers.SerializerMethodField()
+
+    @property
+    def usd_exchange_rate(self):
+        # read the rate once per serializer, not once per product
+        if not hasattr(self, "_usd_exchange_rate"):
+            self._usd_exchange_rate = config.USD_TO_IQD_EXCHANGE_RATE
+        return self._usd_exchange_rate
+
+    def to_usd(self, price):
+        if not price:
+            return 0
+        return round(price / self.usd_exchange_rate, 2)
+
+    def get_price_readonly(self, obj):
+        user = get_current_user()
+        if user and user.is_authenticated:
+            return obj.price_for(user.wholesale_type_id)
+        return obj.price
+
+    def get_price_in_usd_readonly(self, obj):
+        return self.to_usd(self.get_price_readonly(obj))
+
+    def get_old_price_in_usd(self, obj):
+        return self.to_usd(obj.old_price)
+
+
+class ProductCardSerializer(ProductPriceFieldsMixin, serializers.ModelSerializer):
+    """
+    Slim product of the product lists, it never touches the keys, options or
+    pricing tables: the tier price and the first image are annotated by
+    `Product.with_tier_price` and `Product.with_first_image`.
+    """
+
+    image = serializers.SerializerMethodField()
+    category_name = serializers.CharField(source="category.name", read_only=True)
+    category_name_ar = serializers.CharField(
+        source="category.name_ar", read_only=True
+    )
+
+    class Meta:
+        model = Product
+        fields = (
+            "id",
+            "name",
+            "name_ar",
+            "price_readonly",
+            "price_in_usd_readonly",
+            "old_price",
+            "old_price_in_usd",
+            "image",
+            "tag",
+            "color",
+            "available",
+            "is_discounted",
+            "is_special_offer",
+            "has_options",
+            "category",
+            "category_name",
+            "category_name_ar",
+            "search_status",
+        )
+        read_only_fields = fields
+
+    def get_image(self, obj):
+        name = getattr(obj, "first_image", None)
+        if name is None:
+            image = obj.images.first()
+            name = image.image_file.name if image else None
+        if not name:
+            return None
+        url = ProductImage._meta.get_field("image_file").storage.url(name)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return Product.with_first_image(queryset.select_related("category"))
+
+
+class ProductSerializer(
+    ProductPriceFieldsMixin,
+    SparseFieldsetsMixin,
+    NoUpdateMixin,
+    serializers.ModelSerializer,
+):
     category_name = serializers.CharField(
         source="category.name", read_only=True)
     category_name_ar = serializers.CharField(
@@ -181,8 +274,6 @@ class ProductSerializer(NoUpdateMixin, serializers.ModelSerializer):
     )
 
     # Read only fields
-    price_readonly = serializers.SerializerMethodField()
-    price_in_usd_readonly = serializers.SerializerMethodField()
     options_readonly = serializers.SerializerMethodField()
 
     class Meta:
@@ -273,45 +364,78 @@ class ProductSerializer(NoUpdateMixin, serializers.ModelSerializer):
             "options",
             "product_keys",
         )
-
-    def get_price_readonly(self, obj):
-        user = get_current_user()
-        if user.is_authenticated:
-            return (
-                obj.wholesale_pricings.filter(
-                    wholesale_user_type=user.wholesale_type)
-                .first()
-                .price
-                # first check if there is a user and if the user has a wholesale type
-                if user and user.wholesale_type is not None
-                else obj.price
-            )
-        return obj.price
-
-    def get_price_in_usd_readonly(self, obj):
-        user = get_current_user()
-        if user.is_authenticated:
-            return (
-                round(
-                    obj.wholesale_pricings.filter(
-                        wholesale_user_type=user.wholesale_type)
-                    .first()
-                    .price
-                    / config.USD_TO_IQD_EXCHANGE_RATE,
-                    2,
-                )
-                if user.is_authenticated and user.wholesale_type is not None
-                else obj.price_in_usd
+        # left out of the lists unless asked with `?expand=`
+        expandable_fields = (
+            "product_keys",
+            "wholesale_pricings",
+            "options_readonly",
+            "sections",
+            "offer_products",
+        )
+        # never serialized for the non staff users, whatever they ask
+        staff_only_fields = ("product_keys", "wholesale_pricings")
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None, is_staff=False):
+        """
+        Load the relations of the serialized `fields` (all when None) with
+        `select_related` and `prefetch_related`, the keys and the wholesale
+        pricings are only shown to the staff.
+        """
+
+        def wanted(name):
+            return fields is None or name in fields
+
+        options = ProductOption.objects.select_related(
+            "keys_users_count", "keys_validity"
+        )
+        prefetches = {
+            "images": ["images"],
+            "sections": ["sections"],
+            "offer_products": ["offer_products"],
+            "options_readonly": [
+                Prefetch("options", queryset=options),
+                Prefetch(
+                    "option_of",
+                    queryset=ProductOption.objects.select_related("parent_product"),
+                ),
+                Prefetch("option_of__parent_product__options", queryset=options),
+            ],
+        }
+        if is_staff:
+            prefetches["product_keys"] = ["product_keys"]
+            prefetches["wholesale_pricings"] = ["wholesale_pricings"]
+
+        related = [
+            name
+            for name in (
+                "category",
+                "sub_category",
+                "company",
+                "keys_users_count",
+                "keys_validity",
             )
-        return obj.price_in_usd
+            if fields is None
+            or any(field.startswith(name) for field in fields)
+        ]
+        lookups = [
+            lookup
+            for name, name_lookups in prefetches.items()
+            if wanted(name)
+            for lookup in name_lookups
+        ]
+        return queryset.select_related(*related).prefetch_related(*lookups)
 
     def get_options_readonly(self, obj):
         if obj.has_options:
             return NestedProductOptionSerializer(obj.options.all(), many=True).data
-        elif obj.is_option_product and obj.option_of.exists():
-            return NestedProductOptionSerializer(
-                obj.option_of.first().parent_product.options.all(), many=True
-            ).data
+        elif obj.is_option_product:
+            # `all()` reuses the prefetched options of setup_eager_loading
+            option_of = obj.option_of.all()
+            if option_of:
+                return NestedProductOptionSerializer(
+                    option_of[0].parent_product.options.all(), many=True
+                ).data
         return []
 
     def validate(self, data):
@@ -367,9 +491,9 @@ class ProductSerializer(NoUpdateMixin, serializers.ModelSerializer):
 
         user = get_current_user()
         if not user.is_staff:
-            res.pop("product_keys")
-            res.pop("wholesale_pricings")
-            res.pop("number_of_keys_to_send_notification")
+            res.pop("product_keys", None)
+            res.pop("wholesale_pricings", None)
+            res.pop("number_of_keys_to_send_notification", None)
 
         # return the modified representation
         return res
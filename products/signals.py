@@ -1,3 +1,64 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.cache import bump_catalog_version
+from products.models import (
+    Category,
+    CategorySlider,
+    Company,
+    KeyUsersCount,
+    KeyValidity,
+    Product,
+    ProductImage,
+    ProductOption,
+    ProductSection,
+    ProductWholesalePricing,
+    Slider,
+    SpecialOffer,
+    SubCategory,
+    SubCategorySlider,
+)
+
+# models shown by the cached catalog endpoints (see core.cache.CatalogCacheMixin)
+CATALOG_MODELS = (
+    Category,
+    CategorySlider,
+    Company,
+    KeyUsersCount,
+    KeyValidity,
+    Product,
+    ProductImage,
+    ProductOption,
+    ProductSection,
+    ProductWholesalePricing,
+    Slider,
+    SpecialOffer,
+    SubCategory,
+    SubCategorySlider,
+)
+
+
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_save_{model.__name__}")
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_delete_{model.__name__}")
+m2m_changed.connect(
+    catalog_changed,
+    sender=Product.offer_products.through,
+    dispatch_uid="catalog_offer_products",
+)
+
+
+# the category name is part of the products search document
+@receiver(post_save, sender=Category)
+def refresh_category_products_search(sender, instance, created, **kwargs):
+    if not created:
+        Product.refresh_search_vectors(instance.products.all())
+
+
 # from django.db.models.signals import m2m_changed
 # from django.dispatch import receiver
 
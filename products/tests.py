@@ -0,0 +1,71 @@
+from django.contrib import admin
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from authentication.models import User
+from products.models import Category, Product, ProductKey, SubCategory
+
+
+class ProductKeyDeleteTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Games", name_ar="Games")
+        sub_category = SubCategory.objects.create(
+            name="Cards", name_ar="Cards", category=category
+        )
+        self.product = Product.objects.create(
+            name="Card",
+            name_ar="Card",
+            price=1000,
+            SKU_code="SKU",
+            category=category,
+            sub_category=sub_category,
+            is_key_product=True,
+        )
+
+    def add_keys(self, count, used=0):
+        ProductKey.objects.bulk_create(
+            ProductKey(product=self.product, key=f"KEY-{n}", is_used=n < used)
+            for n in range(count)
+        )
+        Product.adjust_keys_stock(self.product.pk, used=used, unused=count - used)
+
+    def keys_ids(self):
+        return list(
+            ProductKey.objects.filter(product=self.product).values_list("pk", flat=True)
+        )
+
+    def assert_counters(self, used, unused):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.keys_used_count, used)
+        self.assertEqual(self.product.keys_unused_count, unused)
+        self.assertEqual(self.product.keys_qty, used + unused)
+
+    def test_bulk_delete_queries_do_not_grow_with_the_keys(self):
+        self.add_keys(200, used=50)
+        keys = ProductKey.objects.filter(pk__in=self.keys_ids()[:10])
+        with CaptureQueriesContext(connection) as ten_keys:
+            keys.delete()
+        self.assert_counters(used=40, unused=150)
+
+        keys = ProductKey.objects.filter(pk__in=self.keys_ids()[:100])
+        with self.assertNumQueries(len(ten_keys)):
+            deleted, _ = keys.delete()
+        self.assertEqual(deleted, 100)
+        self.assert_counters(used=0, unused=90)
+
+    def test_deleting_some_keys_keeps_the_rest_counted(self):
+        self.add_keys(10, used=4)
+        ProductKey.objects.filter(key__in=["KEY-0", "KEY-9"]).delete()
+        self.assert_counters(used=3, unused=5)
+        ProductKey.objects.get(key="KEY-8").delete()
+        self.assert_counters(used=3, unused=4)
+
+    def test_admin_delete_selected_adjusts_the_counters(self):
+        self.add_keys(10, used=4)
+        request = RequestFactory().post("/")
+        request.user = User.objects.create(username="staff", is_staff=True)
+        admin.site._registry[ProductKey].delete_queryset(
+            request, ProductKey.objects.filter(is_used=False)
+        )
+        self.assert_counters(used=4, unused=0)
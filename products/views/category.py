@@ -1,13 +1,25 @@
+from collections import defaultdict
+
+from django.db.models import Count, Prefetch
 from django.utils.decorators import method_decorator
 from django_filters import rest_framework as django_filters_rest_framework
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import filters, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
+from core.cache import CatalogCacheMixin
 from core.permissions import IsAdminUserOrReadOnly
 from core.utils import StandardLimitOffsetPagination
 from products.filters import CategoryFilter, SubCategoryFilter
-from products.models import Category, CategorySlider, SubCategory, SubCategorySlider
+from products.models import (
+    Category,
+    CategorySlider,
+    Product,
+    SubCategory,
+    SubCategorySlider,
+)
 from products.serializers import (
     CategorySerializer,
     CategorySliderSerializer,
@@ -44,9 +56,17 @@ from products.serializers import (
         ],
     ),
 )
-class CategoryViews(viewsets.ModelViewSet):
+class CategoryViews(CatalogCacheMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
-    queryset = Category.objects.exclude(is_deleted=True)
+    queryset = Category.objects.exclude(is_deleted=True).prefetch_related(
+        "category_slider_items",
+        Prefetch(
+            "sub_categories",
+            queryset=SubCategory.objects.exclude(is_deleted=True).prefetch_related(
+                "sub_category_slider_items"
+            ),
+        ),
+    )
     serializer_class = CategorySerializer
     model_object = Category
     pagination_class = StandardLimitOffsetPagination
@@ -62,8 +82,85 @@ class CategoryViews(viewsets.ModelViewSet):
     filterset_class = CategoryFilter
     ordering_fields = "__all__"
 
+    @swagger_auto_schema(
+        operation_description="Categories with their sub categories, sliders and number of active products, for the navigation menu",
+        responses={200: "Category tree"},
+    )
+    @action(detail=False, methods=["get"], pagination_class=None, filter_backends=[])
+    def tree(self, request, *args, **kwargs):
+        return self.cached_response(self.build_tree, request, *args, **kwargs)
+
+    def build_tree(self, request, *args, **kwargs):
+        """
+        Assemble the tree from one query per table, whatever the number of
+        categories.
+        """
+
+        def file_url(file):
+            return request.build_absolute_uri(file.url) if file else None
+
+        def slider(item):
+            return {"id": item.id, "path": item.path, "image": file_url(item.image)}
+
+        counts = Product.objects.filter(status=Product.STATUS.active).exclude(
+            is_deleted=True
+        )
+        category_counts = dict(
+            counts.order_by()
+            .values_list("category")
+            .annotate(count=Count("id"))
+        )
+        sub_category_counts = dict(
+            counts.filter(sub_category__isnull=False)
+            .order_by()
+            .values_list("sub_category")
+            .annotate(count=Count("id"))
+        )
+
+        category_sliders = defaultdict(list)
+        for item in CategorySlider.objects.filter(category__is_deleted=False):
+            category_sliders[item.category_id].append(slider(item))
+        sub_category_sliders = defaultdict(list)
+        for item in SubCategorySlider.objects.filter(
+            sub_category__is_deleted=False
+        ):
+            sub_category_sliders[item.sub_category_id].append(slider(item))
+
+        sub_categories = defaultdict(list)
+        for sub_category in SubCategory.objects.filter(
+            is_deleted=False, category__is_deleted=False
+        ):
+            sub_categories[sub_category.category_id].append(
+                {
+                    "id": sub_category.id,
+                    "seq": sub_category.seq,
+                    "name": sub_category.name,
+                    "name_ar": sub_category.name_ar,
+                    "image_file": file_url(sub_category.image_file),
+                    "products_count": sub_category_counts.get(sub_category.id, 0),
+                    "sub_category_slider_items": sub_category_sliders[
+                        sub_category.id
+                    ],
+                }
+            )
+
+        tree = [
+            {
+                "id": category.id,
+                "seq": category.seq,
+                "name": category.name,
+                "name_ar": category.name_ar,
+                "image_file": file_url(category.image_file),
+                "products_count": category_counts.get(category.id, 0),
+                "category_slider_items": category_sliders[category.id],
+                "sub_categories": sub_categories[category.id],
+            }
+            for category in Category.objects.filter(is_deleted=False)
+        ]
+        return Response(tree)
+
 
-class CategorySliderViews(viewsets.ModelViewSet):
+class CategorySliderViews(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = CategorySlider.objects.all()
     serializer_class = CategorySliderSerializer
     permission_classes = [IsAdminUserOrReadOnly]
@@ -98,9 +195,13 @@ class CategorySliderViews(viewsets.ModelViewSet):
         ],
     ),
 )
-class SubCategoryViews(viewsets.ModelViewSet):
+class SubCategoryViews(CatalogCacheMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
-    queryset = SubCategory.objects.exclude(is_deleted=True)
+    queryset = (
+        SubCategory.objects.exclude(is_deleted=True)
+        .select_related("category")
+        .prefetch_related("sub_category_slider_items")
+    )
     serializer_class = SubCategorySerializer
     model_object = SubCategory
     pagination_class = StandardLimitOffsetPagination
@@ -119,7 +220,7 @@ class SubCategoryViews(viewsets.ModelViewSet):
     ordering_fields = "__all__"
 
 
-class SubCategorySliderViews(viewsets.ModelViewSet):
+class SubCategorySliderViews(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = SubCategorySlider.objects.all()
     serializer_class = SubCategorySliderSerializer
     permission_classes = [IsAdminUserOrReadOnly]
@@ -1,6 +1,7 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, viewsets
 
+from core.cache import CatalogCacheMixin
 from core.permissions import IsAdminUserOrReadOnly
 from core.utils import StandardLimitOffsetPagination
 from products.filters import CompanyFilter
@@ -14,7 +15,7 @@ from core.permissions import IsAdminUser, IsAdminUserOrReadOnly
 
 
 
-class CompanyViews(viewsets.ModelViewSet):
+class CompanyViews(CatalogCacheMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
     queryset = Company.objects.exclude(is_deleted=True)
     serializer_class = CompanySerializer
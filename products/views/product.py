@@ -10,12 +10,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils.dateparse import parse_date
 from rest_framework import exceptions as drf_exceptions
-from django.db.models import Sum, Case, When
-from orders.models import OrderLine
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
 
 
+from core.cache import CatalogCacheMixin
+from core.export import StreamingExportMixin
 from core.permissions import IsAdminUser, IsAdminUserOrReadOnly
-from core.utils import StandardLimitOffsetPagination
+from core.utils import (
+    StandardKeysetPagination,
+    StandardLimitOffsetPagination,
+    get_sparse_fieldsets,
+)
 from products.filters import ProductCustomFilterBackend, ProductFilter
 from products.models import (
     KeyUsersCount,
@@ -31,6 +37,7 @@ from products.models import (
 from products.serializers import (
     KeyUsersCountSerializer,
     KeyValiditySerializer,
+    ProductCardSerializer,
     ProductImageSerializer,
     ProductKeySerializer,
     ProductOptionSerializer,
@@ -41,6 +48,11 @@ from products.serializers import (
 )
 from products.stats import ProductStats
 
+# (days) of the top sold windows, None is all time
+TOP_SOLD_WINDOWS = {"7d": 7, "30d": 30, "all": None}
+# the storefront ranking can lag behind the orders by this many seconds
+TOP_SOLD_PRODUCTS_CACHE_TIMEOUT = 60 * 5
+
 
 @method_decorator(
     name="list",
@@ -70,10 +82,22 @@ from products.stats import ProductStats
                 description="Filter products by status",
                 type=openapi.TYPE_STRING,
             ),
+            openapi.Parameter(
+                "fields",
+                openapi.IN_QUERY,
+                description="Comma separated product fields to return instead of the product cards",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "expand",
+                openapi.IN_QUERY,
+                description="Comma separated nested fields (product_keys, wholesale_pricings, options_readonly, sections, offer_products) to add to the full products instead of the product cards",
+                type=openapi.TYPE_STRING,
+            ),
         ],
     ),
 )
-class ProductViews(viewsets.ModelViewSet):
+class ProductViews(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Product.objects.order_by(
         Coalesce("qty_modified_from_zero", "created").desc(nulls_last=True)
     ).exclude(is_deleted=True)
@@ -81,63 +105,117 @@ class ProductViews(viewsets.ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
     model_object = Product
     pagination_class = StandardLimitOffsetPagination
+    # the `search` parameter is handled by ProductCustomFilterBackend
     filter_backends = [
-        filters.SearchFilter,
         filters.OrderingFilter,
         ProductCustomFilterBackend,
         django_filters_rest_framework.DjangoFilterBackend,
     ]
-    search_fields = [
-        "name",
-        "qty",
-        "price",
-        "old_price",
-        "search_status",
-        "created",
-        "category__name",
-    ]
     filterset_class = ProductFilter
+    list_actions = ("list", "top_sold_products")
+
+    def get_wholesale_type_id(self):
+        return getattr(self.request.user, "wholesale_type_id", None)
+
+    def use_product_cards(self):
+        """
+        Lists return the slim product cards unless sparse fieldsets are asked.
+        """
+        only, expand = get_sparse_fieldsets(self.request)
+        return self.action in self.list_actions and not only and not expand
+
+    def get_serializer_class(self):
+        if self.use_product_cards():
+            return ProductCardSerializer
+        return ProductSerializer
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Product.objects.all().exclude(is_deleted=True).order_by("created")
-        return Product.objects.filter(status=Product.STATUS.active).exclude(is_deleted=True).order_by("created")
+            queryset = Product.objects.all().exclude(is_deleted=True).order_by("created")
+        else:
+            queryset = Product.objects.filter(status=Product.STATUS.active).exclude(is_deleted=True).order_by("created")
+        queryset = Product.with_tier_price(queryset, self.get_wholesale_type_id())
+        if self.action not in self.list_actions:
+            return queryset
+        if self.use_product_cards():
+            return ProductCardSerializer.setup_eager_loading(queryset)
+        only, expand = get_sparse_fieldsets(self.request)
+        fields = only or (
+            set(ProductSerializer.Meta.fields)
+            - (set(ProductSerializer.Meta.expandable_fields) - expand)
+        )
+        return ProductSerializer.setup_eager_loading(
+            queryset, fields=fields, is_staff=self.request.user.is_staff
+        )
 
     def retrieve(self, request, *args, **kwargs):
-        instance = Product.objects.get(pk=kwargs['pk'])
+        return self.cached_response(self.retrieve_product, request, *args, **kwargs)
+
+    def retrieve_product(self, request, *args, **kwargs):
+        only, _ = get_sparse_fieldsets(request)
+        instance = ProductSerializer.setup_eager_loading(
+            Product.with_tier_price(Product.objects.all(), self.get_wholesale_type_id()),
+            fields=only or None,
+            is_staff=request.user.is_staff,
+        ).get(pk=kwargs['pk'])
         if (instance.status != Product.STATUS.active or instance.is_deleted) and not request.user.is_staff:
             return Response(status=404)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @swagger_auto_schema(
+        operation_description="Best selling active products, as product cards unless `fields` or `expand` are passed",
+        manual_parameters=[
+            openapi.Parameter(
+                "window",
+                openapi.IN_QUERY,
+                description="Sales window: 7d, 30d or all (default)",
+                type=openapi.TYPE_STRING,
+                enum=list(TOP_SOLD_WINDOWS),
+            ),
+            openapi.Parameter(
+                "limit",
+                openapi.IN_QUERY,
+                description="Number of products (default 10, max 50)",
+                type=openapi.TYPE_INTEGER,
+            ),
+        ],
+    )
     @action(detail=False, methods=["get"], url_path="top-sold")
     def top_sold_products(self, request):
-        # Step 1: Aggregate top sold product IDs with their total sold quantity
-        top_product_data = (
-            OrderLine.objects
-            .values("product_id")
-            .annotate(total_sold=Sum("quantity"))
-            .order_by("-total_sold")
-        )
-
-        # Step 2: Filter to only active products
-        active_products = Product.objects.filter(status="active")
-        active_product_ids = set(active_products.values_list("id", flat=True))
-
-        # Step 3: Filter the top products to include only active ones and take top 10
-        filtered_top_ids = [item["product_id"]
-                            for item in top_product_data if item["product_id"] in active_product_ids][:10]
+        window = request.query_params.get("window", "all")
+        if window not in TOP_SOLD_WINDOWS:
+            raise drf_exceptions.ValidationError(
+                {"window": f"Must be one of {', '.join(TOP_SOLD_WINDOWS)}."}
+            )
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            raise drf_exceptions.ValidationError({"limit": "Must be a number."})
+
+        # the ranking is the same for everybody, only the prices differ
+        cache_key = f"products:top_sold:{window}:{limit}"
+        product_ids = cache.get(cache_key)
+        if product_ids is None:
+            ranked = Product.top_sold(
+                Product.objects.filter(status=Product.STATUS.active).exclude(
+                    is_deleted=True
+                ),
+                days=TOP_SOLD_WINDOWS[window],
+            )
+            product_ids = list(ranked.values_list("id", flat=True)[:limit])
+            cache.set(cache_key, product_ids, TOP_SOLD_PRODUCTS_CACHE_TIMEOUT)
 
-        # Step 4: Fetch those products and preserve ordering
-        preserved_order = Case(
-            *[When(id=pk, then=pos) for pos, pk in enumerate(filtered_top_ids)]
+        products = self.get_queryset().in_bulk(product_ids)
+        serializer = self.get_serializer(
+            [products[pk] for pk in product_ids if pk in products], many=True
         )
-        products = Product.objects.filter(
-            id__in=filtered_top_ids).order_by(preserved_order)
-
-        # Step 5: Serialize
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        patch_cache_control(
+            response, private=True, max_age=TOP_SOLD_PRODUCTS_CACHE_TIMEOUT
+        )
+        patch_vary_headers(response, ["Authorization", "Cookie"])
+        return response
 
     @swagger_auto_schema(
         operation_description="Get stats for products",
@@ -272,17 +350,29 @@ class ProductOptionViews(viewsets.ModelViewSet):
     pagination_class = StandardLimitOffsetPagination
 
 
-class ProductKeyViews(viewsets.ModelViewSet):
-    queryset = ProductKey.objects.all()
+class ProductKeyViews(StreamingExportMixin, viewsets.ModelViewSet):
+    queryset = ProductKey.objects.select_related("product")
     serializer_class = ProductKeySerializer
     permission_classes = [IsAdminUser]
-    pagination_class = StandardLimitOffsetPagination
+    pagination_class = StandardKeysetPagination
     filter_backends = [
         filters.SearchFilter,
         filters.OrderingFilter,
         django_filters_rest_framework.DjangoFilterBackend,
     ]
     search_fields = ["key"]
+    export_filename = "product-keys"
+    export_fields = (
+        ("ID", "id"),
+        ("Product", "product__name"),
+        ("Key", "key"),
+        ("Used", "is_used"),
+        ("Viewed", "is_viewed"),
+        ("Used At", "used_at"),
+        ("Used By", "used_by__username"),
+        ("Order Number", "used_order__order_number"),
+        ("Created", "created"),
+    )
 
 
 class ProductWholesalePricingViews(viewsets.ModelViewSet):
@@ -292,7 +382,7 @@ class ProductWholesalePricingViews(viewsets.ModelViewSet):
     pagination_class = StandardLimitOffsetPagination
 
 
-class SpecialOfferViews(viewsets.ModelViewSet):
+class SpecialOfferViews(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = SpecialOffer.objects.all()
     serializer_class = SpecialOfferSerializer
     permission_classes = [IsAdminUser]
@@ -1,12 +1,13 @@
 from rest_framework import viewsets
 
+from core.cache import CatalogCacheMixin
 from core.permissions import IsAdminUserOrReadOnly
 from core.utils import StandardLimitOffsetPagination
 from products.models import Slider
 from products.serializers import SliderSerializer
 
 
-class SliderViews(viewsets.ModelViewSet):
+class SliderViews(CatalogCacheMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminUserOrReadOnly]
     queryset = Slider.objects.all()
     serializer_class = SliderSerializer